@@ -1,32 +1,110 @@
+import base64
+import calendar
+import json
+from datetime import datetime, timedelta, timezone
+
 import frappe
 from frappe import _
+from frappe.auth import LoginManager
 from frappe.exceptions import DoesNotExistError, ValidationError
-from frappe.utils import get_datetime
-from hrms.hr.utils import get_distance_between_coordinates, validate_active_employee
+from frappe.utils import get_datetime, getdate
+from frappe.utils.password import set_encrypted_password
 from hrms.hr.doctype.employee_checkin.employee_checkin import CheckinRadiusExceededError
-import base64
-from frappe.utils.file_manager import save_file
-from frappe.auth import LoginManager
-import json
+from hrms.hr.utils import get_distance_between_coordinates, validate_active_employee
+
+from frappe_mobile_application import (
+	checkin_sync,
+	deferred_photos,
+	diagnostics,
+	geofence,
+	idempotency,
+	metrics,
+	photo_processing,
+	photo_storage,
+	punch_queue,
+	rate_limits,
+)
+from frappe_mobile_application.employee_settings import get_employee_for_user, get_employee_settings
+from frappe_mobile_application.photo_storage import PHOTO_CUSTOM_FIELDS, PHOTO_FILE_MARKERS
+from frappe_mobile_application.responses import (
+	encoded_response,
+	etag_matches,
+	get_request,
+	get_request_header,
+	json_response,
+	not_modified_response,
+	text_response,
+)
+
+# Maximum number of punches accepted by one sync_offline_punches call
+MAX_SYNC_BATCH_SIZE = 100
+
+# Employee Checkin date column of mobile punches, and the unique key enforcing one IN and
+# one OUT per employee per date on it (see db_indexes.UNIQUE_KEYS)
+PUNCH_DATE_FIELD = "custom_punch_date"
+PUNCH_DATE_UNIQUE_KEY = "unique_employee_punch_date_log_type"
+
+# Views of get_employee_checkin_records: "summary" reads SUMMARY_CHECKIN_FIELDS only, which
+# the (employee, log_type, time) index covers, and skips photo lookups
+HISTORY_VIEWS = ("full", "summary")
+SUMMARY_CHECKIN_FIELDS = ["name", "log_type", "time"]
+# Row layout of the compact summary view
+SUMMARY_CHECKIN_COLUMNS = ("checkin_id", "log_type", "time")
+
+# Row layout of the compact history format (response_format="compact")
+COMPACT_CHECKIN_COLUMNS = (
+	"checkin_id",
+	"log_type",
+	"time",
+	"latitude",
+	"longitude",
+	"device_id",
+	"shift",
+	"shift_start",
+	"shift_end",
+	"attendance",
+	"skip_auto_attendance",
+	"location_photo_id",
+	"location_photo_url",
+	"location_photo_full_url",
+	"client_biometric_photo_id",
+	"client_biometric_photo_url",
+	"client_biometric_photo_full_url",
+)
+
+# Records returned per sync_employee_checkin_records call
+DEFAULT_SYNC_LIMIT = 200
+MAX_SYNC_LIMIT = 500
+# Rows modified within the last few seconds are left for the next sync, so a transaction
+# that commits after the sync ran (with an earlier modified time) is not skipped. Batch
+# inserts set modified again just before they commit (see checkin_sync.touch_on_commit),
+# so this only has to cover a single commit.
+SYNC_LAG_SECONDS = 5
 
 
 @frappe.whitelist(allow_guest=True)
-def mobile_login(usr=None, pwd=None, has_existing_token=False):
+@metrics.instrument
+def mobile_login(usr=None, pwd=None, has_existing_token=False, token_only=False):
 	"""
 	Mobile app login endpoint with API credential generation.
-	
+
 	This endpoint:
 	1. Authenticates user using standard ERPNext login
 	2. Generates API credentials if needed (based on has_existing_token flag)
 	3. Returns login response with API credentials
-	
+
+	In token-only mode no desk session is created (``sid`` is null) and the API secret
+	is rotated with a direct encrypted-password update instead of saving the User, so a
+	login costs a fraction of the database writes. The token is then the only credential.
+
 	Args:
 		usr (str, required): ERPNext username
 		pwd (str, required): ERPNext password
-		has_existing_token (bool, optional): 
+		has_existing_token (bool, optional):
 			- False: Generate new API credentials if user doesn't have them
 			- True: Skip credential generation (assumes mobile already has credentials)
-	
+		token_only (bool, optional): Authenticate without creating a session
+
 	Returns:
 		dict: {
 			"login": {standard login response},
@@ -36,72 +114,78 @@ def mobile_login(usr=None, pwd=None, has_existing_token=False):
 				"message": str
 			}
 		}
-	
+
 	Raises:
 		ValidationError: If login fails or credentials cannot be generated
 	"""
+	# Reject clients over their rate limit before any database work (see rate_limits.py)
+	limited = rate_limits.check("mobile_login", user=usr or None)
+	if limited:
+		return limited
+
 	# Validate required parameters
 	if not usr:
 		frappe.throw(_("Username is required."), ValidationError)
-	
+
 	if not pwd:
 		frappe.throw(_("Password is required."), ValidationError)
-	
+
 	# Convert has_existing_token to boolean (handles string "true"/"false" from API)
 	if isinstance(has_existing_token, str):
 		has_existing_token = has_existing_token.lower() in ("true", "1", "yes")
 	else:
 		has_existing_token = bool(has_existing_token)
-	
+
+	if _to_bool(token_only):
+		return _token_login(usr, pwd, has_existing_token)
+
 	# Perform standard ERPNext login
 	try:
 		login_manager = LoginManager()
 		login_manager.authenticate(usr, pwd)
-		
+
 		if not login_manager.user:
-			frappe.throw(_("Invalid login credentials. Please check your username and password."), ValidationError)
-		
+			frappe.throw(
+				_("Invalid login credentials. Please check your username and password."), ValidationError
+			)
+
 		# Login successful - create session
 		login_manager.post_login()
-		
+
 	except frappe.exceptions.AuthenticationError as e:
 		# Handle authentication errors (wrong password, user disabled, etc.)
 		frappe.throw(_("Login failed: {0}").format(str(e)), ValidationError)
 	except Exception as e:
 		# Handle any other login errors
 		frappe.throw(_("Login error: {0}").format(str(e)), ValidationError)
-	
+
 	# Get user document
 	try:
 		user_doc = frappe.get_doc("User", login_manager.user)
 	except Exception as e:
 		frappe.throw(_("Error retrieving user information: {0}").format(str(e)), ValidationError)
-	
+
 	# Initialize response
 	login_response = {
 		"message": "Logged In",
 		"home_page": "/app",
 		"full_name": user_doc.full_name or user_doc.name,
-		"sid": frappe.session.sid if hasattr(frappe.session, 'sid') else None
+		"sid": frappe.session.sid if hasattr(frappe.session, "sid") else None,
 	}
-	
+
 	# Handle API credentials based on has_existing_token flag
 	api_credentials = {}
-	
+
 	if has_existing_token:
 		# Mobile app has existing token - don't generate new one
-		api_credentials = {
-			"token": None,
-			"generated": False,
-			"message": "Using existing API credentials."
-		}
+		api_credentials = {"token": None, "generated": False, "message": "Using existing API credentials."}
 	else:
 		# Mobile app doesn't have token - generate new credentials
 		# If user already has api_key, we'll regenerate secret (since secret is hashed and can't be retrieved)
 		try:
 			# Check if user has existing API key
 			has_api_key = bool(user_doc.api_key)
-			
+
 			# Generate API key and secret using Frappe's method
 			api_secret = frappe.generate_hash(length=15)
 			if not user_doc.api_key:
@@ -112,500 +196,425 @@ def mobile_login(usr=None, pwd=None, has_existing_token=False):
 			user_doc.api_secret = api_secret
 			user_doc.save(ignore_permissions=True)
 			frappe.db.commit()
-			
+
 			# Format token as api_key:api_secret
 			token = f"{api_key}:{api_secret}"
 			api_credentials = {
 				"token": token,
 				"generated": True,
-				"message": "API credentials generated successfully." if not has_api_key else "New API credentials generated. Old credentials are now invalid."
+				"message": "API credentials generated successfully."
+				if not has_api_key
+				else "New API credentials generated. Old credentials are now invalid.",
 			}
 		except Exception as e:
 			frappe.throw(_("Error generating API credentials: {0}").format(str(e)), ValidationError)
-	
+
 	# Build final response
-	response = {
+	response = {"login": login_response, "api_credentials": api_credentials}
+
+	return response
+
+
+def _token_login(usr, pwd, has_existing_token):
+	"""
+	Token-only variant of mobile_login: authenticate and (optionally) rotate the API
+	secret, without creating a session or saving the User document.
+	Returns: same shape as mobile_login, with "sid": None
+	"""
+	try:
+		login_manager = LoginManager()
+		login_manager.authenticate(usr, pwd)
+
+		if not login_manager.user:
+			frappe.throw(
+				_("Invalid login credentials. Please check your username and password."), ValidationError
+			)
+
+		# Checks post_login would run before creating the session
+		login_manager.validate_ip_address()
+		login_manager.validate_hour()
+
+	except frappe.exceptions.AuthenticationError as e:
+		frappe.throw(_("Login failed: {0}").format(str(e)), ValidationError)
+	except ValidationError:
+		raise
+	except Exception as e:
+		frappe.throw(_("Login error: {0}").format(str(e)), ValidationError)
+
+	user = frappe.db.get_value("User", login_manager.user, ["name", "full_name", "api_key"], as_dict=True)
+
+	login_response = {
+		"message": "Logged In",
+		"home_page": "/app",
+		"full_name": user.full_name or user.name,
+		"sid": None,
+	}
+
+	if has_existing_token:
+		return {
+			"login": login_response,
+			"api_credentials": {
+				"token": None,
+				"generated": False,
+				"message": "Using existing API credentials.",
+			},
+		}
+
+	try:
+		api_key = user.api_key
+		if not api_key:
+			api_key = frappe.generate_hash(length=15)
+			frappe.db.set_value("User", user.name, "api_key", api_key, update_modified=False)
+
+		# Stored encrypted in __Auth, like User.api_secret on save
+		api_secret = frappe.generate_hash(length=15)
+		set_encrypted_password("User", user.name, api_secret, "api_secret")
+		frappe.db.commit()
+	except Exception as e:
+		frappe.throw(_("Error generating API credentials: {0}").format(str(e)), ValidationError)
+
+	return {
 		"login": login_response,
-		"api_credentials": api_credentials
+		"api_credentials": {
+			"token": f"{api_key}:{api_secret}",
+			"generated": True,
+			"message": "API credentials generated successfully."
+			if not user.api_key
+			else "New API credentials generated. Old credentials are now invalid.",
+		},
 	}
-	
-	return response
 
 
 @frappe.whitelist()
-def get_employee_configuration(employee_id=None):
+@metrics.instrument
+def get_employee_configuration(employee_id=None, config_version=None):
 	"""
 	Get employee configuration data including branch location and check-in/check-out settings.
-	
+
 	This API returns:
 	- Employee Name, Employee ID, Email, Department, Branch
-	- Location Information (Latitude, Longitude, Radius from Branch)
-	- Rules (required_to_upload_location_photo, required_to_upload_client_bio_metric_photo, 
+	- Location Information (Latitude, Longitude, Radius from Branch) and the allowed branches
+	- Rules (required_to_upload_location_photo, required_to_upload_client_bio_metric_photo,
 	  require_location_check_on_check_out) from Department or Project based on Company setting
-	
+
+	Every response carries a ``config_version`` (also sent as the ``ETag`` header).
+	If the client sends it back, as ``config_version`` or via ``If-None-Match``, and the
+	configuration has not changed, the payload is not rebuilt:
+	- ``config_version`` param: returns {"not_modified": true, "config_version": ...}
+	- ``If-None-Match`` header: returns an empty HTTP 304
+
 	Args:
 		employee_id (str, optional): Employee ID. If not provided, uses authenticated user's employee record.
-	
+		config_version (str, optional): Version of the configuration the client already has.
+
 	Returns:
 		dict: Employee configuration data with location and rules
-	
+
 	Raises:
 		DoesNotExistError: If employee not found
 		ValidationError: If required data is missing
 	"""
-	# Get employee record
-	if employee_id:
-		employee = frappe.get_doc("Employee", employee_id)
-	else:
-		# Get employee from authenticated user
-		employee_name = frappe.db.get_value("Employee", {"user_id": frappe.session.user}, "name")
-		if not employee_name:
-			frappe.throw(_("Employee not found for user {0}").format(frappe.session.user), DoesNotExistError)
-		employee = frappe.get_doc("Employee", employee_name)
-	
-	# Get employee basic information
-	employee_name = getattr(employee, "employee_name", None) or employee.name
-	# Try employee_code first, then employee_number, then fallback to name
-	employee_code = employee.name
-	# Get email from various possible fields
-	email = getattr(employee, "company_email", None)
-	if not email:
-		frappe.throw(_("Employee has no company email assigned. Please assign a company email to the employee."), ValidationError)
-	department = getattr(employee, "department", None) or ""
-	department_name = frappe.db.get_value("Department", department, "department_name") if department else ""
-	branch = getattr(employee, "branch", None) or ""
-	branch_name = frappe.db.get_value("Branch", branch, "branch") if branch else ""
-	
-	# Validate branch exists
-	if not branch:
-		frappe.throw(
-			_("Employee has no branch assigned. Please assign a branch to the employee."),
-			ValidationError
-		)
-	
-	# Get Branch location information
-	branch_doc = frappe.get_doc("Branch", branch)
-	# Get custom fields safely (they may not exist if not configured)
-	latitude = getattr(branch_doc, "custom_latitude", None)
-	longitude = getattr(branch_doc, "custom_longitude", None)
-	radius = getattr(branch_doc, "custom_radius_in_meters", None)
-	
-	# Validate branch has location data
-	if latitude is None or longitude is None or radius is None:
-		frappe.throw(
-			_("Branch {0} does not have location information (latitude, longitude, or radius) configured.").format(branch_name),
-			ValidationError
-		)
-	
-	# Get Company setting
-	company = getattr(employee, "company", None)
-	if not company:
+	limited = rate_limits.check("get_employee_configuration")
+	if limited:
+		return limited
+
+	# Get employee record with its resolved settings (cached, see employee_settings.py)
+	employee = _get_employee_settings_or_throw(employee_id)
+
+	# Answer "not modified" before building the payload
+	if etag_matches(employee.config_version, get_request_header("If-None-Match")):
+		return not_modified_response(employee.config_version)
+	if config_version and config_version == employee.config_version:
+		return {"not_modified": True, "config_version": employee.config_version}
+
+	# Validate company email
+	if not employee.company_email:
 		frappe.throw(
-			_("Employee has no company assigned."),
-			ValidationError
+			_("Employee has no company email assigned. Please assign a company email to the employee."),
+			ValidationError,
 		)
-	
-	company_doc = frappe.get_doc("Company", company)
-	# Get Company setting safely (it may be a custom field)
-	use_department_settings = getattr(company_doc, "custom_attendnace_validations_based_on_department", False)
-	if use_department_settings is None:
-		use_department_settings = False
-	
-	# Get settings based on Company setting
-	settings_source = ""
-	project = None
-	project_name = None
-	
-	if use_department_settings:
-		# Get settings from Department
-		if not department:
-			frappe.throw(
-				_("Company setting requires Department settings, but Employee has no Department assigned."),
-				ValidationError
-			)
-		
-		department_doc = frappe.get_doc("Department", department)
-		# Get settings fields safely (they may be custom fields)
-		required_to_upload_location_photo = getattr(department_doc, "custom_required_to_upload_location_photo", None)
-		required_to_upload_client_bio_metric_photo = getattr(department_doc, "custom_required_to_upload_client_bio_metric_photo", None)
-		require_location_check_on_check_out = getattr(department_doc, "custom_required_location_check_on_check_out", None)
-		
-		# Check if settings fields exist in the doctype
-		if not hasattr(department_doc, "custom_required_to_upload_location_photo") and \
-		   not hasattr(department_doc, "custom_required_to_upload_client_bio_metric_photo") and \
-		   not hasattr(department_doc, "custom_required_location_check_on_check_out"):
-			frappe.throw(
-				_("Company setting requires Department settings, but Department has no validation settings configured. Please configure settings in Department."),
-				ValidationError
-			)
-		
-		# Default to False if fields exist but are None
-		required_to_upload_location_photo = required_to_upload_location_photo if required_to_upload_location_photo is not None else False
-		required_to_upload_client_bio_metric_photo = required_to_upload_client_bio_metric_photo if required_to_upload_client_bio_metric_photo is not None else False
-		require_location_check_on_check_out = require_location_check_on_check_out if require_location_check_on_check_out is not None else False
-		
-		settings_source = "department"
-	else:
-		# Get settings from Project (via Department -> custom_project)
-		if not department:
-			frappe.throw(
-				_("Company setting requires Project settings, but Employee has no Department assigned."),
-				ValidationError
-			)
-		
-		department_doc = frappe.get_doc("Department", department)
-		# Get custom_project field safely (it may be a custom field)
-		project = getattr(department_doc, "custom_project", None)
-		
-		if not project:
-			frappe.throw(
-				_("Company setting requires Project settings, but Department has no linked Project. Please link a Project to Department via custom_project field."),
-				ValidationError
-			)
-		
-		project_doc = frappe.get_doc("Project", project)
-		project_name = frappe.db.get_value("Project", project, "project_name") or project
-		# Get settings fields safely (they may be custom fields)
-		required_to_upload_location_photo = getattr(project_doc, "custom_required_to_upload_location_photo", None)
-		required_to_upload_client_bio_metric_photo = getattr(project_doc, "custom_required_to_upload_client_bio_metric_photo", None)
-		require_location_check_on_check_out = getattr(project_doc, "custom_required_location_check_on_check_out", None)
-		
-		# Check if settings fields exist in the doctype
-		if not hasattr(project_doc, "custom_required_to_upload_location_photo") and \
-		   not hasattr(project_doc, "custom_required_to_upload_client_bio_metric_photo") and \
-		   not hasattr(project_doc, "custom_required_location_check_on_check_out"):
-			frappe.throw(
-				_("Company setting requires Project settings, but linked Project has no validation settings configured. Please configure settings in Project."),
-				ValidationError
-			)
-		
-		# Default to False if fields exist but are None
-		required_to_upload_location_photo = required_to_upload_location_photo if required_to_upload_location_photo is not None else False
-		required_to_upload_client_bio_metric_photo = required_to_upload_client_bio_metric_photo if required_to_upload_client_bio_metric_photo is not None else False
-		require_location_check_on_check_out = require_location_check_on_check_out if require_location_check_on_check_out is not None else False
-		
-		settings_source = "project"
-	
+
 	# Build branch information block
 	branch_info = {
-		"branch_id": branch,
-		"branch_name": branch_name or branch,
-		"latitude": latitude,
-		"longitude": longitude,
-		"checkin_radius_meters": radius,
-		"address": getattr(branch_doc, "address", None),
+		"branch_id": employee.branch,
+		"branch_name": employee.branch_name or employee.branch,
+		"latitude": employee.latitude,
+		"longitude": employee.longitude,
+		"checkin_radius_meters": employee.radius,
+		"address": employee.branch_address,
+		# Branches the employee may punch at (assigned branch first)
+		"allowed_branches": employee.allowed_branches or [employee.branch],
 	}
-	
+
 	# Build settings block with booleans and metadata
 	settings = {
-		"required_to_upload_location_photo": bool(required_to_upload_location_photo),
-		"required_to_upload_client_bio_metric_photo": bool(required_to_upload_client_bio_metric_photo),
-		"require_location_check_on_check_out": bool(require_location_check_on_check_out),
-		"settings_source": settings_source,
-		"department_id": department or None,
-		"department_name": department_name or None,
-		"project_id": project,
-		"project_name": project_name,
+		"required_to_upload_location_photo": employee.required_to_upload_location_photo,
+		"required_to_upload_client_bio_metric_photo": employee.required_to_upload_client_bio_metric_photo,
+		"require_location_check_on_check_out": employee.require_location_check_on_check_out,
+		"settings_source": employee.settings_source,
+		"department_id": employee.department or None,
+		"department_name": employee.department_name or None,
+		"project_id": employee.project,
+		"project_name": employee.project_name,
 	}
-	
+
 	# Build response matching the exact format from the image
 	response = {
-		"employee_id": employee_code,
-		"employee_name": employee_name,
-		"employee_code": employee_code,
-		"designation": getattr(employee, "designation", None) or "",
-		"department": department or "",
-		"department_name": department_name or "",
-		"company": company,
+		"employee_id": employee.name,
+		"employee_name": employee.employee_name,
+		"employee_code": employee.name,
+		"designation": employee.designation or "",
+		"department": employee.department or "",
+		"department_name": employee.department_name or "",
+		"company": employee.company,
 		"branch": branch_info,
 		"settings": settings,
+		"config_version": employee.config_version,
 	}
 
-	frappe.log_error(
-		title="Employee Configuration",
-		message=json.dumps(response, indent=4),
+	diagnostics.log(
+		"get_employee_configuration",
+		"Employee Configuration",
+		lambda: json.dumps(response, indent=4),
 	)
-	
+
+	# Send the version as ETag so HTTP clients can revalidate with If-None-Match
+	if get_request() is not None:
+		return json_response(response, headers={"ETag": f'"{employee.config_version}"'})
+
 	return response
 
 
+def _get_employee_settings_or_throw(employee_id=None):
+	"""
+	Get the resolved settings for employee_id, or for the authenticated user's employee.
+	Raises DoesNotExistError if no employee is found.
+	"""
+	if not employee_id:
+		employee_id = get_employee_for_user(frappe.session.user)
+		if not employee_id:
+			frappe.throw(_("Employee not found for user {0}").format(frappe.session.user), DoesNotExistError)
+
+	employee = get_employee_settings(employee_id)
+	if employee is None:
+		frappe.throw(_("Employee {0} not found").format(employee_id), DoesNotExistError)
+
+	return employee
+
+
+def _get_employee_identity(employee_id=None):
+	"""
+	Get the name, employee_name and employee_number of employee_id, or of the
+	authenticated user's employee, in one query.
+	Raises DoesNotExistError if no employee is found.
+	"""
+	employee = frappe.db.get_value(
+		"Employee",
+		employee_id or {"user_id": frappe.session.user},
+		["name", "employee_name", "employee_number"],
+		as_dict=True,
+	)
+	if not employee:
+		if employee_id:
+			frappe.throw(_("Employee {0} not found").format(employee_id), DoesNotExistError)
+		frappe.throw(_("Employee not found for user {0}").format(frappe.session.user), DoesNotExistError)
+
+	return employee
+
+
 def _get_employee_settings(employee):
 	"""
-	Helper function to get employee settings (same logic as get_employee_configuration).
+	Helper function to get the check-in settings and allowed branches from resolved employee settings.
 	Returns: dict with settings and branch info
 	"""
-	department = getattr(employee, "department", None) or ""
-	company = getattr(employee, "company", None)
-	
-	if not company:
-		frappe.throw(_("Employee has no company assigned."), ValidationError)
-	
-	company_doc = frappe.get_doc("Company", company)
-	use_department_settings = getattr(company_doc, "custom_attendnace_validations_based_on_department", False)
-	if use_department_settings is None:
-		use_department_settings = False
-	
-	# Get settings based on Company setting
-	if use_department_settings:
-		if not department:
-			frappe.throw(
-				_("Company setting requires Department settings, but Employee has no Department assigned."),
-				ValidationError
-			)
-		
-		department_doc = frappe.get_doc("Department", department)
-		required_to_upload_location_photo = getattr(department_doc, "custom_required_to_upload_location_photo", None)
-		required_to_upload_client_bio_metric_photo = getattr(department_doc, "custom_required_to_upload_client_bio_metric_photo", None)
-		require_location_check_on_check_out = getattr(department_doc, "custom_required_location_check_on_check_out", None)
-		
-		if not (hasattr(department_doc, "custom_required_to_upload_location_photo") or \
-		        hasattr(department_doc, "custom_required_to_upload_client_bio_metric_photo") or \
-		        hasattr(department_doc, "custom_required_location_check_on_check_out")):
-			frappe.throw(
-				_("Company setting requires Department settings, but Department has no validation settings configured."),
-				ValidationError
-			)
-		
-		required_to_upload_location_photo = required_to_upload_location_photo if required_to_upload_location_photo is not None else False
-		required_to_upload_client_bio_metric_photo = required_to_upload_client_bio_metric_photo if required_to_upload_client_bio_metric_photo is not None else False
-		require_location_check_on_check_out = require_location_check_on_check_out if require_location_check_on_check_out is not None else False
-	else:
-		if not department:
-			frappe.throw(
-				_("Company setting requires Project settings, but Employee has no Department assigned."),
-				ValidationError
-			)
-		
-		department_doc = frappe.get_doc("Department", department)
-		project = getattr(department_doc, "custom_project", None)
-		
-		if not project:
-			frappe.throw(
-				_("Company setting requires Project settings, but Department has no linked Project."),
-				ValidationError
-			)
-		
-		project_doc = frappe.get_doc("Project", project)
-		required_to_upload_location_photo = getattr(project_doc, "custom_required_to_upload_location_photo", None)
-		required_to_upload_client_bio_metric_photo = getattr(project_doc, "custom_required_to_upload_client_bio_metric_photo", None)
-		require_location_check_on_check_out = getattr(project_doc, "custom_required_location_check_on_check_out", None)
-		
-		if not (hasattr(project_doc, "custom_required_to_upload_location_photo") or \
-		        hasattr(project_doc, "custom_required_to_upload_client_bio_metric_photo") or \
-		        hasattr(project_doc, "custom_required_location_check_on_check_out")):
-			frappe.throw(
-				_("Company setting requires Project settings, but linked Project has no validation settings configured."),
-				ValidationError
-			)
-		
-		required_to_upload_location_photo = required_to_upload_location_photo if required_to_upload_location_photo is not None else False
-		required_to_upload_client_bio_metric_photo = required_to_upload_client_bio_metric_photo if required_to_upload_client_bio_metric_photo is not None else False
-		require_location_check_on_check_out = require_location_check_on_check_out if require_location_check_on_check_out is not None else False
-	
-	# Get branch info
-	branch = getattr(employee, "branch", None) or ""
-	if not branch:
-		frappe.throw(_("Employee has no branch assigned."), ValidationError)
-	
-	branch_doc = frappe.get_doc("Branch", branch)
-	latitude = getattr(branch_doc, "custom_latitude", None)
-	longitude = getattr(branch_doc, "custom_longitude", None)
-	radius = getattr(branch_doc, "custom_radius_in_meters", None)
-	
-	if latitude is None or longitude is None or radius is None:
-		branch_name = frappe.db.get_value("Branch", branch, "branch") or branch
-		frappe.throw(
-			_("Branch {0} does not have location information configured.").format(branch_name),
-			ValidationError
-		)
-	
 	return {
-		"required_to_upload_location_photo": bool(required_to_upload_location_photo),
-		"required_to_upload_client_bio_metric_photo": bool(required_to_upload_client_bio_metric_photo),
-		"require_location_check_on_check_out": bool(require_location_check_on_check_out),
-		"branch_latitude": float(latitude),
-		"branch_longitude": float(longitude),
-		"branch_radius": int(radius),
-		"branch": branch,
+		"required_to_upload_location_photo": employee.required_to_upload_location_photo,
+		"required_to_upload_client_bio_metric_photo": employee.required_to_upload_client_bio_metric_photo,
+		"require_location_check_on_check_out": employee.require_location_check_on_check_out,
+		"branch": employee.branch,
+		"allowed_branches": employee.allowed_branches or [employee.branch],
 	}
 
 
-def _validate_location(latitude, longitude, branch_latitude, branch_longitude, branch_radius, log_type="IN"):
+def _validate_location(latitude, longitude, allowed_branches, log_type="IN"):
 	"""
-	Validate if employee location is within branch radius.
-	Raises ValidationError if outside radius.
+	Validate if employee location is within the radius of one of the allowed branches.
+	The nearest geofence is looked up in the in-memory branch index (see geofence.py).
+
+	Returns: frappe._dict with "branch" (matched branch) and "distance" (meters)
+	Raises ValidationError if outside every allowed radius.
 	"""
 	if not latitude or not longitude:
 		action = "check-in" if log_type == "IN" else "check-out"
 		frappe.throw(
 			_("Location coordinates are required for {0}. Please enable GPS and try again.").format(action),
-			ValidationError
+			ValidationError,
 		)
-	
+
 	try:
 		latitude = float(latitude)
 		longitude = float(longitude)
 	except (ValueError, TypeError) as e:
 		frappe.throw(
-			_("Invalid location coordinates. Please ensure GPS is enabled and try again. Error: {0}").format(str(e)),
-			ValidationError
+			_("Invalid location coordinates. Please ensure GPS is enabled and try again. Error: {0}").format(
+				str(e)
+			),
+			ValidationError,
 		)
-	
+
 	# Validate coordinate ranges
 	if not (-90 <= latitude <= 90):
 		frappe.throw(
-			_("Invalid latitude value. Latitude must be between -90 and 90 degrees."),
-			ValidationError
+			_("Invalid latitude value. Latitude must be between -90 and 90 degrees."), ValidationError
 		)
 	if not (-180 <= longitude <= 180):
 		frappe.throw(
-			_("Invalid longitude value. Longitude must be between -180 and 180 degrees."),
-			ValidationError
+			_("Invalid longitude value. Longitude must be between -180 and 180 degrees."), ValidationError
 		)
-	
+
 	try:
-		distance = get_distance_between_coordinates(
-			branch_latitude, branch_longitude, latitude, longitude
-		)
+		with metrics.span("geofence"):
+			geofence_match = geofence.find_geofence(latitude, longitude, allowed_branches)
 	except Exception as e:
 		frappe.throw(
 			_("Error calculating distance from branch location. Please try again. Error: {0}").format(str(e)),
-			ValidationError
+			ValidationError,
+		)
+
+	if not geofence_match:
+		frappe.throw(
+			_(
+				"Branch {0} does not have location information (latitude, longitude, or radius) configured."
+			).format(allowed_branches[0]),
+			ValidationError,
 		)
-	
-	if distance > branch_radius:
+
+	if not geofence_match.inside:
 		action = "check in" if log_type == "IN" else "check out"
 		frappe.throw(
-			_("You are {0:.2f} meters away from the branch location. Please move within {1} meters to {2}.").format(
-				distance, branch_radius, action
-			),
+			_(
+				"You are {0:.2f} meters away from the branch location. Please move within {1} meters to {2}."
+			).format(geofence_match.distance, geofence_match.radius, action),
 			exc=CheckinRadiusExceededError,
 		)
-	
-	return distance
 
+	return geofence_match
 
-def _handle_photo_upload(photo_data, employee_id, checkin_id, photo_type="location"):
+
+def _stage_photo_upload(photo_data):
 	"""
-	Handle photo upload from base64 or file_id.
-	Returns file_doc or None.
+	Stage a photo upload (multipart file, base64 string or bytes) before the checkin is
+	created, so empty, corrupt or oversized photos are rejected up front. The upload is
+	streamed in chunks to a staging file (see photo_storage.py), never read fully into memory.
+
+	Returns: File ID (str) for an already uploaded file, staged photo (frappe._dict) or None
 	"""
-	# frappe.log_error(
-	# 	f"DEBUG: _handle_photo_upload called - photo_type: {photo_type}, "
-	# 	f"photo_data type: {type(photo_data)}, has_data: {bool(photo_data)}, "
-	# 	f"employee_id: {employee_id}, checkin_id: {checkin_id}",
-	# 	"Checkin Photo Upload Debug"
-	# )
-	
 	if not photo_data:
-		frappe.log_error(
-			title="Checkin Photo Debug",
-			message="_handle_photo_upload - photo_data is empty/None",
+		diagnostics.log(
+			"create_checkin_checkout",
+			"Checkin Photo Debug",
+			"_stage_photo_upload - photo_data is empty/None",
 		)
 		return None
-	
-	# If it's a file_id (already uploaded), return the file doc
+
+	# If it's a file_id (already uploaded), keep the file ID
 	if isinstance(photo_data, str) and not photo_data.startswith("data:"):
 		# Check if it's a valid file ID
 		if frappe.db.exists("File", photo_data):
-			frappe.log_error(
-				title="Checkin Photo Debug",
-				message=f"_handle_photo_upload - treating as file_id: {photo_data}",
+			diagnostics.log(
+				"create_checkin_checkout",
+				"Checkin Photo Debug",
+				f"_stage_photo_upload - treating as file_id: {photo_data}",
 			)
-			return frappe.get_doc("File", photo_data)
+			return photo_data
 		# If not a file ID, treat as base64
-		frappe.log_error(
-			title="Checkin Photo Debug",
-			message="_handle_photo_upload - treating string as base64",
+
+	try:
+		staged = photo_storage.stage_photo(photo_data)
+	except ValidationError as e:
+		diagnostics.log(
+			"create_checkin_checkout",
+			"Checkin Photo Debug",
+			f"_stage_photo_upload - rejected photo: {e!s}",
+			level=diagnostics.WARNING,
 		)
-	
-	# Handle base64 encoded image
-	if isinstance(photo_data, str):
-		if photo_data.startswith("data:"):
-			# Remove data:image/jpeg;base64, prefix
-			photo_data = photo_data.split(",", 1)[1]
-		
-		try:
-			file_bytes = base64.b64decode(photo_data)
-			if not file_bytes or len(file_bytes) == 0:
-				frappe.throw(
-					_("Invalid image data. The photo appears to be empty. Please capture the photo again."),
-					ValidationError
-				)
-			frappe.log_error(
-				title="Checkin Photo Debug",
-				message=f"_handle_photo_upload - decoded base64, size: {len(file_bytes)}",
-			)
-		except Exception as e:
-			frappe.log_error(
-				title="Checkin Photo Debug",
-				message=f"_handle_photo_upload - base64 decode error: {str(e)}",
-			)
-			frappe.throw(
-				_("Invalid image format. Please ensure the photo is properly encoded and try again."),
-				ValidationError
-			)
-	else:
-		file_bytes = photo_data
-		frappe.log_error(
-			title="Checkin Photo Debug",
-			message=f"_handle_photo_upload - using bytes directly, size: {len(file_bytes) if file_bytes else 0}",
+		raise
+	except Exception as e:
+		diagnostics.log(
+			"create_checkin_checkout",
+			"Checkin Photo Debug",
+			f"_stage_photo_upload - error reading photo: {e!s}",
+			level=diagnostics.WARNING,
+		)
+		frappe.throw(
+			_("Error uploading photo. Please try again. If the problem persists, contact support."),
+			ValidationError,
 		)
-	
+
+	metrics.incr("mobile_app_ingested_bytes_total", staged.size or 0)
+	diagnostics.log(
+		"create_checkin_checkout",
+		"Checkin Photo Debug",
+		f"_stage_photo_upload - staged photo, size: {staged.size}",
+	)
+	return staged
+
+
+def _handle_photo_upload(staged_photo, employee_id, checkin_id, photo_type="location"):
+	"""
+	Handle photo upload from a staged photo or file_id (see _stage_photo_upload).
+	Returns file_doc or None.
+	"""
+	if not staged_photo:
+		return None
+
+	# If it's a file_id (already uploaded), return the file doc
+	if isinstance(staged_photo, str):
+		return frappe.get_doc("File", staged_photo)
+
 	# Generate filename
-	from frappe.utils import now_datetime
-	timestamp = now_datetime().strftime("%Y%m%d_%H%M%S")
-	filename = f"{photo_type}_photo_{employee_id}_{timestamp}.jpg"
-	
-	frappe.log_error(
-		title="Checkin Photo Debug",
-		message=f"Calling save_file - filename: {filename}, checkin: {checkin_id}, size: {len(file_bytes) if file_bytes else 0}",
+	filename = photo_storage.get_photo_file_name(photo_type, employee_id)
+
+	diagnostics.log(
+		"create_checkin_checkout",
+		"Checkin Photo Debug",
+		f"Saving photo - filename: {filename}, checkin: {checkin_id}, size: {staged_photo.size}",
 	)
-	
+
 	# Save file and attach to checkin
 	try:
-		if not file_bytes or len(file_bytes) == 0:
-			frappe.throw(
-				_("Photo file is empty. Please capture the photo again and try uploading."),
-				ValidationError
-			)
-		
-		# Validate file size (max 5MB as per documentation)
-		max_size = 5 * 1024 * 1024  # 5MB in bytes
-		if len(file_bytes) > max_size:
-			frappe.throw(
-				_("Photo file size exceeds the maximum limit of 5MB. Please compress the image and try again."),
-				ValidationError
+		with metrics.span("save_file"):
+			file_doc = photo_storage.save_staged_photo(
+				staged_photo, filename, "Employee Checkin", checkin_id, is_private=0
 			)
-		
-		file_doc = save_file(
-			fname=filename,
-			content=file_bytes,
-			dt="Employee Checkin",
-			dn=checkin_id,
-			is_private=0
-		)
-		frappe.log_error(
-			title="Checkin Photo Debug",
-			message=f"save_file successful - file_id: {file_doc.name if file_doc else 'None'}",
+		diagnostics.log(
+			"create_checkin_checkout",
+			"Checkin Photo Debug",
+			f"Photo saved - file_id: {file_doc.name}",
 		)
+		# Recompress and create the thumbnail in the background (reused blobs already are)
+		if not file_doc.flags.deduplicated:
+			photo_processing.enqueue_photo_processing(file_doc.name)
 	except ValidationError:
 		# Re-raise validation errors as-is
 		raise
 	except Exception as e:
-		frappe.log_error(
-			title="Checkin Photo Debug",
-			message=f"save_file error: {str(e)}",
+		diagnostics.log(
+			"create_checkin_checkout",
+			"Checkin Photo Debug",
+			f"save photo error: {e!s}",
+			level=diagnostics.WARNING,
 		)
 		frappe.throw(
 			_("Error uploading photo. Please try again. If the problem persists, contact support."),
-			ValidationError
+			ValidationError,
 		)
-	
+
 	return file_doc
 
 
 @frappe.whitelist()
+@metrics.instrument
 def create_checkin_checkout(
 	employee_id=None,
 	log_type="IN",
@@ -618,11 +627,14 @@ def create_checkin_checkout(
 	notes=None,
 	checkin_id=None,
 	location_photo_id=None,
-	client_biometric_photo_id=None
+	client_biometric_photo_id=None,
+	client_request_id=None,
+	defer_photos=False,
+	queued=False,
 ):
 	"""
 	Create employee check-in or check-out record with all validations.
-	
+
 	This endpoint:
 	1. Validates employee is active
 	2. Validates location (geofencing) - always for check-in, conditional for checkout
@@ -630,10 +642,45 @@ def create_checkin_checkout(
 	4. Creates Employee Checkin record
 	5. Links photos to checkin record
 	6. Applies all existing Employee Checkin validations
-	
+
 	All errors are returned to the mobile app in the minimal format:
 		{ "exception": "<message>" }
+
+	Retries: when the app sends a client_request_id, the first successful response is
+	stored for a short time and returned unchanged, with its HTTP status, to retries with
+	the same ID, before any database or photo work (see idempotency.py).
+
+	Deferred photos: with defer_photos set, uploaded photos are only staged; the response
+	comes back right away with "photo_status": "pending" and the photos are saved and
+	linked by a background job. Poll get_checkin_photo_status for the final URLs.
+
+	Queued punches: with queued set, on sites that enable the punch queue, only the
+	validations run in the request. The punch is added to a queue and the response (HTTP
+	202) is a receipt with "status": "accepted" and a "receipt_id"; a background job
+	creates the checkin. Poll get_punch_receipt_status for the outcome. When the queue is
+	full the request gets a 503 with Retry-After (see punch_queue.py).
 	"""
+	# Reject clients over their rate limit before any database work (see rate_limits.py)
+	limited = rate_limits.check("create_checkin_checkout", device_id=device_id)
+	if limited:
+		return limited
+
+	# Replay the stored response of a retried request before any DB or photo work
+	if client_request_id:
+		receipt = idempotency.get_receipt(client_request_id)
+		if receipt is not None:
+			# Same status as the first response (202 for a queued punch)
+			frappe.local.response.http_status_code = receipt.http_status_code
+			return receipt.response
+		if not idempotency.acquire(client_request_id):
+			metrics.reject("in_progress")
+			frappe.local.response.http_status_code = 409
+			return {
+				"exception": _(
+					"Your previous request is still being processed. Please wait a moment and try again."
+				)
+			}
+
 	try:
 		# Support multipart/form-data file uploads (e.g. Postman / mobile form-data).
 		# If files are sent as real files instead of base64 strings, they will be
@@ -642,326 +689,1080 @@ def create_checkin_checkout(
 			request_files = getattr(frappe, "request", None) and getattr(frappe.request, "files", None)
 		except Exception:
 			request_files = None
-		
-		def _read_file_storage(file_storage):
-			"""Read bytes from a FileStorage object, handling stream position."""
-			if not file_storage:
-				return None
+
+		# Multipart files are kept as FileStorage objects and streamed when staged
+		if not location_photo and request_files:
+			location_photo = request_files.get("location_photo") or None
+
+		if not client_biometric_photo and request_files:
+			client_biometric_photo = request_files.get("client_biometric_photo") or None
+
+		with metrics.span("settings"):
+			employee = _get_checkin_employee(employee_id)
+
+		queued = _to_bool(queued) and punch_queue.is_enabled()
+		if queued and punch_queue.is_full(employee.name):
+			return punch_queue.busy_response()
+
+		response = _create_checkin(
+			employee,
+			log_type=log_type,
+			latitude=latitude,
+			longitude=longitude,
+			device_id=device_id,
+			location_photo=location_photo,
+			client_biometric_photo=client_biometric_photo,
+			timestamp=timestamp,
+			notes=notes,
+			location_photo_id=location_photo_id,
+			client_biometric_photo_id=client_biometric_photo_id,
+			defer_photos=_to_bool(defer_photos),
+			queued=queued,
+		)
+		if response.get("status") == punch_queue.ACCEPTED:
+			frappe.local.response.http_status_code = 202
+			idempotency.store_response(client_request_id, response, http_status_code=202)
+		elif response.get("status") == "success":
+			idempotency.store_response(client_request_id, response)
+		return response
+
+	# Convert known validation-type errors into the minimal mobile format
+	except (ValidationError, DoesNotExistError, CheckinRadiusExceededError) as e:
+		metrics.reject(metrics.rejection_reason(e))
+		# Set HTTP status code to 401 for validation errors (including duplicate check-ins)
+		frappe.local.response.http_status_code = 401
+		return {"exception": str(e)}
+	except Exception as e:
+		# Log unexpected errors for debugging, but still return a clean message to mobile
+		frappe.log_error(title="Checkin API Unexpected Error", message=str(e))
+		metrics.incr("mobile_app_error_logs_total")
+		frappe.local.response.http_status_code = 500
+		return {
+			"exception": _(
+				"Something went wrong while creating your check-in. Please try again or contact support."
+			)
+		}
+	finally:
+		idempotency.release(client_request_id)
+
+
+@frappe.whitelist()
+@metrics.instrument
+def sync_offline_punches(punches=None, employee_id=None, defer_photos=False):
+	"""
+	Create a batch of punches queued on the phone while it was offline.
+
+	The employee and settings are resolved once, every punch goes through the same
+	validations as create_checkin_checkout (geofence, required photos, one IN and one
+	OUT per day), and all punches are inserted in a single transaction. A punch that
+	fails is rolled back on its own (savepoint) and does not affect the others.
+
+	Args:
+		punches (list or str, required): Ordered list (or JSON string) of punches. Each punch
+			takes the create_checkin_checkout parameters: log_type, latitude, longitude,
+			device_id, location_photo, client_biometric_photo (base64), timestamp, notes,
+			location_photo_id, client_biometric_photo_id, client_request_id. Punches are
+			applied in list order, so a day's IN must come before its OUT. A punch whose
+			client_request_id already succeeded gets its stored response back; one that
+			another request is still creating gets an error asking to retry.
+		employee_id (str, optional): Employee ID. If not provided, uses authenticated user's employee.
+		defer_photos (bool, optional): Save photos in a background job (see create_checkin_checkout).
+
+	Returns:
+		dict: {
+			"results": [per-punch result in request order: the create_checkin_checkout
+				success response with "index", or {"index", "status": "error", "exception"}],
+			"synced": number of punches created,
+			"failed": number of punches rejected
+		}
+	"""
+	limited = rate_limits.check("sync_offline_punches")
+	if limited:
+		return limited
+
+	try:
+		if isinstance(punches, str):
 			try:
-				if hasattr(file_storage, "stream") and hasattr(file_storage.stream, "seek"):
-					file_storage.stream.seek(0)
-				if hasattr(file_storage, "read"):
-					return file_storage.read()
-				if hasattr(file_storage, "stream") and hasattr(file_storage.stream, "read"):
-					return file_storage.stream.read()
-				return None
-			except Exception as e:
-				frappe.log_error(
-					title="Checkin Photo Debug",
-					message=f"Error reading file_storage stream: {str(e)}",
-				)
-				return None
-		
-		# For location photo: handle different input types
-		if location_photo:
-			# If it's a FileStorage-like object, read bytes from it
-			if hasattr(location_photo, "read") or (
-				hasattr(location_photo, "stream") and hasattr(location_photo.stream, "read")
-			):
-				location_photo = _read_file_storage(location_photo)
-		elif request_files:
-			file_storage = request_files.get("location_photo")
-			if file_storage:
-				location_photo = _read_file_storage(file_storage)
-		
-		# For biometric photo: same logic
-		if client_biometric_photo:
-			if hasattr(client_biometric_photo, "read") or (
-				hasattr(client_biometric_photo, "stream") and hasattr(client_biometric_photo.stream, "read")
-			):
-				client_biometric_photo = _read_file_storage(client_biometric_photo)
-		elif request_files:
-			file_storage = request_files.get("client_biometric_photo")
-			if file_storage:
-				client_biometric_photo = _read_file_storage(file_storage)
-		
-		# Get employee record with clear error messages
-		if employee_id:
-			if not frappe.db.exists("Employee", employee_id):
-				raise DoesNotExistError(
-					_("Employee not found. Please check the employee ID and try again.")
+				punches = json.loads(punches)
+			except ValueError:
+				raise ValidationError(_("Invalid punches. Please send a JSON array of punches."))
+		if not punches or not isinstance(punches, list):
+			raise ValidationError(_("No punches to sync. Please send a JSON array of punches."))
+		if len(punches) > MAX_SYNC_BATCH_SIZE:
+			raise ValidationError(
+				_("Too many punches in one sync. Please send at most {0} punches per request.").format(
+					MAX_SYNC_BATCH_SIZE
 				)
+			)
+
+		with metrics.span("settings"):
+			employee = _get_checkin_employee(employee_id)
+		with metrics.span("daily_rule"):
+			punched = _get_punched_days(employee.name, punches)
+		defer_photos = _to_bool(defer_photos)
+	except (ValidationError, DoesNotExistError) as e:
+		metrics.reject(metrics.rejection_reason(e))
+		frappe.local.response.http_status_code = 401
+		return {"exception": str(e)}
+
+	results = []
+	acquired = []
+	try:
+		for index, punch in enumerate(punches):
+			savepoint = f"mobile_sync_{index}"
+			frappe.db.savepoint(savepoint)
 			try:
-				employee = frappe.get_doc("Employee", employee_id)
-			except Exception as e:
-				raise DoesNotExistError(
-					_("Error retrieving employee record: {0}").format(str(e))
-				)
-		else:
-			employee_name = frappe.db.get_value("Employee", {"user_id": frappe.session.user}, "name")
-			if not employee_name:
-				raise DoesNotExistError(
-					_("Employee not found for user {0}. Please ensure your user account is linked to an employee record.").format(
-						frappe.session.user
-					)
+				if not isinstance(punch, dict):
+					raise ValidationError(_("Invalid punch. Each punch must be an object."))
+				client_request_id = punch.get("client_request_id")
+				replay = idempotency.get_response(client_request_id)
+				if replay is not None:
+					results.append({"index": index, **replay})
+					continue
+				if client_request_id:
+					# Same lock as create_checkin_checkout, so a concurrent retry of the punch
+					# (or of the whole batch) is told to wait instead of hitting the unique key
+					if not idempotency.acquire(client_request_id):
+						metrics.reject("in_progress")
+						results.append(
+							{
+								"index": index,
+								"status": "error",
+								"exception": _(
+									"Your previous request is still being processed. Please wait a moment and try again."
+								),
+							}
+						)
+						continue
+					acquired.append(client_request_id)
+					# The other request may have finished between the replay check and the lock
+					replay = idempotency.get_response(client_request_id)
+					if replay is not None:
+						results.append({"index": index, **replay})
+						continue
+				result = _create_checkin(
+					employee,
+					log_type=punch.get("log_type") or "IN",
+					latitude=punch.get("latitude"),
+					longitude=punch.get("longitude"),
+					device_id=punch.get("device_id"),
+					location_photo=punch.get("location_photo"),
+					client_biometric_photo=punch.get("client_biometric_photo"),
+					timestamp=punch.get("timestamp"),
+					notes=punch.get("notes"),
+					location_photo_id=punch.get("location_photo_id"),
+					client_biometric_photo_id=punch.get("client_biometric_photo_id"),
+					punched=punched,
+					commit=False,
+					defer_photos=defer_photos,
 				)
-			try:
-				employee = frappe.get_doc("Employee", employee_name)
+				if "exception" in result:
+					frappe.db.rollback(save_point=savepoint)
+					result = {"status": "error", **result}
+			except (ValidationError, DoesNotExistError, CheckinRadiusExceededError) as e:
+				frappe.db.rollback(save_point=savepoint)
+				metrics.reject(metrics.rejection_reason(e))
+				result = {"status": "error", "exception": str(e)}
 			except Exception as e:
-				raise DoesNotExistError(
-					_("Error retrieving employee record: {0}").format(str(e))
-				)
-		
-		# Validate employee is active
-		validate_active_employee(employee.name)
-		
-		# Validate log_type
-		if log_type not in ("IN", "OUT"):
-			raise ValidationError(
-				_("Invalid log_type. Must be 'IN' for check-in or 'OUT' for check-out.")
-			)
-		
-		# Get employee settings and branch info
-		settings = _get_employee_settings(employee)
-		
-		# Validate location
-		if log_type == "IN":
-			if not latitude or not longitude:
-				raise ValidationError(
-					_("Location is required for check-in. Please provide latitude and longitude.")
+				frappe.db.rollback(save_point=savepoint)
+				frappe.log_error(title="Checkin Sync Unexpected Error", message=str(e))
+				metrics.incr("mobile_app_error_logs_total")
+				result = {
+					"status": "error",
+					"exception": _(
+						"Something went wrong while creating your check-in. Please try again or contact support."
+					),
+				}
+			results.append({"index": index, **result})
+
+		frappe.db.commit()
+
+		# Store responses only once they are committed
+		for punch, result in zip(punches, results, strict=True):
+			if result["status"] == "success" and isinstance(punch, dict):
+				idempotency.store_response(
+					punch.get("client_request_id"),
+					{key: value for key, value in result.items() if key != "index"},
 				)
-			distance = _validate_location(
-				latitude,
-				longitude,
-				settings["branch_latitude"],
-				settings["branch_longitude"],
-				settings["branch_radius"],
-				log_type,
+	finally:
+		for client_request_id in acquired:
+			idempotency.release(client_request_id)
+
+	synced = sum(1 for result in results if result["status"] == "success")
+	return {
+		"results": results,
+		"synced": synced,
+		"failed": len(results) - synced,
+	}
+
+
+def _to_bool(value):
+	"""Convert a boolean API parameter (handles string "true"/"false" from API)."""
+	if isinstance(value, str):
+		return value.lower() in ("true", "1", "yes")
+	return bool(value)
+
+
+def _get_checkin_employee(employee_id=None):
+	"""
+	Get the resolved settings of the employee punching, with clear error messages.
+	Raises DoesNotExistError if the employee is not found, or the employee's
+	inactive-status error.
+	"""
+	# Resolved settings are cached, so a warm punch does not query
+	# Employee/Branch/Company/Department/Project
+	if employee_id:
+		employee = get_employee_settings(employee_id)
+		if employee is None:
+			raise DoesNotExistError(_("Employee not found. Please check the employee ID and try again."))
+	else:
+		employee_name = get_employee_for_user(frappe.session.user)
+		if not employee_name:
+			raise DoesNotExistError(
+				_(
+					"Employee not found for user {0}. Please ensure your user account is linked to an employee record."
+				).format(frappe.session.user)
 			)
-		elif settings["require_location_check_on_check_out"]:
-			if not latitude or not longitude:
-				raise ValidationError(
-					_("Location is required for check-out. Please provide latitude and longitude.")
-				)
-			distance = _validate_location(
-				latitude,
-				longitude,
-				settings["branch_latitude"],
-				settings["branch_longitude"],
-				settings["branch_radius"],
-				log_type,
+		employee = get_employee_settings(employee_name)
+		if employee is None:
+			raise DoesNotExistError(_("Error retrieving employee record: {0}").format(employee_name))
+
+	# Validate employee is active (only inactive employees need the authoritative check)
+	if employee.status == "Inactive":
+		validate_active_employee(employee.name)
+
+	return employee
+
+
+def _parse_checkin_time(timestamp):
+	"""
+	Parse a punch timestamp (ISO 8601) into naive UTC without microseconds.
+	Defaults to now when no timestamp is given.
+	"""
+	if not timestamp:
+		return get_datetime().replace(microsecond=0)
+
+	try:
+		checkin_time = get_datetime(timestamp)
+		if checkin_time.tzinfo is not None:
+			checkin_time = checkin_time.astimezone(timezone.utc).replace(tzinfo=None)
+		return checkin_time.replace(microsecond=0)
+	except Exception as e:
+		raise ValidationError(
+			_(
+				"Invalid timestamp format. Please use ISO 8601 format (e.g., 2025-01-27T09:15:30Z). Error: {0}"
+			).format(str(e))
+		)
+
+
+def _get_punched_days(employee, punches):
+	"""
+	Load the (date, log_type) pairs the employee already punched on the days covered
+	by a batch of punches, in one query.
+	Returns: set of (date, log_type)
+	"""
+	days = set()
+	for punch in punches:
+		try:
+			days.add(_parse_checkin_time(punch.get("timestamp") if isinstance(punch, dict) else None).date())
+		except ValidationError:
+			# Reported per punch when the punch itself is processed
+			continue
+	if not days:
+		return set()
+
+	return _get_punches_between(employee, min(days), max(days))
+
+
+def _get_punches_between(employee, from_date, to_date):
+	"""
+	Load the (date, log_type) pairs the employee punched from from_date to to_date.
+
+	Read by time rather than punch date, so check-ins created outside the mobile app
+	(e.g. biometric devices or the desk), which have no punch date, count as well.
+	Returns: set of (date, log_type)
+	"""
+	start = datetime.combine(from_date, datetime.min.time())
+	end = datetime.combine(to_date, datetime.min.time()) + timedelta(days=1)
+	existing = frappe.get_all(
+		"Employee Checkin",
+		filters=[["employee", "=", employee], ["time", ">=", start], ["time", "<", end]],
+		fields=["log_type", "time"],
+	)
+	return {(getdate(row.time), row.log_type) for row in existing}
+
+
+def _validate_daily_punch(employee, log_type, checkin_time, punched=None):
+	"""
+	Ensure one IN and one OUT per employee per date, and that an OUT follows an IN.
+
+	This is an early answer counting every check-in of the day. Between two concurrent
+	mobile punches, the PUNCH_DATE_UNIQUE_KEY decides when the checkin is inserted (see
+	_insert_checkin).
+
+	Args:
+		employee (str): Employee ID
+		log_type (str): "IN" or "OUT"
+		checkin_time (datetime): Punch time
+		punched (set, optional): (date, log_type) pairs already punched, for batch callers
+			that preloaded them (see _get_punched_days). Queries the database if not given.
+	"""
+	punch_date = checkin_time.date()
+	if punched is None:
+		punched = _get_punches_between(employee, punch_date, punch_date)
+
+	if (punch_date, log_type) in punched:
+		_throw_already_punched(log_type, punch_date)
+
+	# If checking out, ensure there's a check-in record for today first
+	if log_type == "OUT" and (punch_date, "IN") not in punched:
+		raise ValidationError(
+			_("You must check-in before you can check-out. No check-in record found for {0}.").format(
+				punch_date.strftime("%B %d, %Y")
 			)
-		else:
-			distance = None
-		
-		# Validate required photos
-		location_photo_file = None
-		client_biometric_photo_file = None
-		
-		if settings["required_to_upload_location_photo"]:
-			if not location_photo and not location_photo_id:
-				action = "check-in" if log_type == "IN" else "check-out"
-				return {"exception": _("Location photo is required for {0}.").format(action)}
-			if location_photo_id and not frappe.db.exists("File", location_photo_id):
-				raise ValidationError(
-					_("Location photo file not found. Please upload the photo again.")
-				)
-		
-		if settings["required_to_upload_client_bio_metric_photo"]:
-			if not client_biometric_photo and not client_biometric_photo_id:
-				action = "check-in" if log_type == "IN" else "check-out"
-				return {
-					"exception": _("Client biometric photo is required for {0}.").format(action)
-				}
-			if client_biometric_photo_id and not frappe.db.exists("File", client_biometric_photo_id):
-				raise ValidationError(
-					_("Client biometric photo file not found. Please upload the photo again.")
-				)
-		
-		# Parse timestamp
-		if timestamp:
-			try:
-				checkin_time = get_datetime(timestamp)
-				if checkin_time.tzinfo is not None:
-					from datetime import timezone
-					checkin_time = checkin_time.astimezone(timezone.utc).replace(tzinfo=None)
-				checkin_time = checkin_time.replace(microsecond=0)
-			except Exception as e:
-				raise ValidationError(
-					_("Invalid timestamp format. Please use ISO 8601 format (e.g., 2025-01-27T09:15:30Z). Error: {0}").format(
-						str(e)
-					)
-				)
-		else:
-			checkin_time = get_datetime().replace(microsecond=0)
-		
-		# Ensure only one IN and one OUT per employee per date
-		from datetime import timedelta
-		start_of_day = checkin_time.replace(hour=0, minute=0, second=0, microsecond=0)
-		end_of_day = start_of_day + timedelta(days=1)
-		
-		# If checking out, ensure there's a check-in record for today first
-		if log_type == "OUT":
-			checkin_exists = frappe.db.exists(
-				"Employee Checkin",
-				{
-					"employee": employee.name,
-					"log_type": "IN",
-					"time": ["between", [start_of_day, end_of_day]],
-				},
+		)
+
+
+def _get_queued_punched_day(employee, punch_date):
+	"""
+	Load the punches of the employee on punch_date, including those accepted by the punch
+	queue and not inserted yet (see punch_queue.py).
+	Returns: set of (date, log_type)
+	"""
+	punched = _get_punches_between(employee, punch_date, punch_date)
+	punched.update((punch_date, log_type) for log_type in punch_queue.get_marks(employee, punch_date))
+	return punched
+
+
+def _throw_already_punched(log_type, punch_date):
+	action = "check-in" if log_type == "IN" else "check-out"
+	raise ValidationError(
+		_(
+			"You have already completed your {0} for {1}. Only one check-in and one check-out are allowed per day."
+		).format(action, punch_date.strftime("%B %d, %Y"))
+	)
+
+
+def _create_checkin(
+	employee,
+	log_type="IN",
+	latitude=None,
+	longitude=None,
+	device_id=None,
+	location_photo=None,
+	client_biometric_photo=None,
+	timestamp=None,
+	notes=None,
+	location_photo_id=None,
+	client_biometric_photo_id=None,
+	punched=None,
+	commit=True,
+	defer_photos=False,
+	queued=False,
+):
+	"""
+	Validate and create one punch for an employee, and attach its photos.
+
+	Shared by create_checkin_checkout and sync_offline_punches. Photos may be multipart
+	files, base64 strings, bytes or File IDs.
+
+	Args:
+		employee (frappe._dict): Resolved employee settings (see _get_checkin_employee)
+		punched (set, optional): Preloaded (date, log_type) pairs for the daily rule; the
+			new punch is added to it on success.
+		commit (bool, optional): Commit after inserting the checkin. Batch callers commit once.
+		defer_photos (bool, optional): Save uploaded photos in a background job.
+		queued (bool, optional): Add the validated punch to the punch queue instead of
+			inserting it (see punch_queue.py).
+
+	Returns:
+		dict: Success response (accepted receipt when queued), or {"exception": ...} when a
+		required photo is missing
+
+	Raises:
+		ValidationError, DoesNotExistError, CheckinRadiusExceededError
+	"""
+	# Validate log_type
+	if log_type not in ("IN", "OUT"):
+		raise ValidationError(_("Invalid log_type. Must be 'IN' for check-in or 'OUT' for check-out."))
+
+	# Get employee settings and branch info
+	with metrics.span("settings"):
+		settings = _get_employee_settings(employee)
+
+	# Validate location
+	if log_type == "IN":
+		if not latitude or not longitude:
+			raise ValidationError(
+				_("Location is required for check-in. Please provide latitude and longitude.")
 			)
-			if not checkin_exists:
-				date_str = start_of_day.date().strftime("%B %d, %Y")
-				raise ValidationError(
-					_(
-						"You must check-in before you can check-out. No check-in record found for {0}."
-					).format(date_str)
-				)
-		
-		existing_count = frappe.db.count(
-			"Employee Checkin",
-			filters={
-				"employee": employee.name,
-				"log_type": log_type,
-				"time": ["between", [start_of_day, end_of_day]],
-			},
+		geofence_match = _validate_location(
+			latitude,
+			longitude,
+			settings["allowed_branches"],
+			log_type,
 		)
-		if existing_count > 0:
-			action = "check-in" if log_type == "IN" else "check-out"
-			date_str = start_of_day.date().strftime("%B %d, %Y")
+	elif settings["require_location_check_on_check_out"]:
+		if not latitude or not longitude:
 			raise ValidationError(
-				_(
-					"You have already completed your {0} for {1}. Only one check-in and one check-out are allowed per day."
-				).format(action, date_str)
+				_("Location is required for check-out. Please provide latitude and longitude.")
 			)
-		
-		# Create Employee Checkin record
-		checkin_doc = frappe.new_doc("Employee Checkin")
-		checkin_doc.employee = employee.name
-		checkin_doc.employee_name = getattr(employee, "employee_name", None) or employee.name
-		checkin_doc.log_type = log_type
-		checkin_doc.time = checkin_time
-		checkin_doc.latitude = float(latitude) if latitude else None
-		checkin_doc.longitude = float(longitude) if longitude else None
-		checkin_doc.device_id = device_id
-		if notes and hasattr(checkin_doc, "notes"):
-			checkin_doc.notes = notes
-		
+		geofence_match = _validate_location(
+			latitude,
+			longitude,
+			settings["allowed_branches"],
+			log_type,
+		)
+	else:
+		geofence_match = None
+
+	# Validate required photos
+	if settings["required_to_upload_location_photo"]:
+		if not location_photo and not location_photo_id:
+			metrics.reject("photo_required")
+			action = "check-in" if log_type == "IN" else "check-out"
+			return {"exception": _("Location photo is required for {0}.").format(action)}
+		if location_photo_id and not frappe.db.exists("File", location_photo_id):
+			raise ValidationError(_("Location photo file not found. Please upload the photo again."))
+
+	if settings["required_to_upload_client_bio_metric_photo"]:
+		if not client_biometric_photo and not client_biometric_photo_id:
+			metrics.reject("photo_required")
+			action = "check-in" if log_type == "IN" else "check-out"
+			return {"exception": _("Client biometric photo is required for {0}.").format(action)}
+		if client_biometric_photo_id and not frappe.db.exists("File", client_biometric_photo_id):
+			raise ValidationError(_("Client biometric photo file not found. Please upload the photo again."))
+
+	# Parse timestamp
+	checkin_time = _parse_checkin_time(timestamp)
+
+	# Ensure only one IN and one OUT per employee per date
+	with metrics.span("daily_rule"):
+		if queued:
+			punched = _get_queued_punched_day(employee.name, checkin_time.date())
+		_validate_daily_punch(employee.name, log_type, checkin_time, punched)
+
+	# Stage uploaded photos before the checkin exists; staging files not saved below are
+	# removed in the finally block
+	staged_photos = {}
+	try:
+		with metrics.span("photo_decode"):
+			staged_photos["location"] = _stage_photo_upload(location_photo)
+			staged_photos["biometric"] = _stage_photo_upload(client_biometric_photo)
+		if queued:
+			with metrics.span("enqueue"):
+				if not punch_queue.mark(employee.name, checkin_time.date(), log_type):
+					# A concurrent request had the same punch accepted
+					_throw_already_punched(log_type, checkin_time.date())
+				response = punch_queue.enqueue(
+					employee,
+					log_type,
+					checkin_time,
+					latitude,
+					longitude,
+					device_id,
+					notes,
+					geofence_match,
+					staged_photos,
+					location_photo_id,
+					client_biometric_photo_id,
+				)
+			if response is not None:
+				return response
+			# The queue is unavailable: insert the punch in the request
+			punch_queue.unmark(employee.name, checkin_time.date(), log_type)
+		return _insert_checkin(
+			employee,
+			log_type,
+			checkin_time,
+			latitude,
+			longitude,
+			device_id,
+			notes,
+			geofence_match,
+			staged_photos,
+			location_photo_id,
+			client_biometric_photo_id,
+			punched,
+			commit,
+			defer_photos,
+		)
+	finally:
+		for staged_photo in staged_photos.values():
+			if staged_photo and not isinstance(staged_photo, str):
+				photo_storage.discard_staged_photo(staged_photo)
+
+
+def _insert_checkin(
+	employee,
+	log_type,
+	checkin_time,
+	latitude,
+	longitude,
+	device_id,
+	notes,
+	geofence_match,
+	staged_photos,
+	location_photo_id,
+	client_biometric_photo_id,
+	punched,
+	commit,
+	defer_photos=False,
+):
+	"""
+	Insert a validated punch and attach its photos (second half of _create_checkin).
+	Returns: success response
+	"""
+	location_photo_file = None
+	client_biometric_photo_file = None
+
+	# Create Employee Checkin record
+	checkin_doc = frappe.new_doc("Employee Checkin")
+	checkin_doc.employee = employee.name
+	checkin_doc.employee_name = getattr(employee, "employee_name", None) or employee.name
+	checkin_doc.log_type = log_type
+	checkin_doc.time = checkin_time
+	checkin_doc.latitude = float(latitude) if latitude else None
+	checkin_doc.longitude = float(longitude) if longitude else None
+	checkin_doc.device_id = device_id
+	if checkin_doc.meta.has_field(PUNCH_DATE_FIELD):
+		checkin_doc.set(PUNCH_DATE_FIELD, checkin_time.date())
+	if notes and hasattr(checkin_doc, "notes"):
+		checkin_doc.notes = notes
+
+	with metrics.span("fetch_shift"):
 		checkin_doc.set_geolocation()
 		checkin_doc.fetch_shift()
-		
-		try:
+
+	try:
+		with metrics.span("insert"):
 			checkin_doc.insert()
-			frappe.db.commit()
-		except frappe.DuplicateEntryError:
-			raise ValidationError(
-				_("A check-in record already exists for this timestamp. Please wait a moment and try again, or use a different timestamp.")
-			)
-		except Exception as e:
-			msg = str(e)
-			if "duplicate" in msg.lower():
-				raise ValidationError(
-					_("A check-in record already exists for this timestamp. Please wait a moment and try again.")
-				)
-			raise ValidationError(_("Error creating check-in record: {0}").format(msg))
-		
-		# Upload and/or link photos
-		if location_photo:
-			location_photo_file = _handle_photo_upload(
-				location_photo, employee.name, checkin_doc.name, "location"
+			if commit:
+				frappe.db.commit()
+			else:
+				# Committed with the caller's batch; delta sync must see the commit time
+				checkin_sync.touch_on_commit(checkin_doc.name)
+	except frappe.DuplicateEntryError:
+		raise ValidationError(
+			_(
+				"A check-in record already exists for this timestamp. Please wait a moment and try again, or use a different timestamp."
 			)
-		elif location_photo_id and frappe.db.exists("File", location_photo_id):
-			file_doc = frappe.get_doc("File", location_photo_id)
-			file_doc.attached_to_doctype = "Employee Checkin"
-			file_doc.attached_to_name = checkin_doc.name
-			file_doc.save(ignore_permissions=True)
-			location_photo_file = file_doc
-		
-		if client_biometric_photo:
-			client_biometric_photo_file = _handle_photo_upload(
-				client_biometric_photo, employee.name, checkin_doc.name, "biometric"
+		)
+	except Exception as e:
+		msg = str(e)
+		if PUNCH_DATE_UNIQUE_KEY in msg:
+			# Already punched this log type today; drop frappe's generic "must be unique" message
+			frappe.clear_messages()
+			_throw_already_punched(log_type, checkin_time.date())
+		if "duplicate" in msg.lower():
+			raise ValidationError(
+				_("A check-in record already exists for this timestamp. Please wait a moment and try again.")
 			)
-		elif client_biometric_photo_id and frappe.db.exists("File", client_biometric_photo_id):
-			file_doc = frappe.get_doc("File", client_biometric_photo_id)
-			file_doc.attached_to_doctype = "Employee Checkin"
-			file_doc.attached_to_name = checkin_doc.name
-			file_doc.save(ignore_permissions=True)
-			client_biometric_photo_file = file_doc
-		
-		updated_values = {}
-		if location_photo_file and hasattr(checkin_doc, "custom_location_photo"):
-			updated_values["custom_location_photo"] = location_photo_file.file_url
-		if client_biometric_photo_file and hasattr(checkin_doc, "custom_client_bio_metric_photo"):
-			updated_values["custom_client_bio_metric_photo"] = client_biometric_photo_file.file_url
-		if updated_values:
+		raise ValidationError(_("Error creating check-in record: {0}").format(msg))
+
+	# In deferred mode, uploaded photos are handed to a background job as they are
+	deferred = {}
+	if defer_photos:
+		for photo_type, staged_photo in staged_photos.items():
+			if staged_photo and not isinstance(staged_photo, str):
+				deferred[photo_type] = staged_photo
+		if deferred:
+			deferred_photos.enqueue_attach_photos(checkin_doc.name, employee.name, deferred)
+
+	# Upload and/or link photos
+	if staged_photos.get("location") and "location" not in deferred:
+		location_photo_file = _handle_photo_upload(
+			staged_photos["location"], employee.name, checkin_doc.name, "location"
+		)
+	elif location_photo_id and frappe.db.exists("File", location_photo_id):
+		file_doc = frappe.get_doc("File", location_photo_id)
+		file_doc.attached_to_doctype = "Employee Checkin"
+		file_doc.attached_to_name = checkin_doc.name
+		file_doc.save(ignore_permissions=True)
+		location_photo_file = file_doc
+
+	if staged_photos.get("biometric") and "biometric" not in deferred:
+		client_biometric_photo_file = _handle_photo_upload(
+			staged_photos["biometric"], employee.name, checkin_doc.name, "biometric"
+		)
+	elif client_biometric_photo_id and frappe.db.exists("File", client_biometric_photo_id):
+		file_doc = frappe.get_doc("File", client_biometric_photo_id)
+		file_doc.attached_to_doctype = "Employee Checkin"
+		file_doc.attached_to_name = checkin_doc.name
+		file_doc.save(ignore_permissions=True)
+		client_biometric_photo_file = file_doc
+
+	updated_values = {}
+	if location_photo_file and hasattr(checkin_doc, "custom_location_photo"):
+		updated_values["custom_location_photo"] = location_photo_file.file_url
+	if client_biometric_photo_file and hasattr(checkin_doc, "custom_client_bio_metric_photo"):
+		updated_values["custom_client_bio_metric_photo"] = client_biometric_photo_file.file_url
+	if updated_values:
+		with metrics.span("set_value"):
 			frappe.db.set_value("Employee Checkin", checkin_doc.name, updated_values, update_modified=False)
-		
-		# Success response
-		response = {
-			"checkin_id": checkin_doc.name,
-			"employee_id": getattr(employee, "employee_code", None)
-			or getattr(employee, "employee_number", None)
-			or employee.name,
-			"employee_name": getattr(employee, "employee_name", None) or employee.name,
-			"log_type": log_type,
-			"time": checkin_doc.time.isoformat()
-			if hasattr(checkin_doc.time, "isoformat")
-			else str(checkin_doc.time),
-			"latitude": checkin_doc.latitude,
-			"longitude": checkin_doc.longitude,
-			"shift": checkin_doc.shift,
-			"shift_start": checkin_doc.shift_start.isoformat()
-			if checkin_doc.shift_start and hasattr(checkin_doc.shift_start, "isoformat")
-			else (str(checkin_doc.shift_start) if checkin_doc.shift_start else None),
-			"shift_end": checkin_doc.shift_end.isoformat()
-			if checkin_doc.shift_end and hasattr(checkin_doc.shift_end, "isoformat")
-			else (str(checkin_doc.shift_end) if checkin_doc.shift_end else None),
-			"attendance": checkin_doc.attendance,
-			"status": "success",
+
+	if punched is not None:
+		punched.add((checkin_time.date(), log_type))
+
+	# Success response
+	response = {
+		"checkin_id": checkin_doc.name,
+		"employee_id": getattr(employee, "employee_code", None)
+		or getattr(employee, "employee_number", None)
+		or employee.name,
+		"employee_name": getattr(employee, "employee_name", None) or employee.name,
+		"log_type": log_type,
+		"time": checkin_doc.time.isoformat()
+		if hasattr(checkin_doc.time, "isoformat")
+		else str(checkin_doc.time),
+		"latitude": checkin_doc.latitude,
+		"longitude": checkin_doc.longitude,
+		"shift": checkin_doc.shift,
+		"shift_start": checkin_doc.shift_start.isoformat()
+		if checkin_doc.shift_start and hasattr(checkin_doc.shift_start, "isoformat")
+		else (str(checkin_doc.shift_start) if checkin_doc.shift_start else None),
+		"shift_end": checkin_doc.shift_end.isoformat()
+		if checkin_doc.shift_end and hasattr(checkin_doc.shift_end, "isoformat")
+		else (str(checkin_doc.shift_end) if checkin_doc.shift_end else None),
+		"attendance": checkin_doc.attendance,
+		"status": "success",
+	}
+
+	if geofence_match is not None:
+		response["distance_from_branch_meters"] = round(geofence_match.distance, 2)
+		response["matched_branch"] = geofence_match.branch
+
+	if location_photo_file:
+		response["location_photo_url"] = location_photo_file.file_url
+		response["location_photo_id"] = location_photo_file.name
+
+	if client_biometric_photo_file:
+		response["client_biometric_photo_url"] = client_biometric_photo_file.file_url
+		response["client_biometric_photo_id"] = client_biometric_photo_file.name
+
+	if deferred:
+		response["photo_status"] = deferred_photos.PENDING
+		response["pending_photos"] = list(deferred)
+
+	return response
+
+
+@frappe.whitelist()
+@metrics.instrument
+def get_checkin_photo_status(checkin_id=None):
+	"""
+	Get the photo status of a checkin created with deferred photos.
+
+	Args:
+		checkin_id (str, required): Employee Checkin ID returned by create_checkin_checkout
+
+	Returns:
+		dict: {
+			"checkin_id": str,
+			"photo_status": "pending", "done" or "failed",
+			"location_photo_id" / "location_photo_url": once saved,
+			"client_biometric_photo_id" / "client_biometric_photo_url": once saved
 		}
-		
-		if distance is not None:
-			response["distance_from_branch_meters"] = round(distance, 2)
-		
-		if location_photo_file:
-			response["location_photo_url"] = location_photo_file.file_url
-			response["location_photo_id"] = location_photo_file.name
-		
-		if client_biometric_photo_file:
-			response["client_biometric_photo_url"] = client_biometric_photo_file.file_url
-			response["client_biometric_photo_id"] = client_biometric_photo_file.name
-		
-		return response
-	
-	# Convert known validation-type errors into the minimal mobile format
-	except (ValidationError, DoesNotExistError, CheckinRadiusExceededError) as e:
-		# Set HTTP status code to 401 for validation errors (including duplicate check-ins)
-		frappe.local.response.http_status_code = 401
-		return {"exception": str(e)}
-	except Exception as e:
-		# Log unexpected errors for debugging, but still return a clean message to mobile
-		frappe.log_error(title="Checkin API Unexpected Error", message=str(e))
-		frappe.local.response.http_status_code = 500
+
+	Raises:
+		DoesNotExistError: If the checkin is not found
+		PermissionError: If the checkin belongs to another employee
+	"""
+	limited = rate_limits.check("get_checkin_photo_status")
+	if limited:
+		return limited
+
+	if not checkin_id:
+		frappe.throw(_("checkin_id is required."), ValidationError)
+
+	checkin_meta = frappe.get_meta("Employee Checkin")
+	fields = ["name", "employee"]
+	fields.extend(
+		fieldname for fieldname in PHOTO_CUSTOM_FIELDS.values() if checkin_meta.has_field(fieldname)
+	)
+	checkin = frappe.db.get_value("Employee Checkin", checkin_id, fields, as_dict=True)
+	if not checkin:
+		frappe.throw(_("Check-in record {0} not found.").format(checkin_id), DoesNotExistError)
+
+	if checkin.employee != get_employee_for_user(frappe.session.user):
+		frappe.has_permission("Employee Checkin", "read", checkin_id, throw=True)
+
+	response = {"checkin_id": checkin.name}
+
+	status = deferred_photos.get_status(checkin.name)
+	if status and status["status"] != deferred_photos.DONE:
+		response["photo_status"] = status["status"]
+		photos = {
+			photo_type: frappe._dict(name=photo["file_id"], file_url=photo["file_url"])
+			for photo_type, photo in status["photos"].items()
+			if photo.get("file_id")
+		}
+	else:
+		# Saved (or never deferred): read what is attached to the checkin
+		response["photo_status"] = deferred_photos.DONE
+		photos = _get_checkin_photos([checkin]).get(checkin.name, {})
+
+	if photos.get("location"):
+		response["location_photo_id"] = photos["location"].name
+		response["location_photo_url"] = photos["location"].file_url
+	if photos.get("biometric"):
+		response["client_biometric_photo_id"] = photos["biometric"].name
+		response["client_biometric_photo_url"] = photos["biometric"].file_url
+
+	return response
+
+
+@frappe.whitelist()
+@metrics.instrument
+def get_punch_receipt_status(receipt_id=None):
+	"""
+	Get the outcome of a punch accepted by the punch queue (create_checkin_checkout with queued).
+
+	Args:
+		receipt_id (str, required): Receipt ID returned by create_checkin_checkout
+
+	Returns:
+		dict: {
+			"receipt_id": str,
+			"receipt_status": "queued", "done" or "failed",
+			"log_type": str,
+			"time": str,
+			"error": rejection message, once failed
+		}
+		Once done, the create_checkin_checkout success response is included
+		("checkin_id", "shift", ..., "status": "success").
+
+	Raises:
+		DoesNotExistError: If the receipt is unknown or expired (after 24 hours)
+		PermissionError: If the receipt belongs to another employee the user may not read
+	"""
+	limited = rate_limits.check("get_punch_receipt_status")
+	if limited:
+		return limited
+
+	if not receipt_id:
+		frappe.throw(_("receipt_id is required."), ValidationError)
+
+	status = punch_queue.get_status(receipt_id)
+	if not status:
+		frappe.throw(_("Receipt {0} not found or expired.").format(receipt_id), DoesNotExistError)
+
+	if status["user"] != frappe.session.user and status["employee"] != get_employee_for_user(
+		frappe.session.user
+	):
+		# Receipts of other employees need access to that employee
+		frappe.has_permission("Employee", "read", status["employee"], throw=True)
+
+	response = {
+		"receipt_id": receipt_id,
+		"receipt_status": status["status"],
+		"log_type": status["log_type"],
+		"time": status["time"],
+	}
+	if status["status"] == punch_queue.DONE:
+		response.update(status["checkin"] or {})
+	elif status["status"] == punch_queue.FAILED:
+		response["error"] = status["error"]
+
+	return response
+
+
+def _get_checkin_photos(checkin_records):
+	"""
+	Resolve location and biometric photos for a page of checkin records.
+
+	Replaces the per-row File lookups with one query for every File attached to the
+	page's checkins, grouped in Python by checkin and photo type. The most recent
+	attached file whose name carries the photo type marker wins; otherwise the
+	checkin's custom photo field (File name or file_url) is matched against the
+	attached files. Only references pointing at files that are not attached to the
+	checkin need a second, equally batched query.
+
+	Args:
+		checkin_records (list): Employee Checkin rows (must include ``name`` and, when
+			present on the doctype, the custom photo fields)
+
+	Returns:
+		dict: {checkin name: {"location": File row, "biometric": File row}}
+	"""
+	names = [record.name for record in checkin_records]
+	if not names:
+		return {}
+
+	attached_files = frappe.get_all(
+		"File",
+		filters={
+			"attached_to_doctype": "Employee Checkin",
+			"attached_to_name": ["in", names],
+		},
+		fields=["name", "file_name", "file_url", "thumbnail_url", "attached_to_name"],
+		order_by="creation desc",
+	)
+
+	files_by_checkin = {}
+	for file_row in attached_files:
+		files_by_checkin.setdefault(file_row.attached_to_name, []).append(file_row)
+
+	photos_by_checkin = {}
+	unresolved = []
+	for record in checkin_records:
+		files = files_by_checkin.get(record.name, [])
+		photos = {}
+		for photo_type, marker in PHOTO_FILE_MARKERS.items():
+			# Most recent file whose name carries the photo type marker
+			photo = next((f for f in files if marker in (f.file_name or "")), None)
+			if not photo:
+				# Fall back to the reference stored on the checkin itself
+				reference = record.get(PHOTO_CUSTOM_FIELDS[photo_type])
+				if reference:
+					photo = next((f for f in files if reference in (f.name, f.file_url)), None)
+					if not photo:
+						unresolved.append((record.name, photo_type, reference))
+			if photo:
+				photos[photo_type] = photo
+		photos_by_checkin[record.name] = photos
+
+	if unresolved:
+		references = list({reference for _name, _photo_type, reference in unresolved})
+		referenced_files = frappe.get_all(
+			"File",
+			or_filters=[
+				["name", "in", references],
+				["file_url", "in", references],
+			],
+			fields=["name", "file_name", "file_url", "thumbnail_url", "attached_to_name"],
+			order_by="creation desc",
+		)
+		files_by_reference = {}
+		for file_row in referenced_files:
+			files_by_reference.setdefault(file_row.name, file_row)
+			files_by_reference.setdefault(file_row.file_url, file_row)
+		for checkin_name, photo_type, reference in unresolved:
+			if reference in files_by_reference:
+				photos_by_checkin[checkin_name][photo_type] = files_by_reference[reference]
+
+	return photos_by_checkin
+
+
+def _get_photo_url(photo, photo_size="thumbnail"):
+	"""URL of a photo File row at the requested size (full size until a thumbnail exists)."""
+	if photo_size == "thumbnail" and photo.get("thumbnail_url"):
+		return photo.thumbnail_url
+	return photo.file_url
+
+
+def _get_checkin_record_fields():
+	"""Employee Checkin fields read for history records, including the photo custom fields."""
+	fields = [
+		"name",
+		"employee",
+		"employee_name",
+		"log_type",
+		"time",
+		"latitude",
+		"longitude",
+		"device_id",
+		"shift",
+		"shift_start",
+		"shift_end",
+		"attendance",
+		"skip_auto_attendance",
+		"geolocation",
+	]
+	# Read the photo custom fields with the page instead of loading each checkin doc
+	checkin_meta = frappe.get_meta("Employee Checkin")
+	fields.extend(
+		fieldname for fieldname in PHOTO_CUSTOM_FIELDS.values() if checkin_meta.has_field(fieldname)
+	)
+	return fields
+
+
+def _build_checkin_record(record, employee_code, photos, photo_size="thumbnail"):
+	"""
+	Build one history record from an Employee Checkin row and its photos
+	(see _get_checkin_photos).
+	"""
+	record_data = {
+		"checkin_id": record.name,
+		"employee_id": employee_code,
+		"employee_name": record.employee_name or record.employee,
+		"log_type": record.log_type,
+		"time": record.time.isoformat() if hasattr(record.time, "isoformat") else str(record.time),
+		"latitude": record.latitude,
+		"longitude": record.longitude,
+		"device_id": record.device_id,
+		"shift": record.shift,
+		"shift_start": record.shift_start.isoformat()
+		if record.shift_start and hasattr(record.shift_start, "isoformat")
+		else (str(record.shift_start) if record.shift_start else None),
+		"shift_end": record.shift_end.isoformat()
+		if record.shift_end and hasattr(record.shift_end, "isoformat")
+		else (str(record.shift_end) if record.shift_end else None),
+		"attendance": record.attendance,
+		"skip_auto_attendance": record.skip_auto_attendance,
+	}
+
+	# Add photo information
+	location_photo = photos.get("location")
+	if location_photo:
+		record_data["location_photo_id"] = location_photo.name
+		record_data["location_photo_url"] = _get_photo_url(location_photo, photo_size)
+		record_data["location_photo_full_url"] = location_photo.file_url
+
+	biometric_photo = photos.get("biometric")
+	if biometric_photo:
+		record_data["client_biometric_photo_id"] = biometric_photo.name
+		record_data["client_biometric_photo_url"] = _get_photo_url(biometric_photo, photo_size)
+		record_data["client_biometric_photo_full_url"] = biometric_photo.file_url
+
+	return record_data
+
+
+def _is_compact_format(response_format):
+	"""Validate the response_format parameter of the list endpoints. Returns: True for "compact"."""
+	if response_format in (None, "", "default"):
+		return False
+	if response_format != "compact":
+		frappe.throw(_("response_format must be 'default' or 'compact'."), ValidationError)
+	return True
+
+
+def _build_compact_records(
+	checkin_records, employee_code, employee_name, photos_by_checkin, photo_size="thumbnail"
+):
+	"""
+	Columnar form of a page of history records (see COMPACT_CHECKIN_COLUMNS): fields shared
+	by every row are given once, and times are epoch seconds.
+	Returns: dict with "format", "employee_id", "employee_name", "columns" and "rows"
+	"""
+	rows = []
+	for record in checkin_records:
+		photos = photos_by_checkin.get(record.name, {})
+		location_photo = photos.get("location")
+		biometric_photo = photos.get("biometric")
+		rows.append(
+			[
+				record.name,
+				record.log_type,
+				_to_epoch(record.time),
+				record.latitude,
+				record.longitude,
+				record.device_id,
+				record.shift,
+				_to_epoch(record.shift_start),
+				_to_epoch(record.shift_end),
+				record.attendance,
+				record.skip_auto_attendance,
+				location_photo.name if location_photo else None,
+				_get_photo_url(location_photo, photo_size) if location_photo else None,
+				location_photo.file_url if location_photo else None,
+				biometric_photo.name if biometric_photo else None,
+				_get_photo_url(biometric_photo, photo_size) if biometric_photo else None,
+				biometric_photo.file_url if biometric_photo else None,
+			]
+		)
+
+	return {
+		"format": "compact",
+		"employee_id": employee_code,
+		"employee_name": employee_name,
+		"columns": list(COMPACT_CHECKIN_COLUMNS),
+		"rows": rows,
+	}
+
+
+def _build_summary_records(checkin_records, employee_code, employee_name, compact=False):
+	"""
+	Summary view of a page of history records: checkin_id, log_type and time only.
+	In the compact format the rows follow SUMMARY_CHECKIN_COLUMNS.
+	"""
+	if compact:
 		return {
-			"exception": _(
-				"Something went wrong while creating your check-in. Please try again or contact support."
-			)
+			"format": "compact",
+			"employee_id": employee_code,
+			"employee_name": employee_name,
+			"columns": list(SUMMARY_CHECKIN_COLUMNS),
+			"rows": [[record.name, record.log_type, _to_epoch(record.time)] for record in checkin_records],
 		}
+
+	return {
+		"records": [
+			{
+				"checkin_id": record.name,
+				"log_type": record.log_type,
+				"time": record.time.isoformat() if hasattr(record.time, "isoformat") else str(record.time),
+			}
+			for record in checkin_records
+		]
+	}
+
+
+def _to_epoch(value):
+	"""Epoch seconds of a stored (naive UTC) datetime, or None."""
+	if not value:
+		return None
+	if not isinstance(value, datetime):
+		value = get_datetime(value)
+	return calendar.timegm(value.timetuple())
+
+
+def _encode_checkin_cursor(record):
+	"""
+	Build the opaque pagination cursor for the last record of a page.
+	Returns: URL-safe base64 string encoding the record's (time, name) key
+	"""
+	time = record.time.isoformat() if hasattr(record.time, "isoformat") else str(record.time)
+	payload = json.dumps([time, record.name], separators=(",", ":"))
+	return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def _decode_checkin_cursor(cursor):
+	"""
+	Decode a cursor produced by _encode_checkin_cursor.
+	Returns: tuple (time as datetime, name)
+	Raises ValidationError if the cursor is malformed.
+	"""
+	try:
+		padded = cursor + "=" * (-len(cursor) % 4)
+		time, name = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+		return get_datetime(time), name
+	except Exception:
+		frappe.throw(_("Invalid cursor. Please restart pagination from the first page."), ValidationError)
+
+
 @frappe.whitelist()
+@metrics.instrument
 def get_employee_checkin_records(
 	employee_id=None,
 	log_type=None,
 	start_date=None,
 	end_date=None,
 	limit=None,
-	offset=0
+	offset=0,
+	cursor=None,
+	include_total=False,
+	photo_size="thumbnail",
+	response_format=None,
+	view="full",
 ):
 	"""
 	Get all check-in and check-out records for the logged-in employee.
-	
+
 	This endpoint retrieves all Employee Checkin records for the authenticated employee,
 	with optional filtering by log_type, date range, and pagination.
-	
+
+	Two pagination modes are supported:
+	- Offset mode (default): ``limit``/``offset`` with a ``total_count`` on every call.
+	- Cursor mode: pass ``cursor`` (an empty string for the first page, then the
+	  ``next_cursor`` of the previous response). Pages are read with a keyset seek on
+	  ``(time, name)``, so every page costs the same, and the total count is skipped
+	  unless ``include_total`` is set.
+
+	Screens that only need when and how the employee punched can ask for
+	``view="summary"``: records then carry only ``checkin_id``, ``log_type`` and ``time``,
+	read by a single index-covered query, and no photos are looked up. The summary view
+	also skips the total count in offset mode unless ``include_total`` is set.
+
 	Args:
 		employee_id (str, optional): Employee ID. If not provided, uses authenticated user's employee.
 		log_type (str, optional): Filter by log type ("IN" or "OUT"). If not provided, returns all.
@@ -969,22 +1770,47 @@ def get_employee_checkin_records(
 		end_date (str, optional): End date filter (ISO 8601 format or YYYY-MM-DD). If not provided, no end limit.
 		limit (int, optional): Maximum number of records to return. Defaults to 100 if not specified.
 		offset (int, optional): Number of records to skip for pagination. Defaults to 0.
-	
+			Ignored in cursor mode.
+		cursor (str, optional): Opaque cursor returned as ``next_cursor``. Enables cursor mode.
+		include_total (bool, optional): In cursor mode and in the summary view, also return
+			``total_count``. Defaults to False.
+		photo_size (str, optional): "thumbnail" (default) or "full". Selects which image the
+			``*_photo_url`` fields point to; ``*_photo_full_url`` always holds the full-size photo.
+			Thumbnails are created in the background, so the full URL is used until one exists.
+		response_format (str, optional): "compact" for the columnar format: the employee is
+			given once, ``records`` is replaced by ``columns`` (COMPACT_CHECKIN_COLUMNS) and
+			``rows``, and times are epoch seconds (UTC). Compact responses are msgpack or
+			JSON (by the Accept header) and gzipped if the client accepts it.
+		view (str, optional): "full" (default) or "summary", see above.
+
 	Returns:
 		dict: {
 			"records": [list of checkin records],
-			"total_count": total number of records matching filters,
+			"total_count": total number of records matching filters (cursor mode and summary
+				view: only if include_total),
 			"limit": limit applied,
-			"offset": offset applied,
-			"has_more": boolean indicating if more records are available
+			"offset": offset applied (offset mode only),
+			"has_more": boolean indicating if more records are available,
+			"next_cursor": cursor for the next page, or None when there are no more records
 		}
-	
+
 	Raises:
 		DoesNotExistError: If employee not found
 		ValidationError: If invalid parameters provided
 	"""
+	limited = rate_limits.check("get_employee_checkin_records")
+	if limited:
+		return limited
+
+	if view not in HISTORY_VIEWS:
+		frappe.throw(_("view must be 'full' or 'summary'."), ValidationError)
+	summary = view == "summary"
+
 	# Get employee record
-	if employee_id:
+	if summary:
+		# The summary view only needs the employee's identity, not the whole document
+		employee = _get_employee_identity(employee_id)
+	elif employee_id:
 		employee = frappe.get_doc("Employee", employee_id)
 	else:
 		# Get employee from authenticated user
@@ -992,32 +1818,30 @@ def get_employee_checkin_records(
 		if not employee_name:
 			frappe.throw(_("Employee not found for user {0}").format(frappe.session.user), DoesNotExistError)
 		employee = frappe.get_doc("Employee", employee_name)
-	
+
 	# Build filters
 	filters = {"employee": employee.name}
-	
+
 	# Add log_type filter if provided
 	if log_type:
 		if log_type not in ["IN", "OUT"]:
 			frappe.throw(_("log_type must be 'IN' or 'OUT'."), ValidationError)
 		filters["log_type"] = log_type
-	
+
 	# Add date filters if provided
-	from datetime import timezone, timedelta
-	
 	if start_date and end_date:
 		# Both dates provided - use between filter
 		try:
 			start_datetime = get_datetime(start_date)
 			if start_datetime.tzinfo is not None:
 				start_datetime = start_datetime.astimezone(timezone.utc).replace(tzinfo=None)
-			
+
 			end_datetime = get_datetime(end_date)
 			if end_datetime.tzinfo is not None:
 				end_datetime = end_datetime.astimezone(timezone.utc).replace(tzinfo=None)
 			# Add one day to include the entire end date
 			end_datetime = end_datetime + timedelta(days=1)
-			
+
 			filters["time"] = ["between", [start_datetime, end_datetime]]
 		except Exception:
 			frappe.throw(_("Invalid date format. Use ISO 8601 format or YYYY-MM-DD."), ValidationError)
@@ -1041,7 +1865,7 @@ def get_employee_checkin_records(
 			filters["time"] = ["<", end_datetime]
 		except Exception:
 			frappe.throw(_("Invalid end_date format. Use ISO 8601 format or YYYY-MM-DD."), ValidationError)
-	
+
 	# Set default limit
 	if limit is None:
 		limit = 100
@@ -1052,7 +1876,7 @@ def get_employee_checkin_records(
 				limit = 100
 		except (ValueError, TypeError):
 			limit = 100
-	
+
 	# Validate offset
 	try:
 		offset = int(offset)
@@ -1060,118 +1884,487 @@ def get_employee_checkin_records(
 			offset = 0
 	except (ValueError, TypeError):
 		offset = 0
-	
-	# Get total count
-	total_count = frappe.db.count("Employee Checkin", filters=filters)
-	
-	# Get records with pagination, ordered by time descending (most recent first)
+
+	if photo_size not in ("thumbnail", "full"):
+		frappe.throw(_("photo_size must be 'thumbnail' or 'full'."), ValidationError)
+	compact = _is_compact_format(response_format)
+
+	use_cursor = cursor is not None
+	include_total = _to_bool(include_total)
+
+	# Get total count (cursor mode and the summary view only count on request; it scans
+	# the whole filtered range)
+	total_count = None
+	if (not use_cursor and not summary) or include_total:
+		total_count = frappe.db.count("Employee Checkin", filters=filters)
+
+	fields = SUMMARY_CHECKIN_FIELDS if summary else _get_checkin_record_fields()
+
+	# Get records with pagination, ordered by time descending (most recent first).
+	# name breaks ties between punches sharing a timestamp so pages never overlap.
+	if use_cursor:
+		query_filters = [
+			[fieldname, *condition] if isinstance(condition, list) else [fieldname, "=", condition]
+			for fieldname, condition in filters.items()
+		]
+		or_filters = None
+		if cursor:
+			cursor_time, cursor_name = _decode_checkin_cursor(cursor)
+			# Keyset seek: (time, name) < (cursor_time, cursor_name)
+			query_filters.append(["time", "<=", cursor_time])
+			or_filters = [["time", "<", cursor_time], ["name", "<", cursor_name]]
+		# Fetch one extra row to learn whether another page exists without counting
+		checkin_records = frappe.get_all(
+			"Employee Checkin",
+			filters=query_filters,
+			or_filters=or_filters,
+			fields=fields,
+			order_by="time desc, name desc",
+			limit=limit + 1,
+		)
+		has_more = len(checkin_records) > limit
+		checkin_records = checkin_records[:limit]
+	elif total_count is None:
+		# Summary view without a count: learn about the next page from one extra row
+		checkin_records = frappe.get_all(
+			"Employee Checkin",
+			filters=filters,
+			fields=fields,
+			order_by="time desc, name desc",
+			limit=limit + 1,
+			start=offset,
+		)
+		has_more = len(checkin_records) > limit
+		checkin_records = checkin_records[:limit]
+	else:
+		checkin_records = frappe.get_all(
+			"Employee Checkin",
+			filters=filters,
+			fields=fields,
+			order_by="time desc, name desc",
+			limit=limit,
+			start=offset,
+		)
+		has_more = (offset + limit) < total_count
+
+	employee_code = (
+		getattr(employee, "employee_code", None)
+		or getattr(employee, "employee_number", None)
+		or employee.name
+	)
+
+	if summary:
+		# No photo lookups in the summary view
+		response = _build_summary_records(
+			checkin_records, employee_code, employee.employee_name or employee.name, compact
+		)
+	else:
+		# Resolve photos for the whole page in one set-based pass (no per-row queries)
+		photos_by_checkin = _get_checkin_photos(checkin_records)
+		if compact:
+			response = _build_compact_records(
+				checkin_records,
+				employee_code,
+				employee.employee_name or employee.name,
+				photos_by_checkin,
+				photo_size,
+			)
+		else:
+			response = {
+				"records": [
+					_build_checkin_record(
+						record, employee_code, photos_by_checkin.get(record.name, {}), photo_size
+					)
+					for record in checkin_records
+				]
+			}
+
+	# Build response
+	response.update(
+		{
+			"limit": limit,
+			"has_more": has_more,
+			"next_cursor": _encode_checkin_cursor(checkin_records[-1])
+			if has_more and checkin_records
+			else None,
+		}
+	)
+	if total_count is not None:
+		response["total_count"] = total_count
+	if not use_cursor:
+		response["offset"] = offset
+
+	if compact and get_request() is not None:
+		return encoded_response(response)
+
+	return response
+
+
+@frappe.whitelist()
+@metrics.instrument
+def sync_employee_checkin_records(
+	employee_id=None, sync_token=None, limit=None, photo_size="thumbnail", response_format=None
+):
+	"""
+	Delta sync of an employee's check-in history.
+
+	The first call (without ``sync_token``) returns the whole history, in batches. Later
+	calls send the ``sync_token`` of the previous response and only get the check-ins
+	created or modified since then (e.g. ``attendance`` or ``shift`` filled in by HR, or a
+	photo saved in the background), plus the IDs of deleted check-ins. Records are in
+	the same format as get_employee_checkin_records.
+
+	While ``has_more`` is true, call again right away with the new ``sync_token``. Deleted
+	IDs are reported with the last batch.
+
+	Args:
+		employee_id (str, optional): Employee ID. Defaults to the authenticated user's employee.
+		sync_token (str, optional): ``sync_token`` of the previous response
+		limit (int, optional): Records per batch. Defaults to 200, at most 500.
+		photo_size (str, optional): "thumbnail" (default) or "full", as in get_employee_checkin_records
+		response_format (str, optional): "compact", as in get_employee_checkin_records
+
+	Returns:
+		dict: {
+			"records": [created or modified checkin records, oldest change first],
+			"deleted": [IDs of checkins deleted since the previous sync],
+			"has_more": bool,
+			"sync_token": str, to send with the next sync
+		}
+
+	Raises:
+		DoesNotExistError: If employee not found
+		ValidationError: If invalid parameters provided
+		PermissionError: If the employee is not the user's own and the user may not read it
+	"""
+	limited = rate_limits.check("sync_employee_checkin_records")
+	if limited:
+		return limited
+
+	# Reading history needs no check-in settings, so a branch or project that is not fully
+	# configured does not matter here
+	employee = _get_employee_identity(employee_id)
+	if employee.name != get_employee_for_user(frappe.session.user):
+		frappe.has_permission("Employee", "read", employee.name, throw=True)
+
+	try:
+		limit = min(int(limit), MAX_SYNC_LIMIT) if limit else DEFAULT_SYNC_LIMIT
+	except (ValueError, TypeError):
+		limit = DEFAULT_SYNC_LIMIT
+	if limit < 1:
+		limit = DEFAULT_SYNC_LIMIT
+
+	if photo_size not in ("thumbnail", "full"):
+		frappe.throw(_("photo_size must be 'thumbnail' or 'full'."), ValidationError)
+	compact = _is_compact_format(response_format)
+
+	since, last_modified, last_name = _decode_sync_token(sync_token) if sync_token else (None, None, None)
+	until = get_datetime() - timedelta(seconds=SYNC_LAG_SECONDS)
+
+	filters = [["employee", "=", employee.name], ["modified", "<=", until]]
+	or_filters = None
+	if last_modified:
+		# Keyset seek: (modified, name) > (last_modified, last_name)
+		filters.append(["modified", ">=", last_modified])
+		or_filters = [["modified", ">", last_modified], ["name", ">", last_name]]
+
 	checkin_records = frappe.get_all(
 		"Employee Checkin",
 		filters=filters,
-		fields=[
-			"name",
-			"employee",
-			"employee_name",
-			"log_type",
-			"time",
-			"latitude",
-			"longitude",
-			"device_id",
-			"shift",
-			"shift_start",
-			"shift_end",
-			"attendance",
-			"skip_auto_attendance",
-			"geolocation"
+		or_filters=or_filters,
+		fields=[*_get_checkin_record_fields(), "modified"],
+		order_by="modified asc, name asc",
+		limit=limit + 1,
+	)
+	has_more = len(checkin_records) > limit
+	checkin_records = checkin_records[:limit]
+
+	deleted = []
+	if has_more:
+		last = checkin_records[-1]
+		next_token = _encode_sync_token(since, last.modified, last.name)
+	else:
+		# Tombstones only matter to a client that synced before
+		if since:
+			deleted = _get_deleted_checkins(employee.name, since, until)
+		next_token = _encode_sync_token(until, until, "")
+
+	photos_by_checkin = _get_checkin_photos(checkin_records)
+	employee_code = (
+		getattr(employee, "employee_code", None)
+		or getattr(employee, "employee_number", None)
+		or employee.name
+	)
+
+	if compact:
+		response = _build_compact_records(
+			checkin_records,
+			employee_code,
+			employee.employee_name or employee.name,
+			photos_by_checkin,
+			photo_size,
+		)
+	else:
+		response = {
+			"records": [
+				_build_checkin_record(
+					record, employee_code, photos_by_checkin.get(record.name, {}), photo_size
+				)
+				for record in checkin_records
+			]
+		}
+	response.update({"deleted": deleted, "has_more": has_more, "sync_token": next_token})
+
+	if compact and get_request() is not None:
+		return encoded_response(response)
+
+	return response
+
+
+def _get_deleted_checkins(employee, since, until):
+	"""
+	IDs of the employee's checkins deleted in (since, until], from Deleted Document.
+	The employee is only stored in the deleted document's JSON, so it is prefiltered
+	with LIKE and checked after parsing.
+	"""
+	rows = frappe.get_all(
+		"Deleted Document",
+		filters=[
+			["deleted_doctype", "=", "Employee Checkin"],
+			["creation", ">", since],
+			["creation", "<=", until],
+			["data", "like", f'%"employee": {json.dumps(employee)}%'],
 		],
-		order_by="time desc",
-		limit=limit,
-		start=offset
+		fields=["deleted_name", "data"],
+		order_by="creation asc",
 	)
-	
-	# Get custom fields for location photo and biometric photo
-	records_with_photos = []
-	for record in checkin_records:
-		# Get location photo (get the most recent one if multiple exist)
-		location_photos = frappe.get_all(
-			"File",
-			filters={
-				"attached_to_doctype": "Employee Checkin",
-				"attached_to_name": record.name,
-				"file_name": ["like", "%location_photo%"]
-			},
-			fields=["name", "file_url"],
-			order_by="creation desc",
-			limit=1
+	deleted = []
+	for row in rows:
+		try:
+			if json.loads(row.data).get("employee") == employee:
+				deleted.append(row.deleted_name)
+		except (TypeError, ValueError):
+			continue
+	return deleted
+
+
+def _encode_sync_token(since, last_modified, last_name):
+	"""
+	Build the opaque sync token.
+	Returns: URL-safe base64 string encoding (since, last modified, last name)
+	"""
+	payload = json.dumps(
+		[str(since) if since else None, str(last_modified), last_name], separators=(",", ":")
+	)
+	return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def _decode_sync_token(sync_token):
+	"""
+	Decode a token produced by _encode_sync_token.
+	Returns: tuple (since, last modified, last name); datetimes, since may be None
+	Raises ValidationError if the token is malformed.
+	"""
+	try:
+		padded = sync_token + "=" * (-len(sync_token) % 4)
+		since, last_modified, last_name = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+		return (get_datetime(since) if since else None), get_datetime(last_modified), last_name
+	except Exception:
+		frappe.throw(_("Invalid sync_token. Please sync again without a token."), ValidationError)
+
+
+@frappe.whitelist()
+@metrics.instrument
+def get_team_attendance(branch=None, department=None, project=None, date=None):
+	"""
+	Get the check-in / check-out status of every active employee of a team for one day.
+
+	The team is a Branch, a Department, or a Project (employees whose Department is linked
+	to the Project via Department.custom_project, as in the settings resolution). Exactly
+	one of them must be given. All employees and their punches come from one grouped query.
+
+	Args:
+		branch (str, optional): Branch ID
+		department (str, optional): Department ID
+		project (str, optional): Project ID
+		date (str, optional): Day (YYYY-MM-DD). Defaults to today.
+
+	Returns:
+		dict: {
+			"date": str,
+			"employees": [{
+				"employee_id", "employee_name", "designation", "department", "branch",
+				"check_in": {"time", "distance_from_branch_meters", "has_location_photo",
+					"has_biometric_photo"} or None,
+				"check_out": same as check_in, or None
+			}],
+			"summary": {"total", "checked_in", "checked_out", "not_checked_in"}
+		}
+
+	Raises:
+		ValidationError: If the team or date is invalid
+		PermissionError: If the user may not report on check-ins or read the team
+	"""
+	limited = rate_limits.check("get_team_attendance")
+	if limited:
+		return limited
+
+	scopes = {"Branch": branch, "Department": department, "Project": project}
+	given = [(doctype, name) for doctype, name in scopes.items() if name]
+	if len(given) != 1:
+		frappe.throw(_("Please provide exactly one of branch, department or project."), ValidationError)
+	scope_doctype, scope_name = given[0]
+
+	# Supervisors need report access to check-ins and read access to the team
+	frappe.has_permission("Employee Checkin", "report", throw=True)
+	frappe.has_permission(scope_doctype, "read", scope_name, throw=True)
+
+	try:
+		day = getdate(date) if date else getdate()
+	except Exception:
+		frappe.throw(_("Invalid date format. Use YYYY-MM-DD."), ValidationError)
+
+	rows = _get_team_punches(scope_doctype, scope_name, day)
+
+	# Distances are measured from the employee's branch, read from the geofence index
+	branch_geofences = geofence.get_geofences({row.branch for row in rows if row.branch})
+
+	employees = []
+	summary = {"total": len(rows), "checked_in": 0, "checked_out": 0, "not_checked_in": 0}
+	for row in rows:
+		check_in = _get_team_punch(row, "in", branch_geofences)
+		check_out = _get_team_punch(row, "out", branch_geofences)
+		if check_in:
+			summary["checked_in"] += 1
+		else:
+			summary["not_checked_in"] += 1
+		if check_out:
+			summary["checked_out"] += 1
+		employees.append(
+			{
+				"employee_id": row.employee,
+				"employee_name": row.employee_name or row.employee,
+				"designation": row.designation,
+				"department": row.department,
+				"branch": row.branch,
+				"check_in": check_in,
+				"check_out": check_out,
+			}
 		)
-		location_photo = location_photos[0] if location_photos else None
-		
-		# Get biometric photo (get the most recent one if multiple exist)
-		biometric_photos = frappe.get_all(
-			"File",
-			filters={
-				"attached_to_doctype": "Employee Checkin",
-				"attached_to_name": record.name,
-				"file_name": ["like", "%biometric%"]
-			},
-			fields=["name", "file_url"],
-			order_by="creation desc",
-			limit=1
+
+	return {"date": str(day), "employees": employees, "summary": summary}
+
+
+def _get_team_punches(scope_doctype, scope_name, day):
+	"""
+	One grouped query: every active employee of the team, with the first IN and last OUT
+	of the day, their locations and photo flags.
+	Returns: list of frappe._dict, one per employee
+	"""
+	checkin_meta = frappe.get_meta("Employee Checkin")
+
+	def punch_columns(log_type, aggregate, order):
+		prefix = log_type.lower()
+		columns = [
+			f"{aggregate}(case when checkin.log_type = '{log_type}' then checkin.time end) as {prefix}_time",
+			# Location of the first IN / last OUT (group_concat skips the other log type)
+			f"""substring_index(group_concat(
+				case when checkin.log_type = '{log_type}' then concat_ws(',', checkin.latitude, checkin.longitude) end
+				order by checkin.time {order} separator '|'
+			), '|', 1) as {prefix}_location""",
+		]
+		for photo_type, fieldname in PHOTO_CUSTOM_FIELDS.items():
+			if checkin_meta.has_field(fieldname):
+				columns.append(
+					f"max(checkin.log_type = '{log_type}' and ifnull(checkin.`{fieldname}`, '') != '') as {prefix}_{photo_type}_photo"
+				)
+		return columns
+
+	columns = [
+		"employee.name as employee",
+		"employee.employee_name",
+		"employee.designation",
+		"employee.department",
+		"employee.branch",
+		*punch_columns("IN", "min", "asc"),
+		*punch_columns("OUT", "max", "desc"),
+	]
+
+	if scope_doctype == "Branch":
+		scope_condition = "employee.branch = %(scope)s"
+	elif scope_doctype == "Department":
+		scope_condition = "employee.department = %(scope)s"
+	else:
+		if not frappe.get_meta("Department").has_field("custom_project"):
+			frappe.throw(
+				_("Departments are not linked to Projects (custom_project field is missing)."),
+				ValidationError,
+			)
+		scope_condition = (
+			"employee.department in (select name from `tabDepartment` where custom_project = %(scope)s)"
 		)
-		biometric_photo = biometric_photos[0] if biometric_photos else None
-		
-		# Also check custom fields if they exist
-		checkin_doc = frappe.get_doc("Employee Checkin", record.name)
-		location_photo_id = getattr(checkin_doc, "custom_location_photo", None)
-		biometric_photo_id = getattr(checkin_doc, "custom_client_bio_metric_photo", None)
-		
-		# Build record response
-		record_data = {
-			"checkin_id": record.name,
-			"employee_id": getattr(employee, "employee_code", None) or getattr(employee, "employee_number", None) or employee.name,
-			"employee_name": record.employee_name or employee.name,
-			"log_type": record.log_type,
-			"time": record.time.isoformat() if hasattr(record.time, "isoformat") else str(record.time),
-			"latitude": record.latitude,
-			"longitude": record.longitude,
-			"device_id": record.device_id,
-			"shift": record.shift,
-			"shift_start": record.shift_start.isoformat() if record.shift_start and hasattr(record.shift_start, "isoformat") else (str(record.shift_start) if record.shift_start else None),
-			"shift_end": record.shift_end.isoformat() if record.shift_end and hasattr(record.shift_end, "isoformat") else (str(record.shift_end) if record.shift_end else None),
-			"attendance": record.attendance,
-			"skip_auto_attendance": record.skip_auto_attendance,
-		}
-		
-		# Add photo information
-		if location_photo:
-			record_data["location_photo_id"] = location_photo.name
-			record_data["location_photo_url"] = location_photo.file_url
-		elif location_photo_id:
-			# Try to get file info from custom field
-			if frappe.db.exists("File", location_photo_id):
-				file_doc = frappe.get_doc("File", location_photo_id)
-				record_data["location_photo_id"] = file_doc.name
-				record_data["location_photo_url"] = file_doc.file_url
-		
-		if biometric_photo:
-			record_data["client_biometric_photo_id"] = biometric_photo.name
-			record_data["client_biometric_photo_url"] = biometric_photo.file_url
-		elif biometric_photo_id:
-			# Try to get file info from custom field
-			if frappe.db.exists("File", biometric_photo_id):
-				file_doc = frappe.get_doc("File", biometric_photo_id)
-				record_data["client_biometric_photo_id"] = file_doc.name
-				record_data["client_biometric_photo_url"] = file_doc.file_url
-		
-		records_with_photos.append(record_data)
-	
-	# Build response
-	response = {
-		"records": records_with_photos,
-		"total_count": total_count,
-		"limit": limit,
-		"offset": offset,
-		"has_more": (offset + limit) < total_count
+
+	start_of_day = get_datetime(day)
+	return frappe.db.sql(
+		f"""
+		select {", ".join(columns)}
+		from `tabEmployee` employee
+		left join `tabEmployee Checkin` checkin
+			on checkin.employee = employee.name
+			and checkin.time >= %(start)s
+			and checkin.time < %(end)s
+		where employee.status = 'Active' and {scope_condition}
+		group by employee.name
+		order by employee.employee_name, employee.name
+		""",
+		{"scope": scope_name, "start": start_of_day, "end": start_of_day + timedelta(days=1)},
+		as_dict=True,
+	)
+
+
+def _get_team_punch(row, prefix, branch_geofences):
+	"""Build the check_in / check_out block of a get_team_attendance row, or None."""
+	punch_time = row.get(f"{prefix}_time")
+	if not punch_time:
+		return None
+
+	distance = None
+	location = row.get(f"{prefix}_location")
+	branch_geofence = branch_geofences.get(row.branch)
+	if location and branch_geofence:
+		latitude, _separator, longitude = location.partition(",")
+		try:
+			distance = round(
+				get_distance_between_coordinates(
+					branch_geofence.latitude, branch_geofence.longitude, float(latitude), float(longitude)
+				),
+				2,
+			)
+		except ValueError:
+			distance = None
+
+	return {
+		"time": punch_time.isoformat() if hasattr(punch_time, "isoformat") else str(punch_time),
+		"distance_from_branch_meters": distance,
+		"has_location_photo": bool(row.get(f"{prefix}_location_photo")),
+		"has_biometric_photo": bool(row.get(f"{prefix}_biometric_photo")),
 	}
-	
-	return response
\ No newline at end of file
+
+
+@frappe.whitelist()
+def get_metrics():
+	"""
+	Metrics of the mobile endpoints in Prometheus text format (see metrics.py): call
+	durations and stage durations as histograms, calls by outcome, database queries,
+	photo bytes ingested, Error Log writes and rejections by reason.
+
+	Meant for a Prometheus scrape job authenticating with a System Manager's API token.
+
+	Returns:
+		Response: text/plain exposition format
+
+	Raises:
+		PermissionError: If the user is not a System Manager
+	"""
+	frappe.only_for("System Manager")
+	return text_response(metrics.render(), content_type=metrics.CONTENT_TYPE)
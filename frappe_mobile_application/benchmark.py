@@ -0,0 +1,608 @@
+"""
+Latency and query-count benchmark of the mobile endpoints, run against a test site.
+
+``bench --site <site> mobile-app-benchmark --scale 100k`` (see commands.py) seeds
+synthetic branches, departments, projects, employees, check-ins and photo Files, calls
+mobile_login, get_employee_configuration, create_checkin_checkout and
+get_employee_checkin_records, and reports latency and database queries per call. It
+fails when a call runs more queries than its budget, when a deeper history page costs
+more queries than the first one, or when a larger history page costs more queries than
+a smaller one (photos are resolved per page, not per record).
+
+Seeded rows are named with SEED_PREFIX and written with bulk inserts, so a 1M run
+seeds in minutes. Use a dedicated test site: the benchmark commits, and it needs an
+existing Company. Queries are counted per ``frappe.db.sql`` call, with warm caches
+(each call is warmed up once first); Redis round trips are not counted.
+
+Budgets (site_config.json), all keys optional, merged into DEFAULT_QUERY_BUDGETS:
+
+	"mobile_app_query_budgets": {
+		"create_checkin_checkout": 45
+	}
+"""
+
+import base64
+import io
+import time
+from datetime import datetime
+from datetime import time as day_time
+
+import frappe
+from frappe.utils import add_days, getdate, now_datetime
+from frappe.utils.password import update_password
+
+from frappe_mobile_application.employee_settings import (
+	SETTINGS_FIELDS,
+	clear_all_employee_settings_cache,
+	get_employee_settings,
+)
+from frappe_mobile_application.geofence import clear_branch_index
+from frappe_mobile_application.metrics import QueryCounter
+from frappe_mobile_application.photo_storage import PHOTO_CUSTOM_FIELDS
+
+SEED_PREFIX = "MOBBENCH"
+SEED_USER = "mobbench-user@example.com"
+SEED_PASSWORD = "Mobbench-Pass-2025"
+
+# Scale -> number of seeded check-ins
+SCALES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+
+# Queries per call at most, with warm caches
+DEFAULT_QUERY_BUDGETS = {
+	"mobile_login": 15,
+	"get_employee_configuration": 5,
+	"create_checkin_checkout": 40,
+	"create_checkin_checkout:photo": 60,
+	"get_employee_checkin_records": 12,
+	"get_employee_checkin_records:cursor": 12,
+	"get_employee_checkin_records:summary": 3,
+}
+
+# Measured calls per endpoint at most. Every measured punch needs an employee that has
+# not punched today, so MAX_ITERATIONS + 1 punch-only employees are seeded per punch benchmark.
+MAX_ITERATIONS = 50
+PUNCH_BENCHMARKS = 2
+
+# Rows per bulk insert
+SEED_CHUNK_SIZE = 10_000
+# Cursor page read for the deep page check; the smallest scale has 100 check-ins per employee
+DEEP_PAGE = 5
+HISTORY_PAGE_SIZE = 20
+# Page sizes of the history compared for the page size check
+SMALL_PAGE_SIZE = 10
+LARGE_PAGE_SIZE = 100
+
+# Seeded branches are laid out on a grid around this point, SEED_BRANCH_SPACING degrees apart
+SEED_ORIGIN = (24.7, 46.7)
+SEED_BRANCH_SPACING = 0.02
+SEED_BRANCH_RADIUS = 200
+
+
+def get_budgets():
+	"""Read query budgets from site config, merged into DEFAULT_QUERY_BUDGETS."""
+	return {**DEFAULT_QUERY_BUDGETS, **(frappe.conf.get("mobile_app_query_budgets") or {})}
+
+
+def get_seed_sizes(scale):
+	"""
+	Number of rows seeded per doctype at a scale.
+
+	Returns:
+		frappe._dict: checkins, employees (with a history), punch_employees (without one),
+		branches, departments (one project per department)
+	"""
+	if scale not in SCALES:
+		frappe.throw(f"Unknown scale {scale}. Use one of: {', '.join(SCALES)}")
+	checkins = SCALES[scale]
+	employees = max(10, checkins // 1000)
+	return frappe._dict(
+		checkins=checkins,
+		employees=employees,
+		punch_employees=PUNCH_BENCHMARKS * (MAX_ITERATIONS + 1),
+		branches=max(5, employees // 20),
+		departments=max(2, employees // 50),
+	)
+
+
+def seed(scale):
+	"""
+	Replace the seeded data with a fresh data set at the given scale and commit.
+
+	Every employee has one IN and one OUT per day, going back from yesterday, so today
+	is free for create_checkin_checkout, which punches as the punch-only employees. Every
+	check-in has a location photo File.
+	"""
+	sizes = get_seed_sizes(scale)
+	company = frappe.db.get_single_value("Global Defaults", "default_company") or frappe.db.get_value(
+		"Company", {}, "name"
+	)
+	if not company:
+		frappe.throw("The benchmark needs an existing Company.")
+
+	cleanup()
+
+	now = now_datetime()
+	branches = [f"{SEED_PREFIX}-BR-{i:04d}" for i in range(sizes.branches)]
+	departments = [f"{SEED_PREFIX}-DEPT-{i:04d}" for i in range(sizes.departments)]
+	projects = [f"{SEED_PREFIX}-PROJ-{i:04d}" for i in range(sizes.departments)]
+	employees = [f"{SEED_PREFIX}-EMP-{i:06d}" for i in range(sizes.employees)]
+	punch_employees = [f"{SEED_PREFIX}-PUNCH-{i:04d}" for i in range(sizes.punch_employees)]
+	branch_locations = {
+		branch: (
+			SEED_ORIGIN[0] + (i // 50) * SEED_BRANCH_SPACING,
+			SEED_ORIGIN[1] + (i % 50) * SEED_BRANCH_SPACING,
+		)
+		for i, branch in enumerate(branches)
+	}
+
+	_bulk_insert(
+		"Branch",
+		["name", "branch", "custom_latitude", "custom_longitude", "custom_radius_in_meters"],
+		([branch, branch, *branch_locations[branch], SEED_BRANCH_RADIUS] for branch in branches),
+		now,
+	)
+
+	project_settings = [f for f in SETTINGS_FIELDS if frappe.get_meta("Project").has_field(f)]
+	_bulk_insert(
+		"Project",
+		["name", "project_name", "status", "company", *project_settings],
+		([project, project, "Open", company, *[0] * len(project_settings)] for project in projects),
+		now,
+	)
+
+	# Photos and location checks are not required, whichever way the Company resolves settings
+	department_meta = frappe.get_meta("Department")
+	department_settings = [f for f in SETTINGS_FIELDS if department_meta.has_field(f)]
+	department_fields = ["name", "department_name", "company", "is_group", *department_settings]
+	if department_meta.has_field("custom_project"):
+		department_fields.append("custom_project")
+	_bulk_insert(
+		"Department",
+		department_fields,
+		(
+			[department, department, company, 0, *[0] * len(department_settings), projects[i]][
+				: len(department_fields)
+			]
+			for i, department in enumerate(departments)
+		),
+		now,
+	)
+
+	_bulk_insert(
+		"Employee",
+		[
+			"name",
+			"first_name",
+			"employee_name",
+			"employee_number",
+			"company",
+			"status",
+			"branch",
+			"department",
+		],
+		(
+			[
+				employee,
+				employee,
+				employee,
+				employee,
+				company,
+				"Active",
+				branches[i % len(branches)],
+				departments[i % len(departments)],
+			]
+			for i, employee in enumerate(employees + punch_employees)
+		),
+		now,
+	)
+
+	_seed_checkins(sizes, employees, branches, branch_locations, now)
+	_seed_user()
+
+	clear_all_employee_settings_cache()
+	clear_branch_index()
+	frappe.db.commit()
+	return sizes
+
+
+def cleanup():
+	"""
+	Delete all seeded data and users, and the check-ins and photos created by the
+	benchmark and the load test, and commit.
+	"""
+	employee_filter = {"employee": ["like", f"{SEED_PREFIX}-%"]}
+	created_checkins = frappe.get_all(
+		"Employee Checkin",
+		filters={**employee_filter, "name": ["not like", f"{SEED_PREFIX}-%"]},
+		pluck="name",
+	)
+	# Photos uploaded by create_checkin_checkout: delete the documents so the files go too
+	for file_name in frappe.get_all(
+		"File",
+		filters={
+			"attached_to_doctype": "Employee Checkin",
+			"attached_to_name": ["in", created_checkins or [""]],
+		},
+		pluck="name",
+	):
+		frappe.delete_doc("File", file_name, ignore_permissions=True, force=True)
+
+	frappe.db.delete("Employee Checkin", employee_filter)
+	for doctype in ("File", "Employee", "Department", "Project", "Branch"):
+		frappe.db.delete(doctype, {"name": ["like", f"{SEED_PREFIX}-%"]})
+
+	# SEED_USER and the users of the load test (see loadtest.py)
+	user_filter = ["like", f"{SEED_PREFIX.lower()}-%"]
+	frappe.db.delete("Has Role", {"parenttype": "User", "parent": user_filter})
+	frappe.db.delete("__Auth", {"doctype": "User", "name": user_filter})
+	frappe.db.delete("User", {"name": user_filter})
+
+	clear_all_employee_settings_cache()
+	clear_branch_index()
+	frappe.db.commit()
+
+
+def run(iterations=20):
+	"""
+	Benchmark every endpoint against the seeded data.
+
+	Args:
+		iterations (int): Measured calls per endpoint (after one warm-up call), at most
+			MAX_ITERATIONS
+
+	Returns:
+		list: frappe._dict per benchmark with "label", "budget_key", "budget", "queries"
+		(most queries of a measured call), "p50_ms", "p95_ms", "max_ms", "error" and "failed"
+	"""
+	from frappe_mobile_application.api import (
+		create_checkin_checkout,
+		get_employee_checkin_records,
+		get_employee_configuration,
+		mobile_login,
+	)
+
+	if not 1 <= iterations <= MAX_ITERATIONS:
+		frappe.throw(f"Iterations must be between 1 and {MAX_ITERATIONS}.")
+	reader = frappe.db.get_value("Employee", f"{SEED_PREFIX}-EMP-000000", "name")
+	# Every punch needs its own employee (one IN per day)
+	punch_employees = frappe.get_all(
+		"Employee",
+		filters={"name": ["like", f"{SEED_PREFIX}-PUNCH-%"]},
+		fields=["name", "branch"],
+		order_by="name asc",
+	)
+	if not reader or len(punch_employees) < PUNCH_BENCHMARKS * (MAX_ITERATIONS + 1):
+		frappe.throw("No seeded data found. Run the benchmark with a --scale first.")
+
+	budgets = get_budgets()
+	branch_locations = {
+		row.name: (row.custom_latitude, row.custom_longitude)
+		for row in frappe.get_all(
+			"Branch",
+			filters={"name": ["like", f"{SEED_PREFIX}-BR-%"]},
+			fields=["name", "custom_latitude", "custom_longitude"],
+		)
+	}
+	punchers = iter(punch_employees)
+	photo = base64.b64encode(_make_photo()).decode()
+
+	def punch(with_photo=False):
+		employee = next(punchers)
+		latitude, longitude = branch_locations[employee.branch]
+		# Warm the employee's settings, as on a second punch of the day
+		get_employee_settings(employee.name)
+		return lambda: create_checkin_checkout(
+			employee_id=employee.name,
+			log_type="IN",
+			latitude=latitude,
+			longitude=longitude,
+			device_id=f"{SEED_PREFIX}-DEVICE",
+			location_photo=photo if with_photo else None,
+		)
+
+	deep_cursor = _get_deep_cursor(reader)
+	benchmarks = [
+		(
+			"mobile_login (token_only)",
+			"mobile_login",
+			lambda: lambda: mobile_login(usr=SEED_USER, pwd=SEED_PASSWORD, token_only=True),
+		),
+		(
+			"get_employee_configuration",
+			"get_employee_configuration",
+			lambda: lambda: get_employee_configuration(employee_id=reader),
+		),
+		("create_checkin_checkout", "create_checkin_checkout", punch),
+		(
+			"create_checkin_checkout (location photo)",
+			"create_checkin_checkout:photo",
+			lambda: punch(with_photo=True),
+		),
+		(
+			"get_employee_checkin_records (offset, first page)",
+			"get_employee_checkin_records",
+			lambda: lambda: get_employee_checkin_records(employee_id=reader, limit=HISTORY_PAGE_SIZE),
+		),
+		(
+			"get_employee_checkin_records (cursor, first page)",
+			"get_employee_checkin_records:cursor",
+			lambda: (
+				lambda: get_employee_checkin_records(employee_id=reader, limit=HISTORY_PAGE_SIZE, cursor="")
+			),
+		),
+		(
+			f"get_employee_checkin_records (cursor, page {DEEP_PAGE})",
+			"get_employee_checkin_records:cursor",
+			lambda: (
+				lambda: get_employee_checkin_records(
+					employee_id=reader, limit=HISTORY_PAGE_SIZE, cursor=deep_cursor
+				)
+			),
+		),
+		(
+			f"get_employee_checkin_records (offset, {SMALL_PAGE_SIZE} per page)",
+			"get_employee_checkin_records",
+			lambda: lambda: get_employee_checkin_records(employee_id=reader, limit=SMALL_PAGE_SIZE),
+		),
+		(
+			f"get_employee_checkin_records (offset, {LARGE_PAGE_SIZE} per page)",
+			"get_employee_checkin_records",
+			lambda: lambda: get_employee_checkin_records(employee_id=reader, limit=LARGE_PAGE_SIZE),
+		),
+		(
+			"get_employee_checkin_records (summary view)",
+			"get_employee_checkin_records:summary",
+			lambda: (
+				lambda: get_employee_checkin_records(
+					employee_id=reader, limit=HISTORY_PAGE_SIZE, cursor="", view="summary"
+				)
+			),
+		),
+	]
+
+	report = []
+	results = {}
+	with _benchmark_request():
+		for label, budget_key, prepare in benchmarks:
+			result = _measure(prepare, iterations)
+			result.update(label=label, budget_key=budget_key, budget=budgets.get(budget_key))
+			result.failed = bool(result.error) or (
+				result.budget is not None and result.queries is not None and result.queries > result.budget
+			)
+			report.append(result)
+			results[label] = result
+
+	# Keyset pagination: a deep page must cost the same as the first one
+	report.append(
+		_compare_queries(
+			"history cursor pages: constant queries per page",
+			results["get_employee_checkin_records (cursor, first page)"],
+			results[f"get_employee_checkin_records (cursor, page {DEEP_PAGE})"],
+		)
+	)
+	# Batched photo lookup: a larger page must cost the same as a smaller one
+	report.append(
+		_compare_queries(
+			"history page sizes: constant queries per page",
+			results[f"get_employee_checkin_records (offset, {SMALL_PAGE_SIZE} per page)"],
+			results[f"get_employee_checkin_records (offset, {LARGE_PAGE_SIZE} per page)"],
+		)
+	)
+
+	return report
+
+
+def _compare_queries(label, expected, measured):
+	"""Check result: measured must run as many queries per call as expected."""
+	same = expected.queries is not None and expected.queries == measured.queries
+	return frappe._dict(
+		label=label,
+		budget_key=None,
+		budget=expected.queries,
+		queries=measured.queries,
+		error=None if same else "page queries differ",
+		failed=not same,
+	)
+
+
+def _measure(prepare, iterations):
+	timings = []
+	queries = []
+	error = None
+	for iteration in range(iterations + 1):
+		call = prepare()
+		with QueryCounter() as counter:
+			start = time.perf_counter()
+			try:
+				response = call()
+			except Exception as e:
+				response = {"exception": str(e)}
+			elapsed = time.perf_counter() - start
+		if isinstance(response, dict) and response.get("exception"):
+			error = response["exception"]
+			break
+		# The first call warms the caches and is not counted
+		if iteration:
+			timings.append(elapsed * 1000)
+			queries.append(counter.count)
+
+	timings.sort()
+	return frappe._dict(
+		queries=max(queries) if queries else None,
+		p50_ms=_percentile(timings, 50),
+		p95_ms=_percentile(timings, 95),
+		max_ms=timings[-1] if timings else None,
+		error=error,
+	)
+
+
+def _percentile(values, percentile):
+	if not values:
+		return None
+	return values[min(len(values) - 1, int(len(values) * percentile / 100))]
+
+
+def _get_deep_cursor(employee):
+	"""Cursor of page DEEP_PAGE of an employee's history, read without the endpoint."""
+	from frappe_mobile_application.api import _encode_checkin_cursor
+
+	rows = frappe.get_all(
+		"Employee Checkin",
+		filters={"employee": employee},
+		fields=["name", "time"],
+		order_by="time desc, name desc",
+		limit=1,
+		start=HISTORY_PAGE_SIZE * (DEEP_PAGE - 1) - 1,
+	)
+	if not rows:
+		frappe.throw(f"Not enough seeded check-ins for page {DEEP_PAGE}. Seed a larger scale.")
+	return _encode_checkin_cursor(rows[0])
+
+
+class _benchmark_request:
+	"""
+	Run the endpoints as in an HTTP request from a phone: as Administrator, with a
+	request object and IP, and with the rate limits off.
+	"""
+
+	def __enter__(self):
+		from werkzeug.test import EnvironBuilder
+		from werkzeug.wrappers import Request
+
+		self.user = frappe.session.user
+		self.rate_limits = frappe.local.conf.get("mobile_app_rate_limits")
+		frappe.set_user("Administrator")
+		frappe.local.request = Request(
+			EnvironBuilder(path="/api/method/frappe_mobile_application.api").get_environ()
+		)
+		frappe.local.request_ip = "127.0.0.1"
+		frappe.local.conf.mobile_app_rate_limits = {**(self.rate_limits or {}), "enabled": False}
+		return self
+
+	def __exit__(self, *exc):
+		frappe.local.conf.mobile_app_rate_limits = self.rate_limits
+		frappe.local.request = None
+		frappe.set_user(self.user)
+
+
+def _seed_checkins(sizes, employees, branches, branch_locations, now):
+	"""One IN (with a location photo) and one OUT per employee and day, before today."""
+	has_punch_date = frappe.get_meta("Employee Checkin").has_field("custom_punch_date")
+	photo_field = PHOTO_CUSTOM_FIELDS["location"]
+	has_photo_field = frappe.get_meta("Employee Checkin").has_field(photo_field)
+	checkin_fields = [
+		"name",
+		"employee",
+		"employee_name",
+		"log_type",
+		"time",
+		"latitude",
+		"longitude",
+		"device_id",
+	]
+	if has_punch_date:
+		checkin_fields.append("custom_punch_date")
+	if has_photo_field:
+		checkin_fields.append(photo_field)
+	file_fields = [
+		"name",
+		"file_name",
+		"file_url",
+		"attached_to_doctype",
+		"attached_to_name",
+		"is_private",
+		"folder",
+	]
+
+	days = max(1, sizes.checkins // (2 * len(employees)))
+	today = getdate(now)
+
+	def rows():
+		number = 0
+		for i, employee in enumerate(employees):
+			latitude, longitude = branch_locations[branches[i % len(branches)]]
+			for day in range(1, days + 1):
+				punch_date = add_days(today, -day)
+				for log_type, hour in (("IN", 8), ("OUT", 17)):
+					number += 1
+					checkin = f"{SEED_PREFIX}-CKIN-{number:09d}"
+					punch_time = datetime.combine(punch_date, day_time(hour, number % 60))
+					file_url = f"/files/{SEED_PREFIX.lower()}_{number}.jpg" if log_type == "IN" else None
+					row = [
+						checkin,
+						employee,
+						employee,
+						log_type,
+						punch_time,
+						latitude,
+						longitude,
+						f"{SEED_PREFIX}-DEVICE",
+					]
+					if has_punch_date:
+						row.append(punch_date)
+					if has_photo_field:
+						row.append(file_url)
+					photo_row = None
+					if file_url:
+						photo_row = [
+							f"{SEED_PREFIX}-FILE-{number:09d}",
+							f"location_photo_{employee}_{punch_time:%Y%m%d_%H%M%S}.jpg",
+							file_url,
+							"Employee Checkin",
+							checkin,
+							0,
+							"Home/Attachments",
+						]
+					yield row, photo_row, punch_time
+
+	checkin_rows = []
+	file_rows = []
+	for row, photo_row, punch_time in rows():
+		checkin_rows.append([*row, punch_time])
+		if photo_row:
+			file_rows.append([*photo_row, punch_time])
+		if len(checkin_rows) >= SEED_CHUNK_SIZE:
+			_insert_chunk("Employee Checkin", checkin_fields, checkin_rows)
+			_insert_chunk("File", file_fields, file_rows)
+			checkin_rows, file_rows = [], []
+	_insert_chunk("Employee Checkin", checkin_fields, checkin_rows)
+	_insert_chunk("File", file_fields, file_rows)
+
+
+def _insert_chunk(doctype, fields, rows):
+	"""Insert rows whose last value is their creation time."""
+	if not rows:
+		return
+	frappe.db.bulk_insert(
+		doctype,
+		[*fields, "creation", "modified", "owner", "modified_by", "docstatus"],
+		[[*row, row[-1], "Administrator", "Administrator", 0] for row in rows],
+	)
+	frappe.db.commit()
+
+
+def _bulk_insert(doctype, fields, rows, now):
+	_insert_chunk(doctype, fields, [[*row, now] for row in rows])
+
+
+def _seed_user():
+	"""The user mobile_login is benchmarked with."""
+	if not frappe.db.exists("User", SEED_USER):
+		frappe.get_doc(
+			{
+				"doctype": "User",
+				"email": SEED_USER,
+				"first_name": SEED_PREFIX,
+				"send_welcome_email": 0,
+			}
+		).insert(ignore_permissions=True)
+	update_password(SEED_USER, SEED_PASSWORD)
+
+
+def _make_photo():
+	"""A small JPEG, as uploaded by the app."""
+	from PIL import Image
+
+	buffer = io.BytesIO()
+	Image.new("RGB", (640, 480), (90, 140, 200)).save(buffer, "JPEG", quality=80)
+	return buffer.getvalue()
@@ -0,0 +1,67 @@
+"""
+Keep Employee Checkin.modified usable as the delta sync watermark
+(api.sync_employee_checkin_records).
+
+HRMS links check-ins to their Attendance, and unlinks them when it is cancelled, with
+query builder updates that leave ``modified`` untouched, so delta sync would never
+return the change. The Attendance ``doc_events`` below (see hooks.py) bump ``modified``
+on the affected check-ins in the same transaction.
+
+Check-ins inserted by a batch get their ``modified`` set again right before the batch
+commits (touch_on_commit), so it is never older than the commit by more than
+api.SYNC_LAG_SECONDS.
+"""
+
+import frappe
+from frappe.utils import now_datetime
+
+
+def on_attendance_submit(doc, method=None):
+	"""
+	doc_events handler for Attendance: bump the check-ins HRMS links to it.
+
+	HRMS submits the Attendance first and links the check-ins afterwards
+	(update_attendance_in_checkins), so they are looked up right before the commit.
+	"""
+	frappe.db.before_commit.add(lambda: touch_checkins({"attendance": doc.name}))
+
+
+def on_attendance_cancel(doc, method=None):
+	"""
+	doc_events handler (before_cancel) for Attendance: bump the check-ins linked to it,
+	while the link still exists. HRMS unlinks them in Attendance.on_cancel.
+	"""
+	touch_checkins({"attendance": doc.name})
+
+
+def touch_checkins(filters):
+	"""Set ``modified`` of the Employee Checkin rows matching filters to now."""
+	frappe.db.set_value("Employee Checkin", filters, "modified", now_datetime(), update_modified=False)
+
+
+def touch_on_commit(checkin):
+	"""
+	Set ``modified`` of a checkin again right before the transaction commits.
+
+	Batches (sync_offline_punches, the punch queue drain) commit well after their first
+	insert. A delta sync running in between would otherwise move its watermark past
+	rows it cannot see yet, and never return them.
+	"""
+	pending = getattr(frappe.local, "mobile_app_checkins_to_touch", None)
+	if pending is None:
+		pending = frappe.local.mobile_app_checkins_to_touch = set()
+		frappe.db.before_commit.add(_touch_pending)
+		frappe.db.after_rollback.add(_forget_pending)
+	pending.add(checkin)
+
+
+def _touch_pending():
+	checkins = _forget_pending()
+	if checkins:
+		touch_checkins({"name": ["in", list(checkins)]})
+
+
+def _forget_pending():
+	checkins = getattr(frappe.local, "mobile_app_checkins_to_touch", None)
+	frappe.local.mobile_app_checkins_to_touch = None
+	return checkins
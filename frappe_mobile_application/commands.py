@@ -0,0 +1,141 @@
+import click
+import frappe
+from frappe.commands import get_site, pass_context
+
+
+@click.command("mobile-app-explain")
+@click.option("--verbose", is_flag=True, default=False, help="Print the SQL and full plan of every query")
+@pass_context
+def explain_queries(context, verbose=False):
+	"""
+	Run EXPLAIN on the mobile app's hot queries and report full table scans.
+
+	Exits with status 1 if any query reads a table with a full scan. On small tables
+	the database may prefer a scan even when an index exists; check the row estimates.
+	"""
+	from frappe_mobile_application.db_indexes import explain_hot_queries
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		report = explain_hot_queries()
+	finally:
+		frappe.destroy()
+
+	for query in report:
+		status = "FULL SCAN: " + ", ".join(query.full_scans) if query.full_scans else "ok"
+		click.echo(f"{query.label}: {status}")
+		for row in query.plan:
+			click.echo(
+				f"    {row.get('table')}: type={row.get('type')} key={row.get('key')} rows={row.get('rows')}"
+			)
+		if verbose:
+			click.echo(f"    {query.sql}")
+
+	if any(query.full_scans for query in report):
+		raise SystemExit(1)
+
+
+@click.command("mobile-app-benchmark")
+@click.option(
+	"--scale", type=click.Choice(["1k", "100k", "1m"]), help="Seed fresh benchmark data of this size first"
+)
+@click.option("--iterations", default=20, type=int, help="Measured calls per endpoint")
+@click.option("--cleanup", is_flag=True, default=False, help="Delete the benchmark data afterwards")
+@pass_context
+def benchmark_endpoints(context, scale=None, iterations=20, cleanup=False):
+	"""
+	Measure latency and queries per call of the mobile endpoints on seeded data.
+
+	Use a test site. Exits with status 1 if an endpoint fails or goes over its query
+	budget, or if a deep or larger history page costs more queries than the first one.
+	"""
+	from frappe_mobile_application import benchmark
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		if scale:
+			click.echo(f"Seeding {scale} check-ins...")
+			sizes = benchmark.seed(scale)
+			click.echo(
+				f"Seeded {sizes.checkins} check-ins, {sizes.employees + sizes.punch_employees} employees, "
+				f"{sizes.branches} branches, {sizes.departments} departments"
+			)
+		report = benchmark.run(iterations)
+		if cleanup:
+			benchmark.cleanup()
+	finally:
+		frappe.destroy()
+
+	for result in report:
+		status = "FAIL" if result.failed else "ok"
+		line = f"{status:4} {result.label}: queries={result.queries} budget={result.budget}"
+		if result.get("p50_ms") is not None:
+			line += f" p50={result.p50_ms:.1f}ms p95={result.p95_ms:.1f}ms max={result.max_ms:.1f}ms"
+		if result.error:
+			line += f" ({result.error})"
+		click.echo(line)
+
+	if any(result.failed for result in report):
+		raise SystemExit(1)
+
+
+@click.command("mobile-app-loadtest")
+@click.option("--url", help="Base URL of the running site. Defaults to the site's URL")
+@click.option("--employees", type=int, help="Punches, one per seeded employee (default 1000)")
+@click.option("--duration", type=float, help="Length of the surge in seconds (default 300)")
+@click.option(
+	"--curve", type=click.Choice(["normal", "shift_start", "uniform"]), help="Arrival curve (default normal)"
+)
+@click.option("--concurrency", type=int, help="Requests in flight at most (default 200)")
+@click.option("--photos", type=click.IntRange(0, 2), help="Photos per punch (default 2)")
+@click.option("--photo-kb", type=int, help="Size of each photo in KB (default 200)")
+@click.option("--multipart-share", type=float, help="Share of punches sending multipart files (default 0.5)")
+@click.option("--retry-share", type=float, help="Share of punches retried (default 0.05)")
+@click.option(
+	"--out-of-radius-share", type=float, help="Share of punches outside the geofence (default 0.05)"
+)
+@click.option(
+	"--queued", is_flag=True, default=None, help="Send queued punches (the site must enable the punch queue)"
+)
+@click.option(
+	"--role", "roles", multiple=True, help="Role of the load test users (default Employee); repeatable"
+)
+@click.option("--seed", type=int, help="Random seed, for repeatable runs")
+@pass_context
+def loadtest_checkins(context, url=None, roles=None, seed=None, **options):
+	"""
+	Replay a shift-start surge of check-ins against a running test site.
+
+	Uses the employees seeded by mobile-app-benchmark. Exits with status 1 if a punch
+	got a server or connection error, or a punch outside the geofence was accepted.
+	"""
+	from frappe_mobile_application import loadtest
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		profile = loadtest.get_profile(**options)
+		targets = loadtest.prepare(profile.employees, roles=roles or loadtest.DEFAULT_ROLES)
+		url = (url or frappe.utils.get_url()).rstrip("/")
+		click.echo(
+			f"Sending {len(targets)} punches to {url} over {profile.duration:.0f}s "
+			f"({profile.curve} curve, concurrency {profile.concurrency})..."
+		)
+		report = loadtest.run(url, targets, profile, seed=seed)
+	finally:
+		frappe.destroy()
+
+	for line in loadtest.format_report(report):
+		click.echo(line)
+
+	failures = ("server_error", "connection_error", "accepted_outside")
+	if any(report.outcomes.get(outcome) for outcome in failures):
+		raise SystemExit(1)
+
+
+commands = [explain_queries, benchmark_endpoints, loadtest_checkins]
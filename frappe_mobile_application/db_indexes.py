@@ -0,0 +1,259 @@
+"""
+Composite indexes for the app's hot queries, and an EXPLAIN report on those queries.
+
+INDEXES and UNIQUE_KEYS are created on install and checked again after every migrate
+(see hooks.py), so a key dropped by a schema change comes back. Patches are marked as
+done on install without running, so keys must not depend on them. ``bench --site <site>
+mobile-app-explain`` (see commands.py) runs EXPLAIN on the queries of get_hot_queries
+and reports full table scans.
+"""
+
+from datetime import timedelta
+
+import frappe
+from frappe.utils import now_datetime
+
+# (doctype, columns, index name). Columns may carry a prefix length for text columns.
+INDEXES = (
+	# History, daily punch rule and team views: employee + log_type + time range
+	("Employee Checkin", ["employee", "log_type", "time"], "mobile_app_employee_log_type_time"),
+	# History without a log_type filter, ordered by time
+	("Employee Checkin", ["employee", "time"], "mobile_app_employee_time"),
+	# Delta sync of an employee's history
+	("Employee Checkin", ["employee", "modified"], "mobile_app_employee_modified"),
+	# Delta sync tombstones
+	("Deleted Document", ["deleted_doctype", "creation"], "mobile_app_deleted_doctype_creation"),
+	# Photos of a page of checkins
+	("File", ["attached_to_doctype", "attached_to_name", "file_name"], "mobile_app_attached_to_file_name"),
+	# Photo blobs by content hash (photo_storage.save_staged_photo)
+	("File", ["content_hash"], "mobile_app_content_hash"),
+	# Photo references stored as URL (file_url is a text column, so a prefix is indexed)
+	("File", ["file_url(255)"], "mobile_app_file_url"),
+	# Branches near a point (geofence.get_branches_near). Same name as in the
+	# convert_branch_coordinates_to_float patch, which skips fresh sites
+	("Branch", ["custom_latitude", "custom_longitude"], "custom_latitude_longitude_index"),
+)
+
+# (doctype, columns, constraint name)
+UNIQUE_KEYS = (
+	# One IN and one OUT per employee per punch date (api.PUNCH_DATE_UNIQUE_KEY). The
+	# add_punch_date_unique_key patch backfills existing check-ins before it is added
+	(
+		"Employee Checkin",
+		["employee", "custom_punch_date", "log_type"],
+		"unique_employee_punch_date_log_type",
+	),
+)
+
+
+def ensure_indexes():
+	"""
+	Create any missing index of INDEXES and key of UNIQUE_KEYS. Runs after install and
+	after migrate; cheap when all exist.
+	"""
+	for doctype, columns, index_name in INDEXES:
+		if _has_columns(doctype, columns):
+			frappe.db.add_index(doctype, columns, index_name)
+	for doctype, columns, constraint_name in UNIQUE_KEYS:
+		if _has_columns(doctype, columns):
+			frappe.db.add_unique(doctype, columns, constraint_name=constraint_name)
+
+
+def _has_columns(doctype, columns):
+	if not frappe.db.table_exists(doctype):
+		return False
+	# False until the custom fields are created
+	return all(frappe.db.has_column(doctype, column.split("(")[0]) for column in columns)
+
+
+def get_hot_queries():
+	"""
+	Representative SQL of the queries the endpoints run, built with the same filters.
+	Sample values are taken from existing rows where possible.
+
+	Returns:
+		list: (label, sql) tuples
+	"""
+	# Imported here: api imports hrms, which is only needed when the report runs
+	from frappe_mobile_application.api import SUMMARY_CHECKIN_FIELDS
+	from frappe_mobile_application.photo_storage import PHOTO_CUSTOM_FIELDS
+
+	employee = frappe.db.get_value("Employee Checkin", {}, "employee") or "EMP-0001"
+	end = now_datetime()
+	start = end - timedelta(days=30)
+	checkin_names = frappe.get_all(
+		"Employee Checkin", filters={"employee": employee}, pluck="name", limit=20
+	) or ["EMP-CKIN-0001"]
+	checkin_meta = frappe.get_meta("Employee Checkin")
+	history_fields = ["name", "employee", "log_type", "time"] + [
+		fieldname for fieldname in PHOTO_CUSTOM_FIELDS.values() if checkin_meta.has_field(fieldname)
+	]
+
+	queries = [
+		(
+			"history page (log_type filter)",
+			frappe.get_all(
+				"Employee Checkin",
+				filters={"employee": employee, "log_type": "IN", "time": [">=", start]},
+				fields=history_fields,
+				order_by="time desc, name desc",
+				limit=21,
+				run=0,
+			),
+		),
+		(
+			"history page (cursor)",
+			frappe.get_all(
+				"Employee Checkin",
+				filters=[["employee", "=", employee], ["time", ">=", start], ["time", "<=", end]],
+				or_filters=[["time", "<", end], ["name", "<", checkin_names[0]]],
+				fields=history_fields,
+				order_by="time desc, name desc",
+				limit=21,
+				run=0,
+			),
+		),
+		(
+			"history page (summary view)",
+			frappe.get_all(
+				"Employee Checkin",
+				filters={"employee": employee, "time": [">=", start]},
+				fields=SUMMARY_CHECKIN_FIELDS,
+				order_by="time desc, name desc",
+				limit=101,
+				run=0,
+			),
+		),
+		(
+			"history total count",
+			frappe.get_all(
+				"Employee Checkin",
+				filters={"employee": employee, "time": [">=", start]},
+				fields=["count(*) as total"],
+				run=0,
+			),
+		),
+		(
+			"delta sync batch",
+			frappe.get_all(
+				"Employee Checkin",
+				filters=[["employee", "=", employee], ["modified", "<=", end], ["modified", ">=", start]],
+				or_filters=[["modified", ">", start], ["name", ">", checkin_names[0]]],
+				fields=history_fields,
+				order_by="modified asc, name asc",
+				limit=201,
+				run=0,
+			),
+		),
+		(
+			"delta sync tombstones",
+			frappe.get_all(
+				"Deleted Document",
+				filters=[
+					["deleted_doctype", "=", "Employee Checkin"],
+					["creation", ">", start],
+					["creation", "<=", end],
+					["data", "like", f'%"employee": "{employee}"%'],
+				],
+				fields=["deleted_name", "data"],
+				run=0,
+			),
+		),
+		(
+			"photos of a history page",
+			frappe.get_all(
+				"File",
+				filters={
+					"attached_to_doctype": "Employee Checkin",
+					"attached_to_name": ["in", checkin_names],
+				},
+				fields=["name", "file_name", "file_url", "thumbnail_url", "attached_to_name"],
+				order_by="creation desc",
+				run=0,
+			),
+		),
+		(
+			"photos by reference",
+			frappe.get_all(
+				"File",
+				or_filters=[["name", "in", ["FILE-0001"]], ["file_url", "in", ["/files/photo.jpg"]]],
+				fields=["name", "file_url"],
+				run=0,
+			),
+		),
+		(
+			"photo blob by content hash",
+			frappe.get_all(
+				"File",
+				filters={"content_hash": "0" * 32, "file_url": f"/files/{'0' * 32}.jpg"},
+				fields=["file_size", "thumbnail_url"],
+				limit=1,
+				run=0,
+			),
+		),
+	]
+
+	day_start = end.replace(hour=0, minute=0, second=0, microsecond=0)
+	queries.append(
+		(
+			"daily punch rule",
+			frappe.get_all(
+				"Employee Checkin",
+				filters=[
+					["employee", "=", employee],
+					["time", ">=", day_start],
+					["time", "<", day_start + timedelta(days=1)],
+				],
+				fields=["log_type", "time"],
+				run=0,
+			),
+		)
+	)
+	queries.append(
+		(
+			"offline sync punched days",
+			frappe.get_all(
+				"Employee Checkin",
+				filters=[["employee", "=", employee], ["time", ">=", start], ["time", "<", end]],
+				fields=["log_type", "time"],
+				run=0,
+			),
+		)
+	)
+
+	branch_meta = frappe.get_meta("Branch")
+	if branch_meta.has_field("custom_latitude") and branch_meta.has_field("custom_longitude"):
+		queries.append(
+			(
+				"branches near a point",
+				frappe.get_all(
+					"Branch",
+					filters=[
+						["custom_latitude", ">=", 24.7],
+						["custom_latitude", "<=", 24.8],
+						["custom_longitude", ">=", 46.7],
+						["custom_longitude", "<=", 46.8],
+					],
+					fields=["name", "custom_latitude", "custom_longitude", "custom_radius_in_meters"],
+					run=0,
+				),
+			)
+		)
+
+	return queries
+
+
+def explain_hot_queries():
+	"""
+	Run EXPLAIN on every query of get_hot_queries.
+
+	Returns:
+		list: frappe._dict per query with "label", "sql", "plan" (EXPLAIN rows) and
+		"full_scans" (tables read with a full scan)
+	"""
+	report = []
+	for label, sql in get_hot_queries():
+		plan = frappe.db.sql(f"explain {sql}", as_dict=True)
+		full_scans = [row.get("table") for row in plan if (row.get("type") or "").upper() == "ALL"]
+		report.append(frappe._dict(label=label, sql=sql, plan=plan, full_scans=full_scans))
+	return report
@@ -0,0 +1,160 @@
+"""
+Deferred persistence of check-in photos.
+
+In deferred mode the request only stages the photo bytes (see photo_storage.py) and
+answers right away. A background job then moves the staged files into place, creates
+their File records and back-patches the checkin's custom photo fields. Failed attempts
+are retried up to MAX_ATTEMPTS times. Progress is kept in Redis so the app can poll for
+the final URLs (api.get_checkin_photo_status).
+
+Staged files live in the site folder, so workers must share the site's disk with the web
+processes (the default bench setup). A retry whose staged file was already moved into
+place before its transaction rolled back reuses the moved blob (see
+photo_storage.save_staged_photo); staging files of crashed workers are removed by
+photo_storage.cleanup_staging_files.
+"""
+
+import frappe
+
+from frappe_mobile_application import diagnostics, metrics, photo_processing, photo_storage
+
+STATUS_KEY = "mobile_app_photo_status"
+STATUS_TTL = 24 * 60 * 60  # seconds
+
+MAX_ATTEMPTS = 3
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+def enqueue_attach_photos(checkin, employee, staged_photos):
+	"""
+	Hand staged photos over to a background job.
+
+	Args:
+		checkin (str): Employee Checkin name
+		employee (str): Employee ID, used for the photo file names
+		staged_photos (dict): {photo_type: staged photo}. The staged photos are owned by the
+			job from here on (their path is cleared so the caller does not discard them).
+	"""
+	photos = []
+	for photo_type, staged in staged_photos.items():
+		photos.append(
+			{
+				"photo_type": photo_type,
+				"path": staged.path,
+				"size": staged.size,
+				"content_hash": staged.content_hash,
+			}
+		)
+		staged.path = None
+
+	set_status(checkin, PENDING, photos)
+	frappe.enqueue(
+		"frappe_mobile_application.deferred_photos.attach_photos",
+		queue="short",
+		enqueue_after_commit=True,
+		checkin=checkin,
+		employee=employee,
+		photos=photos,
+	)
+
+
+def attach_photos(checkin, employee, photos, attempt=1):
+	"""
+	Background job: save staged photos, attach them to the checkin and back-patch its
+	custom photo fields. Re-enqueues itself on failure until MAX_ATTEMPTS is reached.
+	"""
+	if not frappe.db.exists("Employee Checkin", checkin):
+		# The punch was rolled back (e.g. a rejected punch of an offline sync batch)
+		_discard(photos)
+		set_status(checkin, FAILED, photos)
+		return
+
+	try:
+		checkin_meta = frappe.get_meta("Employee Checkin")
+		for photo in photos:
+			if photo.get("file_id"):
+				if frappe.db.exists("File", photo["file_id"]):
+					continue
+				# The File was deleted since; save the photo again if it is still staged
+				photo.update({"file_id": None, "file_url": None})
+			if not photo.get("path"):
+				continue
+			file_doc = photo_storage.save_staged_photo(
+				frappe._dict(photo),
+				photo_storage.get_photo_file_name(photo["photo_type"], employee),
+				"Employee Checkin",
+				checkin,
+				is_private=0,
+			)
+
+			fieldname = photo_storage.PHOTO_CUSTOM_FIELDS[photo["photo_type"]]
+			if checkin_meta.has_field(fieldname):
+				# Bumps modified, so delta sync (api.sync_employee_checkin_records) picks the photo up
+				frappe.db.set_value("Employee Checkin", checkin, fieldname, file_doc.file_url)
+			# Commit per photo so a retry does not redo photos that are already saved. The photo
+			# is only marked as saved once committed: a rollback drops the File row, and the
+			# retry saves the photo again (reusing the blob already moved into place)
+			frappe.db.commit()
+			photo.update({"path": None, "file_id": file_doc.name, "file_url": file_doc.file_url})
+			if not file_doc.flags.deduplicated:
+				photo_processing.enqueue_photo_processing(file_doc.name)
+	except Exception as e:
+		frappe.db.rollback()
+		if attempt < MAX_ATTEMPTS:
+			diagnostics.log(
+				"create_checkin_checkout",
+				"Deferred Photo Retry",
+				f"Attaching photos to {checkin} failed (attempt {attempt}): {e}",
+				level=diagnostics.WARNING,
+			)
+			set_status(checkin, PENDING, photos, attempts=attempt)
+			frappe.enqueue(
+				"frappe_mobile_application.deferred_photos.attach_photos",
+				queue="short",
+				checkin=checkin,
+				employee=employee,
+				photos=photos,
+				attempt=attempt + 1,
+			)
+			return
+
+		frappe.log_error(
+			title="Deferred Photo Upload Failed",
+			message=f"Attaching photos to {checkin} failed after {attempt} attempts: {e}",
+		)
+		metrics.incr("mobile_app_error_logs_total")
+		_discard(photos)
+		set_status(checkin, FAILED, photos, attempts=attempt)
+		return
+
+	set_status(checkin, DONE, photos, attempts=attempt)
+
+
+def get_status(checkin):
+	"""Return the stored photo status of a checkin, or None if photos were not deferred (or expired)."""
+	return frappe.cache().get_value(f"{STATUS_KEY}:{checkin}")
+
+
+def set_status(checkin, status, photos, attempts=0):
+	"""Store the photo status of a checkin for polling."""
+	frappe.cache().set_value(
+		f"{STATUS_KEY}:{checkin}",
+		{
+			"status": status,
+			"attempts": attempts,
+			"photos": {
+				photo["photo_type"]: {"file_id": photo.get("file_id"), "file_url": photo.get("file_url")}
+				for photo in photos
+			},
+		},
+		expires_in_sec=STATUS_TTL,
+	)
+
+
+def _discard(photos):
+	for photo in photos:
+		photo_storage.discard_staged_photo(frappe._dict(photo))
+		photo["path"] = None
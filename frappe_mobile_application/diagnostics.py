@@ -0,0 +1,160 @@
+"""
+Buffered, sampled diagnostics channel for the mobile endpoints.
+
+Debug traces used to be written with ``frappe.log_error``: one Error Log insert in the
+request path per trace. Records logged here are instead filtered by level, sampled per
+endpoint, and pushed onto a Redis list. A background job drains the list and writes one
+Error Log per endpoint per flush.
+
+Configuration (site_config.json), all keys optional:
+
+	"mobile_app_diagnostics": {
+		"level": "DEBUG",                # minimum level recorded, default WARNING
+		"sample_rate": 1.0,              # default share of records kept per endpoint
+		"sample_rates": {"create_checkin_checkout": 0.05}
+	}
+
+WARNING and above are never sampled out.
+"""
+
+import json
+import random
+
+import frappe
+from frappe.utils import now
+
+from frappe_mobile_application import metrics
+
+BUFFER_KEY = "mobile_app_diagnostics_buffer"
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "ERROR": ERROR}
+DEFAULT_LEVEL = WARNING
+
+# Records kept in the buffer at most; older ones are dropped if flushing falls behind
+MAX_BUFFER_SIZE = 10000
+# Buffer length that triggers a flush job before the next scheduler tick
+FLUSH_THRESHOLD = 500
+# Records drained per flush batch
+FLUSH_BATCH_SIZE = 1000
+
+
+def log(endpoint, title, message, level=DEBUG):
+	"""
+	Record a diagnostics message for an endpoint.
+
+	Args:
+		endpoint (str): Endpoint (or stage) name, used for sampling and grouping
+		title (str): Short title, e.g. "Checkin Photo Debug"
+		message (str or callable): Message body. A callable is only evaluated if the record
+			is kept, so expensive messages cost nothing when filtered or sampled out.
+		level (int, optional): DEBUG, INFO, WARNING or ERROR. Defaults to DEBUG.
+	"""
+	if not is_enabled(endpoint, level):
+		return
+
+	if callable(message):
+		message = message()
+
+	record = json.dumps(
+		{
+			"time": str(now()),
+			"level": level,
+			"endpoint": endpoint,
+			"title": title,
+			"message": message,
+			"user": getattr(frappe.session, "user", None),
+		},
+		default=str,
+	)
+
+	try:
+		cache = frappe.cache()
+		key = cache.make_key(BUFFER_KEY)
+		pipe = cache.pipeline()
+		pipe.rpush(key, record)
+		pipe.ltrim(key, -MAX_BUFFER_SIZE, -1)
+		pipe.llen(key)
+		buffer_size = pipe.execute()[-1]
+	except Exception:
+		# Diagnostics must never break the request
+		return
+
+	if buffer_size >= FLUSH_THRESHOLD:
+		frappe.enqueue(
+			"frappe_mobile_application.diagnostics.flush",
+			queue="short",
+			job_id="mobile_app_diagnostics_flush",
+			deduplicate=True,
+		)
+
+
+def is_enabled(endpoint, level=DEBUG):
+	"""Check whether a record at this level for this endpoint should be kept (applies sampling)."""
+	config = get_config()
+	if level < config["level"]:
+		return False
+	if level >= WARNING:
+		return True
+	sample_rate = config["sample_rates"].get(endpoint, config["sample_rate"])
+	return sample_rate >= 1 or random.random() < sample_rate
+
+
+def get_config():
+	"""Read diagnostics settings from site config, with defaults."""
+	config = frappe.conf.get("mobile_app_diagnostics") or {}
+	level = config.get("level", DEFAULT_LEVEL)
+	if isinstance(level, str):
+		level = LEVELS.get(level.upper(), DEFAULT_LEVEL)
+	return {
+		"level": level,
+		"sample_rate": float(config.get("sample_rate", 1.0)),
+		"sample_rates": {k: float(v) for k, v in (config.get("sample_rates") or {}).items()},
+	}
+
+
+def flush():
+	"""
+	Drain the buffer into Error Log, one entry per endpoint per batch.
+	Runs from the scheduler (see hooks.py) and when the buffer passes FLUSH_THRESHOLD.
+	"""
+	cache = frappe.cache()
+	key = cache.make_key(BUFFER_KEY)
+
+	while True:
+		pipe = cache.pipeline()
+		pipe.lrange(key, 0, FLUSH_BATCH_SIZE - 1)
+		pipe.ltrim(key, FLUSH_BATCH_SIZE, -1)
+		raw_records = pipe.execute()[0]
+		if not raw_records:
+			break
+
+		records_by_endpoint = {}
+		for raw_record in raw_records:
+			try:
+				record = json.loads(raw_record)
+			except ValueError:
+				continue
+			records_by_endpoint.setdefault(record.get("endpoint"), []).append(record)
+
+		for endpoint, records in records_by_endpoint.items():
+			frappe.log_error(
+				title=f"Mobile App Diagnostics: {endpoint} ({len(records)})",
+				message="\n\n".join(_format_record(record) for record in records),
+			)
+			metrics.incr("mobile_app_error_logs_total")
+		frappe.db.commit()
+
+		if len(raw_records) < FLUSH_BATCH_SIZE:
+			break
+
+
+def _format_record(record):
+	level = next(
+		(name for name, value in LEVELS.items() if value == record.get("level")), record.get("level")
+	)
+	return f"[{record.get('time')}] {level} {record.get('title')} (user: {record.get('user')})\n{record.get('message')}"
@@ -0,0 +1,413 @@
+"""
+Cached resolution of an employee's mobile attendance settings.
+
+Resolving the settings for a check-in touches Employee, Branch, Company, Department,
+Project and the allowed branches of the Employee/Department. The resolved result is
+cached per employee in two tiers:
+
+1. An in-process LRU (per worker, short TTL) so hot employees never leave the process.
+2. Redis keys shared by all workers of the site (REDIS_CACHE_TTL).
+
+Redis entries are invalidated through ``doc_events`` (see hooks.py) whenever one of the
+source doctypes, or a custom field on them, changes: once right away and once more
+after the transaction commits, since a punch running in between may re-cache the old
+settings. The in-process tier of the worker that saved the document is cleared
+immediately; other workers pick up the change once their local entry expires
+(LOCAL_CACHE_TTL seconds). Redis entries expire too, so a missed invalidation heals on
+its own.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import frappe
+from frappe import _
+from frappe.exceptions import ValidationError
+from frappe.utils import flt
+
+# Redis keys {SETTINGS_CACHE_KEY}:{employee} -> resolved settings
+SETTINGS_CACHE_KEY = "mobile_app_employee_settings"
+# Redis keys {USER_EMPLOYEE_CACHE_KEY}:{user} -> employee
+USER_EMPLOYEE_CACHE_KEY = "mobile_app_user_employee"
+
+# Doctypes the resolved settings are built from
+SOURCE_DOCTYPES = ("Employee", "Branch", "Company", "Department", "Project")
+
+# Part of the configuration version hash; bump when the configuration payload changes shape
+CONFIG_PAYLOAD_VERSION = 2
+
+LOCAL_CACHE_SIZE = 2048
+LOCAL_CACHE_TTL = 30  # seconds
+REDIS_CACHE_TTL = 6 * 60 * 60  # seconds
+
+# Table MultiSelect (Mobile Attendance Branch) on Employee and Department
+ALLOWED_BRANCHES_FIELD = "custom_allowed_branches"
+
+SETTINGS_FIELDS = (
+	"custom_required_to_upload_location_photo",
+	"custom_required_to_upload_client_bio_metric_photo",
+	"custom_required_location_check_on_check_out",
+)
+
+_local_cache = OrderedDict()
+_local_cache_lock = threading.Lock()
+
+
+def get_employee_settings(employee):
+	"""
+	Get the resolved mobile attendance settings for an employee.
+
+	Args:
+		employee (str): Employee ID
+
+	Returns:
+		frappe._dict: Resolved settings (see _resolve_employee_settings), or None if the
+		employee does not exist
+
+	Raises:
+		ValidationError: If the employee's Company/Department/Project/Branch setup is incomplete
+	"""
+	if not employee:
+		return None
+
+	key = (SETTINGS_CACHE_KEY, employee)
+	settings = _get_local(key)
+	if settings is not None:
+		return frappe._dict(settings)
+
+	settings = frappe.cache().get_value(f"{SETTINGS_CACHE_KEY}:{employee}")
+	if settings is None:
+		settings = _resolve_employee_settings(employee)
+		if settings is None:
+			return None
+		frappe.cache().set_value(f"{SETTINGS_CACHE_KEY}:{employee}", settings, expires_in_sec=REDIS_CACHE_TTL)
+
+	_set_local(key, settings)
+	return frappe._dict(settings)
+
+
+def get_employee_for_user(user):
+	"""
+	Get the Employee linked to a user.
+
+	Args:
+		user (str): User ID
+
+	Returns:
+		str: Employee ID, or None if the user is not linked to an employee
+	"""
+	if not user:
+		return None
+
+	key = (USER_EMPLOYEE_CACHE_KEY, user)
+	employee = _get_local(key)
+	if employee is not None:
+		return employee
+
+	employee = frappe.cache().get_value(f"{USER_EMPLOYEE_CACHE_KEY}:{user}")
+	if employee is None:
+		employee = frappe.db.get_value("Employee", {"user_id": user}, "name")
+		if not employee:
+			return None
+		frappe.cache().set_value(
+			f"{USER_EMPLOYEE_CACHE_KEY}:{user}", employee, expires_in_sec=REDIS_CACHE_TTL
+		)
+
+	_set_local(key, employee)
+	return employee
+
+
+def _resolve_employee_settings(employee):
+	"""
+	Resolve settings from the database, reading only the fields that are needed.
+
+	Settings come from Department or Project (via Department.custom_project) based on
+	Company.custom_attendnace_validations_based_on_department. Location comes from Branch.
+	Allowed branches come from the Employee, else the Department (see _get_allowed_branches).
+
+	Returns: dict, or None if the employee does not exist
+	"""
+	employee_fields = [
+		"name",
+		"employee_name",
+		"employee_number",
+		"user_id",
+		"status",
+		"company_email",
+		"designation",
+		"company",
+		"department",
+		"branch",
+	]
+	employee_meta = frappe.get_meta("Employee")
+	if employee_meta.has_field("employee_code"):
+		employee_fields.append("employee_code")
+
+	employee_doc = frappe.db.get_value("Employee", employee, employee_fields, as_dict=True)
+	if not employee_doc:
+		return None
+
+	department = employee_doc.department or ""
+	branch = employee_doc.branch or ""
+	company = employee_doc.company
+
+	# Validate branch exists
+	if not branch:
+		frappe.throw(
+			_("Employee has no branch assigned. Please assign a branch to the employee."), ValidationError
+		)
+
+	# Get Branch location information (custom fields may not exist if not configured)
+	branch_meta = frappe.get_meta("Branch")
+	branch_fields = ["name", "branch"] + [
+		fieldname
+		for fieldname in ("custom_latitude", "custom_longitude", "custom_radius_in_meters", "address")
+		if branch_meta.has_field(fieldname)
+	]
+	branch_doc = frappe.db.get_value("Branch", branch, branch_fields, as_dict=True) or frappe._dict()
+	branch_name = branch_doc.get("branch") or branch
+	latitude = branch_doc.get("custom_latitude")
+	longitude = branch_doc.get("custom_longitude")
+	radius = branch_doc.get("custom_radius_in_meters")
+
+	# Validate branch has location data (0, 0 means not configured)
+	if (not flt(latitude) and not flt(longitude)) or radius is None:
+		frappe.throw(
+			_(
+				"Branch {0} does not have location information (latitude, longitude, or radius) configured."
+			).format(branch_name),
+			ValidationError,
+		)
+
+	if not company:
+		frappe.throw(_("Employee has no company assigned."), ValidationError)
+
+	company_meta = frappe.get_meta("Company")
+	use_department_settings = False
+	if company_meta.has_field("custom_attendnace_validations_based_on_department"):
+		use_department_settings = bool(
+			frappe.db.get_value("Company", company, "custom_attendnace_validations_based_on_department")
+		)
+
+	settings_source = "department" if use_department_settings else "project"
+	if not department:
+		if use_department_settings:
+			frappe.throw(
+				_("Company setting requires Department settings, but Employee has no Department assigned."),
+				ValidationError,
+			)
+		frappe.throw(
+			_("Company setting requires Project settings, but Employee has no Department assigned."),
+			ValidationError,
+		)
+
+	department_meta = frappe.get_meta("Department")
+	department_fields = ["name", "department_name"]
+	if department_meta.has_field("custom_project"):
+		department_fields.append("custom_project")
+	department_settings_fields = [f for f in SETTINGS_FIELDS if department_meta.has_field(f)]
+	if use_department_settings:
+		department_fields.extend(department_settings_fields)
+	department_doc = (
+		frappe.db.get_value("Department", department, department_fields, as_dict=True) or frappe._dict()
+	)
+	department_name = department_doc.get("department_name")
+
+	project = None
+	project_name = None
+
+	if use_department_settings:
+		# Check if settings fields exist in the doctype
+		if not department_settings_fields:
+			frappe.throw(
+				_(
+					"Company setting requires Department settings, but Department has no validation settings configured. Please configure settings in Department."
+				),
+				ValidationError,
+			)
+		settings_doc = department_doc
+	else:
+		project = department_doc.get("custom_project")
+		if not project:
+			frappe.throw(
+				_(
+					"Company setting requires Project settings, but Department has no linked Project. Please link a Project to Department via custom_project field."
+				),
+				ValidationError,
+			)
+
+		project_meta = frappe.get_meta("Project")
+		project_settings_fields = [f for f in SETTINGS_FIELDS if project_meta.has_field(f)]
+		# Check if settings fields exist in the doctype
+		if not project_settings_fields:
+			frappe.throw(
+				_(
+					"Company setting requires Project settings, but linked Project has no validation settings configured. Please configure settings in Project."
+				),
+				ValidationError,
+			)
+		settings_doc = (
+			frappe.db.get_value(
+				"Project", project, ["name", "project_name", *project_settings_fields], as_dict=True
+			)
+			or frappe._dict()
+		)
+		project_name = settings_doc.get("project_name") or project
+
+	# Any None values default to False
+	settings = {
+		"name": employee_doc.name,
+		"employee_name": employee_doc.employee_name or employee_doc.name,
+		"employee_code": employee_doc.get("employee_code"),
+		"employee_number": employee_doc.employee_number,
+		"user_id": employee_doc.user_id,
+		"status": employee_doc.status,
+		"company_email": employee_doc.company_email,
+		"designation": employee_doc.designation,
+		"company": company,
+		"department": department,
+		"department_name": department_name,
+		"branch": branch,
+		"branch_name": branch_name,
+		"branch_address": branch_doc.get("address"),
+		"latitude": latitude,
+		"longitude": longitude,
+		"radius": radius,
+		"required_to_upload_location_photo": bool(
+			settings_doc.get("custom_required_to_upload_location_photo")
+		),
+		"required_to_upload_client_bio_metric_photo": bool(
+			settings_doc.get("custom_required_to_upload_client_bio_metric_photo")
+		),
+		"require_location_check_on_check_out": bool(
+			settings_doc.get("custom_required_location_check_on_check_out")
+		),
+		"settings_source": settings_source,
+		"project": project,
+		"project_name": project_name,
+		"allowed_branches": _get_allowed_branches(employee_doc.name, department, branch),
+	}
+	settings["config_version"] = get_config_version(settings)
+	return settings
+
+
+def _get_allowed_branches(employee, department, branch):
+	"""
+	Branches the employee may punch at: the employee's own list if set, else the
+	department's list, and always the assigned branch. Read in one query.
+
+	Returns: list of Branch names, assigned branch first
+	"""
+	parents = []
+	if frappe.get_meta("Employee").has_field(ALLOWED_BRANCHES_FIELD):
+		parents.append(("Employee", employee))
+	if department and frappe.get_meta("Department").has_field(ALLOWED_BRANCHES_FIELD):
+		parents.append(("Department", department))
+	if not parents:
+		return [branch]
+
+	rows = frappe.get_all(
+		"Mobile Attendance Branch",
+		filters={
+			"parentfield": ALLOWED_BRANCHES_FIELD,
+			"parenttype": ["in", [parenttype for parenttype, _parent in parents]],
+			"parent": ["in", [parent for _parenttype, parent in parents]],
+		},
+		fields=["parenttype", "parent", "branch"],
+		order_by="idx asc",
+	)
+	branches_by_parent = {}
+	for row in rows:
+		branches_by_parent.setdefault((row.parenttype, row.parent), []).append(row.branch)
+
+	allowed = [branch]
+	for parent in parents:
+		if branches_by_parent.get(parent):
+			allowed.extend(b for b in branches_by_parent[parent] if b not in allowed)
+			break
+	return allowed
+
+
+def get_config_version(settings):
+	"""
+	Version hash of resolved settings, used as the configuration ETag.
+	Bump CONFIG_PAYLOAD_VERSION when the configuration payload format changes.
+	"""
+	payload = json.dumps([CONFIG_PAYLOAD_VERSION, settings], sort_keys=True, default=str)
+	return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+def clear_employee_settings_cache(doc=None, method=None):
+	"""
+	doc_events handler for Employee: drop the cached settings of one employee.
+
+	The user -> employee map is dropped as a whole since the previous user_id
+	of the employee is not known here. Cleared again after commit.
+	"""
+	employee = doc.name if doc else None
+	_clear_employee(employee)
+	frappe.db.after_commit.add(lambda: _clear_employee(employee))
+
+
+def clear_all_employee_settings_cache(doc=None, method=None):
+	"""
+	doc_events handler for Branch, Company, Department and Project.
+	Any of these can affect many employees, so every cached entry is dropped.
+	Cleared again after commit.
+	"""
+	_clear_all()
+	frappe.db.after_commit.add(_clear_all)
+
+
+def _clear_employee(employee):
+	if employee:
+		frappe.cache().delete_value(f"{SETTINGS_CACHE_KEY}:{employee}")
+	frappe.cache().delete_keys(f"{USER_EMPLOYEE_CACHE_KEY}:")
+	_clear_local()
+
+
+def _clear_all():
+	frappe.cache().delete_keys(f"{SETTINGS_CACHE_KEY}:")
+	_clear_local()
+
+
+def on_custom_field_change(doc, method=None):
+	"""doc_events handler for Custom Field: clear the cache when a source doctype's fields change."""
+	if doc.dt in SOURCE_DOCTYPES:
+		clear_employee_settings_cache()
+		clear_all_employee_settings_cache()
+
+
+def _local_key(key):
+	return (getattr(frappe.local, "site", None), *key)
+
+
+def _get_local(key):
+	key = _local_key(key)
+	with _local_cache_lock:
+		entry = _local_cache.get(key)
+		if entry is None:
+			return None
+		expires_at, value = entry
+		if expires_at < time.monotonic():
+			del _local_cache[key]
+			return None
+		_local_cache.move_to_end(key)
+		return value
+
+
+def _set_local(key, value):
+	key = _local_key(key)
+	with _local_cache_lock:
+		_local_cache[key] = (time.monotonic() + LOCAL_CACHE_TTL, value)
+		_local_cache.move_to_end(key)
+		while len(_local_cache) > LOCAL_CACHE_SIZE:
+			_local_cache.popitem(last=False)
+
+
+def _clear_local():
+	with _local_cache_lock:
+		_local_cache.clear()
@@ -0,0 +1,335 @@
+"""
+Geofence lookup over all branches, backed by an in-memory grid index.
+
+Every Branch with coordinates and a radius is a geofence. The index maps grid cells of
+CELL_SIZE degrees to the branches whose geofence overlaps the cell, so a punch only
+measures the distance to the few branches around its own cell instead of loading
+Branch documents. It is built once per site and worker from a single query.
+
+Branch changes bump a version stored in Redis once their transaction commits (see
+hooks.py); each worker compares it on lookup and rebuilds its index when it is stale.
+Without Redis a worker cannot tell whether its index is stale, so lookups fall back to
+get_branches_near, which prefilters with a bounding box in SQL.
+
+Branch coordinates are Float columns with an index (see the
+convert_branch_coordinates_to_float patch and db_indexes.INDEXES). A branch at 0, 0 has
+no location configured.
+"""
+
+import math
+import threading
+
+import frappe
+import redis
+from frappe import _
+from frappe.exceptions import ValidationError
+from frappe.utils import cint, flt
+from hrms.hr.utils import get_distance_between_coordinates
+
+# Redis key holding the current version of the branch geofences
+INDEX_VERSION_KEY = "mobile_app_branch_index_version"
+
+# Search radius in meters of the lookup without an index (see find_geofence)
+NEAR_SEARCH_DISTANCE = 20000
+
+# Branch coordinate field -> largest absolute value
+COORDINATE_LIMITS = {"custom_latitude": 90, "custom_longitude": 180}
+# Index on (custom_latitude, custom_longitude) for bounding box queries
+COORDINATE_INDEX = "custom_latitude_longitude_index"
+
+# Grid cell size in degrees (about 1.1 km of latitude)
+CELL_SIZE = 0.01
+# Geofences spanning more cells than this are checked on every lookup instead
+MAX_CELLS_PER_BRANCH = 2500
+
+METERS_PER_DEGREE = 111320
+
+# site -> BranchIndex
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class BranchIndex:
+	"""Grid of branch geofences: cell -> branch names."""
+
+	def __init__(self, version, branches):
+		"""
+		Args:
+			version (str): Value of INDEX_VERSION_KEY the index was built for
+			branches (dict): {branch: frappe._dict(latitude, longitude, radius)}
+		"""
+		self.version = version
+		self.branches = branches
+		self.cells = {}
+		# Geofences too large for the grid
+		self.wide = []
+
+		for branch, geofence in branches.items():
+			lat_delta = geofence.radius / METERS_PER_DEGREE
+			# Degrees of longitude shrink towards the poles
+			lon_delta = geofence.radius / (
+				METERS_PER_DEGREE * max(math.cos(math.radians(geofence.latitude)), 0.01)
+			)
+			min_row, min_col = _cell(geofence.latitude - lat_delta, geofence.longitude - lon_delta)
+			max_row, max_col = _cell(geofence.latitude + lat_delta, geofence.longitude + lon_delta)
+
+			if (max_row - min_row + 1) * (max_col - min_col + 1) > MAX_CELLS_PER_BRANCH:
+				self.wide.append(branch)
+				continue
+
+			for row in range(min_row, max_row + 1):
+				for col in range(min_col, max_col + 1):
+					self.cells.setdefault((row, col), []).append(branch)
+
+	def candidates(self, latitude, longitude):
+		"""Branches whose geofence may contain the point."""
+		return self.cells.get(_cell(latitude, longitude), []) + self.wide
+
+
+def find_geofence(latitude, longitude, allowed_branches):
+	"""
+	Find the allowed branch whose geofence contains a point, or else the nearest one.
+
+	Args:
+		latitude (float): Latitude of the punch
+		longitude (float): Longitude of the punch
+		allowed_branches (list): Branches the employee may punch at
+
+	Returns:
+		frappe._dict: {"branch", "distance", "radius", "inside"}, where ``inside`` tells
+		whether the point is within the geofence. If several geofences contain the point,
+		the closest branch wins. None if no allowed branch has a location configured.
+	"""
+	index = get_branch_index()
+	if index is None:
+		return _find_geofence_in_db(latitude, longitude, allowed_branches)
+
+	allowed = set(allowed_branches)
+
+	match = _nearest(
+		index.branches,
+		latitude,
+		longitude,
+		(b for b in index.candidates(latitude, longitude) if b in allowed),
+	)
+	if match and match.inside:
+		return match
+
+	# Outside every allowed geofence: report the nearest allowed branch
+	return _nearest(index.branches, latitude, longitude, (b for b in allowed if b in index.branches))
+
+
+def _find_geofence_in_db(latitude, longitude, allowed_branches):
+	"""find_geofence without the branch index: only the allowed branches near the point are read."""
+	for branch in get_branches_near(latitude, longitude, NEAR_SEARCH_DISTANCE, branches=allowed_branches):
+		if branch.inside:
+			return frappe._dict(
+				branch=branch.branch, distance=branch.distance, radius=branch.radius, inside=True
+			)
+
+	# Not inside a geofence nearby: check every allowed branch (a larger geofence may still
+	# contain the point) and report the nearest one
+	geofences = _load_branches(allowed_branches)
+	return _nearest(geofences, latitude, longitude, geofences)
+
+
+def get_geofences(branches):
+	"""
+	Geofences of some branches, from the branch index when it can be used.
+
+	Args:
+		branches (list): Branch names
+
+	Returns:
+		dict: Branch -> frappe._dict with "latitude", "longitude" and "radius", for the
+		branches that have a location configured
+	"""
+	index = get_branch_index()
+	if index is None:
+		return _load_branches(branches)
+	return {branch: index.branches[branch] for branch in branches if branch in index.branches}
+
+
+def get_branches_near(latitude, longitude, distance, branches=None, limit=None):
+	"""
+	Branches within a distance of a point, nearest first.
+
+	Only the rows inside a bounding box around the point are read (served by
+	COORDINATE_INDEX); the exact distance is computed for those rows only.
+
+	Args:
+		latitude (float): Latitude of the point
+		longitude (float): Longitude of the point
+		distance (float): Search radius in meters
+		branches (list, optional): Only consider these branches, e.g. an employee's
+			allowed branches
+		limit (int, optional): Maximum number of branches returned
+
+	Returns:
+		list: frappe._dict with "branch", "branch_name", "latitude", "longitude", "radius",
+		"distance" (meters) and "inside" (point is within the branch geofence)
+	"""
+	if branches is not None and not branches:
+		return []
+
+	lat_delta = distance / METERS_PER_DEGREE
+	lon_delta = distance / (METERS_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+	# Bounding boxes crossing the antimeridian are not split; no branch is that remote
+	filters = [
+		["custom_latitude", ">=", latitude - lat_delta],
+		["custom_latitude", "<=", latitude + lat_delta],
+		["custom_longitude", ">=", longitude - lon_delta],
+		["custom_longitude", "<=", longitude + lon_delta],
+	]
+	if branches is not None:
+		filters.append(["name", "in", list(branches)])
+
+	nearby = []
+	for row in frappe.get_all(
+		"Branch",
+		filters=filters,
+		fields=["name", "branch", "custom_latitude", "custom_longitude", "custom_radius_in_meters"],
+	):
+		if not row.custom_latitude and not row.custom_longitude:
+			continue
+		row_distance = get_distance_between_coordinates(
+			row.custom_latitude, row.custom_longitude, latitude, longitude
+		)
+		if row_distance > distance:
+			# Corner of the bounding box
+			continue
+		nearby.append(
+			frappe._dict(
+				branch=row.name,
+				branch_name=row.branch or row.name,
+				latitude=row.custom_latitude,
+				longitude=row.custom_longitude,
+				radius=cint(row.custom_radius_in_meters),
+				distance=row_distance,
+				inside=row_distance <= cint(row.custom_radius_in_meters),
+			)
+		)
+
+	nearby.sort(key=lambda branch: branch.distance)
+	return nearby[:limit] if limit else nearby
+
+
+def validate_branch_location(doc, method=None):
+	"""doc_events handler for Branch: reject out of range coordinates and negative radii."""
+	for fieldname, limit in COORDINATE_LIMITS.items():
+		if not -limit <= flt(doc.get(fieldname)) <= limit:
+			frappe.throw(
+				_("{0} must be between -{1} and {1} degrees.").format(doc.meta.get_label(fieldname), limit),
+				ValidationError,
+			)
+	if cint(doc.get("custom_radius_in_meters")) < 0:
+		frappe.throw(_("Radius in meters cannot be negative."), ValidationError)
+
+
+def get_branch_index():
+	"""
+	Get this site's branch index, rebuilding it if a Branch changed since it was built.
+	None if Redis cannot be reached, since the index may then be stale.
+	"""
+	site = getattr(frappe.local, "site", None)
+	version = _get_index_version()
+	if version is None:
+		return None
+
+	index = _indexes.get(site)
+	if index is not None and index.version == version:
+		return index
+
+	with _indexes_lock:
+		index = _indexes.get(site)
+		if index is None or index.version != version:
+			index = BranchIndex(version, _load_branches())
+			_indexes[site] = index
+	return index
+
+
+def clear_branch_index(doc=None, method=None):
+	"""
+	doc_events handler for Branch: make every worker rebuild its index on next use.
+
+	The version is bumped after commit: bumped earlier, a worker rebuilding in between
+	would read the old coordinates and keep them under the new version.
+	"""
+	frappe.db.after_commit.add(_bump_index_version)
+
+
+def _get_index_version():
+	cache = frappe.cache()
+	key = cache.make_key(INDEX_VERSION_KEY)
+	try:
+		version = cache.get(key)
+		if version is None:
+			# First use, or Redis was flushed; the first worker to get here sets the version
+			cache.set(key, frappe.generate_hash(length=10), nx=True)
+			version = cache.get(key)
+	except redis.exceptions.ConnectionError:
+		return None
+	return version
+
+
+def _bump_index_version():
+	cache = frappe.cache()
+	try:
+		cache.set(cache.make_key(INDEX_VERSION_KEY), frappe.generate_hash(length=10))
+	except redis.exceptions.ConnectionError:
+		# Lookups use get_branches_near until Redis is back
+		pass
+	with _indexes_lock:
+		_indexes.pop(getattr(frappe.local, "site", None), None)
+
+
+def on_custom_field_change(doc, method=None):
+	"""doc_events handler for Custom Field: rebuild the index when Branch fields change."""
+	if doc.dt == "Branch":
+		clear_branch_index()
+
+
+def _load_branches(names=None):
+	"""Read the geofence of every branch (or of ``names``) that has one configured, in one query."""
+	fields = (*COORDINATE_LIMITS, "custom_radius_in_meters")
+	branch_meta = frappe.get_meta("Branch")
+	if not all(branch_meta.has_field(fieldname) for fieldname in fields):
+		return {}
+
+	if names is not None and not names:
+		return {}
+
+	branches = {}
+	filters = {"name": ["in", list(names)]} if names is not None else None
+	for row in frappe.get_all("Branch", filters=filters, fields=["name", *fields]):
+		try:
+			geofence = frappe._dict(
+				latitude=float(row.custom_latitude),
+				longitude=float(row.custom_longitude),
+				radius=int(row.custom_radius_in_meters),
+			)
+		except (TypeError, ValueError):
+			# Location not (or not properly) configured
+			continue
+		if not geofence.latitude and not geofence.longitude:
+			continue
+		branches[row.name] = geofence
+	return branches
+
+
+def _nearest(geofences, latitude, longitude, branches):
+	nearest = None
+	for branch in branches:
+		geofence = geofences[branch]
+		distance = get_distance_between_coordinates(
+			geofence.latitude, geofence.longitude, latitude, longitude
+		)
+		inside = distance <= geofence.radius
+		# Prefer any geofence containing the point, then the shortest distance
+		if nearest is None or (inside, -distance) > (nearest.inside, -nearest.distance):
+			nearest = frappe._dict(branch=branch, distance=distance, radius=geofence.radius, inside=inside)
+	return nearest
+
+
+def _cell(latitude, longitude):
+	return (math.floor(latitude / CELL_SIZE), math.floor(longitude / CELL_SIZE))
@@ -83,7 +83,12 @@ app_license = "mit"
 # ------------
 
 # before_install = "frappe_mobile_application.install.before_install"
-# after_install = "frappe_mobile_application.install.after_install"
+after_install = "frappe_mobile_application.db_indexes.ensure_indexes"
+
+# Migration
+# ------------
+
+after_migrate = ["frappe_mobile_application.db_indexes.ensure_indexes"]
 
 # Uninstallation
 # ------------
@@ -145,6 +150,61 @@ app_license = "mit"
 # 	}
 # }
 
+doc_events = {
+	"Employee": {
+		"on_update": "frappe_mobile_application.employee_settings.clear_employee_settings_cache",
+		"on_trash": "frappe_mobile_application.employee_settings.clear_employee_settings_cache",
+		"after_rename": "frappe_mobile_application.employee_settings.clear_employee_settings_cache",
+	},
+	"Branch": {
+		"validate": "frappe_mobile_application.geofence.validate_branch_location",
+		"on_update": [
+			"frappe_mobile_application.employee_settings.clear_all_employee_settings_cache",
+			"frappe_mobile_application.geofence.clear_branch_index",
+		],
+		"on_trash": [
+			"frappe_mobile_application.employee_settings.clear_all_employee_settings_cache",
+			"frappe_mobile_application.geofence.clear_branch_index",
+		],
+		"after_rename": [
+			"frappe_mobile_application.employee_settings.clear_all_employee_settings_cache",
+			"frappe_mobile_application.geofence.clear_branch_index",
+		],
+	},
+	"Company": {
+		"on_update": "frappe_mobile_application.employee_settings.clear_all_employee_settings_cache",
+		"on_trash": "frappe_mobile_application.employee_settings.clear_all_employee_settings_cache",
+		"after_rename": "frappe_mobile_application.employee_settings.clear_all_employee_settings_cache",
+	},
+	"Department": {
+		"on_update": "frappe_mobile_application.employee_settings.clear_all_employee_settings_cache",
+		"on_trash": "frappe_mobile_application.employee_settings.clear_all_employee_settings_cache",
+		"after_rename": "frappe_mobile_application.employee_settings.clear_all_employee_settings_cache",
+	},
+	"Project": {
+		"on_update": "frappe_mobile_application.employee_settings.clear_all_employee_settings_cache",
+		"on_trash": "frappe_mobile_application.employee_settings.clear_all_employee_settings_cache",
+		"after_rename": "frappe_mobile_application.employee_settings.clear_all_employee_settings_cache",
+	},
+	"File": {
+		"after_delete": "frappe_mobile_application.photo_processing.on_file_delete",
+	},
+	"Attendance": {
+		"on_submit": "frappe_mobile_application.checkin_sync.on_attendance_submit",
+		"before_cancel": "frappe_mobile_application.checkin_sync.on_attendance_cancel",
+	},
+	"Custom Field": {
+		"on_update": [
+			"frappe_mobile_application.employee_settings.on_custom_field_change",
+			"frappe_mobile_application.geofence.on_custom_field_change",
+		],
+		"on_trash": [
+			"frappe_mobile_application.employee_settings.on_custom_field_change",
+			"frappe_mobile_application.geofence.on_custom_field_change",
+		],
+	},
+}
+
 # Scheduled Tasks
 # ---------------
 
@@ -166,6 +226,16 @@ app_license = "mit"
 # 	],
 # }
 
+scheduler_events = {
+	"all": [
+		"frappe_mobile_application.diagnostics.flush",
+		"frappe_mobile_application.punch_queue.drain_all",
+	],
+	"daily": [
+		"frappe_mobile_application.photo_storage.cleanup_staging_files",
+	],
+}
+
 # Testing
 # -------
 
@@ -253,6 +323,7 @@ fixtures = [
 					"Branch-custom_column_break_pwwle",
 					"Employee Checkin-custom_location_photo",
 					"Employee Checkin-custom_client_bio_metric_photo",
+					"Employee Checkin-custom_punch_date",
 					"Company-custom_attendnace_validations_based_on_department",
 					"Project-custom_required_location_check_on_check_out",
 					"Project-custom_column_break_ievfh",
@@ -267,6 +338,8 @@ fixtures = [
 					"Branch-custom_radius_in_meters",
 					"Branch-custom_column_break_hvd5h",
 					"Branch-custom_mobile_app_attendance_configurations",
+					"Employee-custom_allowed_branches",
+					"Department-custom_allowed_branches",
 				]
 			]
 		]
@@ -0,0 +1,72 @@
+"""
+Idempotency keys for punch creation.
+
+The mobile app may retry a punch on a flaky network. When it sends a
+``client_request_id``, the first successful response and its HTTP status are kept in
+Redis for REPLAY_TTL seconds and returned as-is to any retry carrying the same ID, before any
+database or photo work. While the first request is still running, a retry is told so
+instead of running the pipeline a second time.
+
+Keys are scoped to the session user, so IDs only need to be unique per user.
+"""
+
+import frappe
+
+RESPONSE_KEY = "mobile_app_request_response"
+LOCK_KEY = "mobile_app_request_lock"
+
+# How long a successful response is replayed (seconds)
+REPLAY_TTL = 15 * 60
+# Upper bound for a request holding the in-flight lock (seconds)
+LOCK_TTL = 60
+
+
+def _key(prefix, client_request_id):
+	return frappe.cache().make_key(f"{prefix}:{frappe.session.user}:{client_request_id}")
+
+
+def get_receipt(client_request_id):
+	"""
+	Return the stored response for client_request_id, or None.
+	Returns: frappe._dict with "response" and "http_status_code"
+	"""
+	if not client_request_id:
+		return None
+	receipt = frappe.cache().get_value(f"{RESPONSE_KEY}:{frappe.session.user}:{client_request_id}")
+	if receipt is None:
+		return None
+	return frappe._dict(receipt)
+
+
+def get_response(client_request_id):
+	"""Return the stored response body for client_request_id, or None."""
+	receipt = get_receipt(client_request_id)
+	return receipt.response if receipt else None
+
+
+def store_response(client_request_id, response, http_status_code=200):
+	"""Store a successful response and its HTTP status for replay."""
+	if not client_request_id:
+		return
+	frappe.cache().set_value(
+		f"{RESPONSE_KEY}:{frappe.session.user}:{client_request_id}",
+		{"response": response, "http_status_code": http_status_code},
+		expires_in_sec=REPLAY_TTL,
+	)
+
+
+def acquire(client_request_id):
+	"""
+	Mark client_request_id as in flight.
+	Returns: False if another request with the same ID is already running
+	"""
+	if not client_request_id:
+		return True
+	return bool(frappe.cache().set(_key(LOCK_KEY, client_request_id), 1, nx=True, ex=LOCK_TTL))
+
+
+def release(client_request_id):
+	"""Clear the in-flight mark of client_request_id."""
+	if not client_request_id:
+		return
+	frappe.cache().delete(_key(LOCK_KEY, client_request_id))
@@ -0,0 +1,518 @@
+"""
+Shift-start surge load test of create_checkin_checkout against a bench site.
+
+``bench --site <site> mobile-app-loadtest`` (see commands.py) replays the few minutes
+around a shift start: every seeded employee punches in once, with arrival times drawn
+from an arrival curve, each punch carrying photos sent as base64 or multipart. A share
+of punches is retried with the same client_request_id and a share is sent from outside
+the geofence. Requests go over HTTP to the running site (web workers, background
+workers, Redis and database as in production), each virtual phone authenticating with
+its own API token and sending its own X-Forwarded-For address.
+
+The report gives throughput, latency percentiles (from the scheduled arrival, so client
+queueing counts, and per request), outcomes, the peak memory of the web and background
+worker processes on this machine, and database row lock waits during the run.
+
+The employees are those seeded by benchmark.py (``mobile-app-benchmark --scale ...``);
+the load test gives each one a user and token. Their punches of today are deleted
+before every run. Use a test site only.
+"""
+
+import base64
+import io
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import frappe
+from frappe.utils import getdate, now_datetime
+from frappe.utils.password import set_encrypted_password
+
+from frappe_mobile_application.benchmark import SEED_PREFIX
+from frappe_mobile_application.employee_settings import clear_all_employee_settings_cache
+
+DEFAULT_PROFILE = {
+	# Punches (one per employee)
+	"employees": 1000,
+	# Length of the surge in seconds
+	"duration": 300,
+	# "normal": around the middle of the surge, "shift_start": most arrivals right at the
+	# start and tailing off, "uniform": spread evenly
+	"curve": "normal",
+	# Requests in flight at most (client side)
+	"concurrency": 200,
+	# Photos per punch: 0, 1 (location) or 2 (location and biometric)
+	"photos": 2,
+	"photo_kb": 200,
+	# Share of punches sending their photos as multipart files instead of base64
+	"multipart_share": 0.5,
+	# Share of punches sent a second time with the same client_request_id
+	"retry_share": 0.05,
+	# Share of punches sent from outside the geofence (expected to be rejected)
+	"out_of_radius_share": 0.05,
+	# Send punches with queued=1 (the site must enable the punch queue, see punch_queue.py)
+	"queued": False,
+	# Request timeout in seconds
+	"timeout": 60,
+}
+
+CURVES = ("normal", "shift_start", "uniform")
+
+# Roles of the load test users; they need to be allowed to create Employee Checkin
+DEFAULT_ROLES = ("Employee",)
+USER_DOMAIN = "example.com"
+
+# Degrees: jitter of punches inside a geofence (about 30 m) and offset of those outside (about 5 km)
+INSIDE_JITTER = 0.0003
+OUTSIDE_OFFSET = 0.05
+
+# Seconds between memory samples
+MEMORY_SAMPLE_INTERVAL = 1.0
+# Command line fragments of the processes sampled
+WEB_PROCESSES = ("frappe.app:application", "serve --port")
+WORKER_PROCESSES = ("frappe worker", "rq:worker")
+
+LOCK_STATUS = (
+	"Innodb_row_lock_waits",
+	"Innodb_row_lock_time",
+	"Innodb_row_lock_time_max",
+	"Innodb_deadlocks",
+)
+
+CHECKIN_METHOD = "/api/method/frappe_mobile_application.api.create_checkin_checkout"
+
+
+def get_profile(**overrides):
+	"""DEFAULT_PROFILE with the given (non-None) overrides, validated."""
+	profile = frappe._dict(DEFAULT_PROFILE)
+	profile.update({key: value for key, value in overrides.items() if value is not None})
+	if profile.curve not in CURVES:
+		frappe.throw(f"Unknown arrival curve {profile.curve}. Use one of: {', '.join(CURVES)}")
+	if profile.photos not in (0, 1, 2):
+		frappe.throw("photos must be 0, 1 or 2.")
+	for share in ("multipart_share", "retry_share", "out_of_radius_share"):
+		if not 0 <= profile[share] <= 1:
+			frappe.throw(f"{share} must be between 0 and 1.")
+	return profile
+
+
+def prepare(count, roles=DEFAULT_ROLES):
+	"""
+	Get the seeded employees ready for a run: link each to a user with an API token and
+	delete their punches of today. Commits.
+
+	Returns:
+		list: frappe._dict per employee with "employee", "token", "latitude", "longitude"
+	"""
+	employees = frappe.get_all(
+		"Employee",
+		filters={"name": ["like", f"{SEED_PREFIX}-%"], "status": "Active"},
+		fields=["name", "branch", "user_id"],
+		order_by="name asc",
+		limit=count,
+	)
+	if len(employees) < count:
+		frappe.throw(
+			f"Only {len(employees)} seeded employees. Seed a larger scale with mobile-app-benchmark first."
+		)
+
+	branches = {
+		row.name: row
+		for row in frappe.get_all(
+			"Branch",
+			filters={"name": ["in", list({employee.branch for employee in employees})]},
+			fields=["name", "custom_latitude", "custom_longitude"],
+		)
+	}
+
+	_create_users([employee for employee in employees if not employee.user_id], roles)
+	_delete_todays_punches([employee.name for employee in employees])
+
+	targets = []
+	for employee in employees:
+		user = employee.user_id or _get_user(employee.name)
+		api_key = frappe.db.get_value("User", user, "api_key")
+		api_secret = frappe.generate_hash(length=15)
+		set_encrypted_password("User", user, api_secret, "api_secret")
+		branch = branches[employee.branch]
+		targets.append(
+			frappe._dict(
+				employee=employee.name,
+				token=f"{api_key}:{api_secret}",
+				latitude=branch.custom_latitude,
+				longitude=branch.custom_longitude,
+			)
+		)
+
+	clear_all_employee_settings_cache()
+	frappe.db.commit()
+	return targets
+
+
+def build_schedule(count, duration, curve, rng):
+	"""Arrival offsets in seconds from the start of the surge, sorted."""
+	offsets = []
+	for _i in range(count):
+		if curve == "normal":
+			offset = rng.gauss(duration / 2, duration / 6)
+		elif curve == "shift_start":
+			# Exponential decay: about 80% of arrivals in the first third
+			offset = rng.expovariate(5 / duration)
+		else:
+			offset = rng.uniform(0, duration)
+		offsets.append(min(max(offset, 0), duration))
+	return sorted(offsets)
+
+
+def run(url, targets, profile, seed=None):
+	"""
+	Replay the surge against a site.
+
+	Args:
+		url (str): Base URL of the site, e.g. http://localhost:8000
+		targets (list): Result of prepare
+		profile (frappe._dict): Result of get_profile
+		seed (int, optional): Random seed, for repeatable runs
+
+	Returns:
+		frappe._dict: The report, see format_report
+	"""
+	import requests
+
+	rng = random.Random(seed)
+	schedule = build_schedule(len(targets), profile.duration, profile.curve, rng)
+	photos = _make_photos(profile.photo_kb)
+	results = []
+	results_lock = threading.Lock()
+	sessions = threading.local()
+
+	def rng_for(punch):
+		return random.Random(f"{seed}:{punch.employee}")
+
+	def send(punch, params, files):
+		session = getattr(sessions, "session", None)
+		if session is None:
+			session = sessions.session = requests.Session()
+		headers = {
+			"Authorization": f"token {punch.token}",
+			"X-Forwarded-For": punch.ip,
+			"Accept": "application/json",
+		}
+		sent = time.perf_counter()
+		try:
+			if files:
+				response = session.post(
+					url + CHECKIN_METHOD, data=params, files=files, headers=headers, timeout=profile.timeout
+				)
+			else:
+				response = session.post(
+					url + CHECKIN_METHOD, json=params, headers=headers, timeout=profile.timeout
+				)
+			status, body = response.status_code, _get_message(response)
+		except requests.RequestException as e:
+			status, body = None, {"exception": str(e)}
+		return sent, time.perf_counter(), status, body
+
+	def punch_in(punch, scheduled):
+		params, files = _build_request(punch, profile, photos, rng_for(punch))
+		sent, done, status, body = send(punch, params, files)
+		result = frappe._dict(
+			scheduled=scheduled,
+			sent=sent,
+			done=done,
+			outcome=_classify(status, body, punch.outside),
+			retry_outcome=None,
+		)
+		if punch.retry:
+			# Same client_request_id: should get the stored response back
+			_sent, _done, retry_status, retry_body = send(punch, params, files)
+			# Queued punches are identified by their receipt
+			id_key = "receipt_id" if profile.queued else "checkin_id"
+			replayed = (
+				retry_status in (200, 202)
+				and isinstance(body, dict)
+				and retry_body.get(id_key)
+				and retry_body.get(id_key) == body.get(id_key)
+			)
+			result.retry_outcome = (
+				"replayed" if replayed else _classify(retry_status, retry_body, punch.outside)
+			)
+		with results_lock:
+			results.append(result)
+
+	punches = []
+	for index, target in enumerate(targets):
+		punches.append(
+			frappe._dict(
+				target,
+				ip=f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}",
+				multipart=rng.random() < profile.multipart_share,
+				retry=rng.random() < profile.retry_share,
+				outside=rng.random() < profile.out_of_radius_share,
+			)
+		)
+	rng.shuffle(punches)
+
+	sampler = MemorySampler()
+	locks_before = get_lock_status()
+	sampler.start()
+	start = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=profile.concurrency) as executor:
+		for punch, offset in zip(punches, schedule, strict=True):
+			delay = start + offset - time.perf_counter()
+			if delay > 0:
+				time.sleep(delay)
+			executor.submit(punch_in, punch, start + offset)
+	elapsed = time.perf_counter() - start
+	sampler.stop()
+	locks_after = get_lock_status()
+
+	return _build_report(results, elapsed, sampler, locks_before, locks_after, profile)
+
+
+def get_lock_status():
+	"""InnoDB row lock counters of the database server (MariaDB / MySQL)."""
+	try:
+		rows = frappe.db.sql(
+			"show global status where Variable_name in %(names)s", {"names": LOCK_STATUS}, as_dict=True
+		)
+	except Exception:
+		return {}
+	return {row.Variable_name: int(row.Value) for row in rows}
+
+
+class MemorySampler:
+	"""Sample the resident memory of the site's web and worker processes in a thread."""
+
+	def __init__(self):
+		self.peaks = {"web": 0, "worker": 0}
+		self.process_peak = 0
+		self._stop = threading.Event()
+		self._thread = threading.Thread(target=self._run, daemon=True)
+
+	def start(self):
+		self._thread.start()
+
+	def stop(self):
+		self._stop.set()
+		self._thread.join()
+
+	def _run(self):
+		import psutil
+
+		while not self._stop.is_set():
+			totals = {"web": 0, "worker": 0}
+			for process in psutil.process_iter(["cmdline", "memory_info"]):
+				cmdline = " ".join(process.info.get("cmdline") or [])
+				memory = process.info.get("memory_info")
+				if not memory:
+					continue
+				kind = (
+					"web"
+					if any(fragment in cmdline for fragment in WEB_PROCESSES)
+					else "worker"
+					if any(fragment in cmdline for fragment in WORKER_PROCESSES)
+					else None
+				)
+				if kind:
+					totals[kind] += memory.rss
+					self.process_peak = max(self.process_peak, memory.rss)
+			for kind, total in totals.items():
+				self.peaks[kind] = max(self.peaks[kind], total)
+			self._stop.wait(MEMORY_SAMPLE_INTERVAL)
+
+
+def format_report(report):
+	"""Lines of text for the command output."""
+	mib = 1024 * 1024
+	lines = [
+		f"Punches: {report.punches} in {report.elapsed:.1f}s "
+		f"({report.throughput:.1f} successful punches/s, {report.request_rate:.1f} requests/s)",
+		"Latency from arrival: " + _format_latency(report.latency),
+		"Latency per request:  " + _format_latency(report.service_latency),
+		"Outcomes: " + ", ".join(f"{outcome}={count}" for outcome, count in sorted(report.outcomes.items())),
+	]
+	if report.retry_outcomes:
+		lines.append(
+			"Retries: "
+			+ ", ".join(f"{outcome}={count}" for outcome, count in sorted(report.retry_outcomes.items()))
+		)
+	lines.append(
+		f"Peak memory: web {report.memory.web / mib:.0f} MiB, workers {report.memory.worker / mib:.0f} MiB, "
+		f"largest process {report.memory.process / mib:.0f} MiB"
+	)
+	if report.lock_waits:
+		lines.append(
+			"DB row locks: " + ", ".join(f"{name}={value}" for name, value in report.lock_waits.items())
+		)
+	return lines
+
+
+def _build_report(results, elapsed, sampler, locks_before, locks_after, profile):
+	outcomes = {}
+	retry_outcomes = {}
+	for result in results:
+		outcomes[result.outcome] = outcomes.get(result.outcome, 0) + 1
+		if result.retry_outcome:
+			retry_outcomes[result.retry_outcome] = retry_outcomes.get(result.retry_outcome, 0) + 1
+
+	lock_waits = {}
+	for name, value in locks_after.items():
+		# The maximum is a high-water mark, the others are counters
+		lock_waits[name] = value if name == "Innodb_row_lock_time_max" else value - locks_before.get(name, 0)
+
+	requests_sent = len(results) + sum(1 for result in results if result.retry_outcome)
+	return frappe._dict(
+		punches=len(results),
+		elapsed=elapsed,
+		throughput=outcomes.get("success", 0) / elapsed if elapsed else 0,
+		request_rate=requests_sent / elapsed if elapsed else 0,
+		latency=_percentiles([result.done - result.scheduled for result in results]),
+		service_latency=_percentiles([result.done - result.sent for result in results]),
+		outcomes=outcomes,
+		retry_outcomes=retry_outcomes,
+		memory=frappe._dict(sampler.peaks, process=sampler.process_peak),
+		lock_waits=lock_waits,
+		profile=profile,
+	)
+
+
+def _build_request(punch, profile, photos, rng):
+	latitude = punch.latitude + rng.uniform(-INSIDE_JITTER, INSIDE_JITTER)
+	longitude = punch.longitude + rng.uniform(-INSIDE_JITTER, INSIDE_JITTER)
+	if punch.outside:
+		latitude += OUTSIDE_OFFSET
+	params = {
+		"log_type": "IN",
+		"latitude": round(latitude, 7),
+		"longitude": round(longitude, 7),
+		"device_id": f"LOADTEST-{punch.employee}",
+		"client_request_id": uuid.uuid4().hex,
+	}
+	if profile.queued:
+		params["queued"] = 1
+
+	files = {}
+	for photo_type, param in (("location", "location_photo"), ("biometric", "client_biometric_photo"))[
+		: profile.photos
+	]:
+		# Random trailing bytes make every photo unique, so uploads are not deduplicated
+		content = photos[photo_type] + os.urandom(16)
+		if punch.multipart:
+			files[param] = (f"{param}.jpg", content, "image/jpeg")
+		else:
+			params[param] = "data:image/jpeg;base64," + base64.b64encode(content).decode()
+	return params, files
+
+
+def _classify(status, body, outside):
+	if status is None:
+		return "connection_error"
+	if status == 429:
+		return "rate_limited"
+	if status == 409:
+		return "in_progress"
+	if status == 503 and isinstance(body, dict) and body.get("exception"):
+		# Refused by the punch queue's backpressure
+		return "queue_full"
+	if status >= 500:
+		return "server_error"
+	if isinstance(body, dict) and body.get("status") in ("success", "accepted"):
+		# A punch from outside the geofence must not succeed
+		return "accepted_outside" if outside else "success"
+	return "rejected_outside" if outside else "rejected"
+
+
+def _get_message(response):
+	try:
+		return response.json().get("message") or {}
+	except ValueError:
+		return {"exception": response.text[:200]}
+
+
+def _percentiles(values):
+	values = sorted(values)
+	if not values:
+		return {}
+	return {
+		label: values[min(len(values) - 1, math.ceil(len(values) * percentile / 100) - 1)]
+		for label, percentile in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))
+	}
+
+
+def _format_latency(latency):
+	return " ".join(f"{label}={seconds * 1000:.0f}ms" for label, seconds in latency.items()) or "-"
+
+
+def _make_photos(photo_kb):
+	"""A location and a biometric JPEG of about photo_kb each."""
+	from PIL import Image
+
+	photos = {}
+	for photo_type in ("location", "biometric"):
+		side = 256
+		for _attempt in range(3):
+			# Noise compresses about as badly as a camera photo
+			buffer = io.BytesIO()
+			Image.effect_noise((side, side), 64).convert("RGB").save(buffer, "JPEG", quality=85)
+			size = buffer.tell()
+			side = max(16, int(side * math.sqrt(photo_kb * 1024 / size)))
+		photos[photo_type] = buffer.getvalue()
+	return photos
+
+
+def _create_users(employees, roles):
+	"""Create and link a user per employee, with bulk inserts."""
+	if not employees:
+		return
+	now = now_datetime()
+	users = [(employee.name, _get_user(employee.name)) for employee in employees]
+	audit_fields = ["creation", "modified", "owner", "modified_by", "docstatus"]
+	audit = [now, now, "Administrator", "Administrator", 0]
+	frappe.db.bulk_insert(
+		"User",
+		["name", "email", "first_name", "full_name", "enabled", "user_type", "api_key", *audit_fields],
+		[
+			[user, user, employee, employee, 1, "System User", frappe.generate_hash(length=15), *audit]
+			for employee, user in users
+		],
+	)
+	frappe.db.bulk_insert(
+		"Has Role",
+		["name", "parent", "parenttype", "parentfield", "role", "idx", *audit_fields],
+		[
+			[frappe.generate_hash(length=10), user, "User", "roles", role, idx, *audit]
+			for _employee, user in users
+			for idx, role in enumerate(roles, 1)
+		],
+	)
+	for employee, user in users:
+		frappe.db.set_value("Employee", employee, "user_id", user, update_modified=False)
+	frappe.db.commit()
+
+
+def _get_user(employee):
+	return f"{employee.lower()}@{USER_DOMAIN}"
+
+
+def _delete_todays_punches(employees):
+	"""Delete today's punches of the employees and their photos, so they can punch again."""
+	today = getdate()
+	checkins = frappe.get_all(
+		"Employee Checkin",
+		filters={"employee": ["in", employees], "time": [">=", today]},
+		pluck="name",
+	)
+	for file_name in frappe.get_all(
+		"File",
+		filters={"attached_to_doctype": "Employee Checkin", "attached_to_name": ["in", checkins or [""]]},
+		pluck="name",
+	):
+		frappe.delete_doc("File", file_name, ignore_permissions=True, force=True)
+	if checkins:
+		frappe.db.delete("Employee Checkin", {"name": ["in", checkins]})
+	frappe.db.commit()
@@ -0,0 +1,275 @@
+"""
+Request and stage metrics of the mobile endpoints, in Prometheus text format.
+
+Endpoints in api.py are wrapped with ``instrument``: every call records its duration,
+outcome and database query count. Inside a call, ``span`` times a stage (settings
+resolution, geofence, photo staging, fetch_shift, insert, ...) and ``incr`` / ``reject``
+count bytes ingested, Error Log writes and rejections by reason. A call collects its
+metrics in memory and adds them to one Redis hash in a single pipeline when it ends.
+
+Durations are histograms with DURATION_BUCKETS, so p95 punch latency can be computed
+and alerted on in Prometheus, e.g.:
+
+	histogram_quantile(0.95, sum by (le) (rate(
+		mobile_app_request_duration_seconds_bucket{endpoint="create_checkin_checkout"}[5m])))
+
+api.get_metrics serves the text format to System Managers.
+
+Configuration (site_config.json), all keys optional:
+
+	"mobile_app_metrics": {
+		"enabled": true
+	}
+
+If Redis is unavailable, metrics are dropped.
+"""
+
+import functools
+import time
+from contextlib import contextmanager
+
+import frappe
+from frappe.exceptions import DoesNotExistError, PermissionError, ValidationError
+
+METRICS_KEY = "mobile_app_metrics"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds of the duration histogram buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# name -> (type, help)
+METRICS = {
+	"mobile_app_request_duration_seconds": ("histogram", "Duration of mobile API calls"),
+	"mobile_app_stage_duration_seconds": ("histogram", "Duration of stages within mobile API calls"),
+	"mobile_app_requests_total": ("counter", "Mobile API calls by outcome (ok, rejected, error)"),
+	"mobile_app_db_queries_total": ("counter", "Database queries run by mobile API calls"),
+	"mobile_app_ingested_bytes_total": ("counter", "Photo bytes received by mobile API calls"),
+	"mobile_app_error_logs_total": ("counter", "Error Log documents written by the mobile app"),
+	"mobile_app_rejections_total": ("counter", "Rejected mobile API calls and punches by reason"),
+	"mobile_app_queued_punches_total": ("counter", "Queued punches drained into Employee Checkin by outcome"),
+}
+
+# Endpoint label of metrics recorded outside an instrumented call (background jobs)
+BACKGROUND = "background"
+
+
+class QueryCounter:
+	"""Count ``frappe.db.sql`` calls while in the ``with`` block. Counters may be nested."""
+
+	def __enter__(self):
+		self.count = 0
+		# An outer counter's wrapper, if any, is restored on exit
+		self.previous = frappe.db.__dict__.get("sql")
+		sql = frappe.db.sql
+
+		def counting_sql(*args, **kwargs):
+			self.count += 1
+			return sql(*args, **kwargs)
+
+		# Instance attribute: also seen by the Database methods calling self.sql
+		frappe.db.sql = counting_sql
+		return self
+
+	def __exit__(self, *exc):
+		if self.previous is None:
+			del frappe.db.sql
+		else:
+			frappe.db.sql = self.previous
+
+
+class _Recorder:
+	"""Metrics of one instrumented call, written to Redis when it ends."""
+
+	def __init__(self, endpoint):
+		self.endpoint = endpoint
+		self.values = {}
+		self.rejected = False
+
+	def add(self, name, labels, amount):
+		field = f"{name}|{_format_labels(labels)}"
+		self.values[field] = self.values.get(field, 0) + amount
+
+	def observe(self, name, labels, seconds):
+		bucket = next((str(bound) for bound in DURATION_BUCKETS if seconds <= bound), "+Inf")
+		# Buckets are stored per bucket and made cumulative when rendered
+		self.add(f"{name}_bucket", {**labels, "le": bucket}, 1)
+		self.add(f"{name}_sum", labels, seconds)
+		self.add(f"{name}_count", labels, 1)
+
+	def flush(self):
+		if not self.values:
+			return
+		try:
+			cache = frappe.cache()
+			key = cache.make_key(METRICS_KEY)
+			pipe = cache.pipeline()
+			for field, amount in self.values.items():
+				pipe.hincrbyfloat(key, field, amount)
+			pipe.execute()
+		except Exception:
+			# Metrics must never take the endpoints down
+			pass
+		self.values = {}
+
+
+def instrument(fn):
+	"""
+	Decorator for whitelisted endpoints (below ``@frappe.whitelist()``): record duration,
+	outcome and query count of every call, and collect the spans and counters of the call.
+	"""
+
+	@functools.wraps(fn)
+	def wrapper(*args, **kwargs):
+		if not is_enabled() or getattr(frappe.local, "mobile_app_metrics", None) is not None:
+			return fn(*args, **kwargs)
+
+		recorder = _Recorder(fn.__name__)
+		frappe.local.mobile_app_metrics = recorder
+		outcome = "error"
+		queries = None
+		start = time.perf_counter()
+		try:
+			with QueryCounter() as queries:
+				response = fn(*args, **kwargs)
+			outcome = "rejected" if _is_rejection(response) else "ok"
+			if outcome == "rejected" and not recorder.rejected:
+				reject("other")
+			return response
+		except (ValidationError, DoesNotExistError, PermissionError) as e:
+			outcome = "rejected"
+			if not recorder.rejected:
+				reject(rejection_reason(e))
+			raise
+		finally:
+			labels = {"endpoint": recorder.endpoint}
+			recorder.observe("mobile_app_request_duration_seconds", labels, time.perf_counter() - start)
+			recorder.add("mobile_app_requests_total", {**labels, "outcome": outcome}, 1)
+			recorder.add("mobile_app_db_queries_total", labels, queries.count if queries else 0)
+			frappe.local.mobile_app_metrics = None
+			recorder.flush()
+
+	return wrapper
+
+
+@contextmanager
+def span(stage):
+	"""Time a stage of the current instrumented call. Does nothing outside one."""
+	recorder = getattr(frappe.local, "mobile_app_metrics", None)
+	if recorder is None:
+		yield
+		return
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		recorder.observe(
+			"mobile_app_stage_duration_seconds",
+			{"endpoint": recorder.endpoint, "stage": stage},
+			time.perf_counter() - start,
+		)
+
+
+def incr(name, amount=1, **labels):
+	"""
+	Add to a counter of METRICS (e.g. "mobile_app_ingested_bytes_total"), labelled with the
+	current endpoint. Outside an instrumented call the counter is written right away.
+	"""
+	recorder = getattr(frappe.local, "mobile_app_metrics", None)
+	if recorder is not None:
+		recorder.add(name, {"endpoint": recorder.endpoint, **labels}, amount)
+		return
+	if not is_enabled():
+		return
+	recorder = _Recorder(BACKGROUND)
+	recorder.add(name, {"endpoint": BACKGROUND, **labels}, amount)
+	recorder.flush()
+
+
+def reject(reason):
+	"""Count a rejected call or punch of the current endpoint, by reason."""
+	recorder = getattr(frappe.local, "mobile_app_metrics", None)
+	if recorder is not None:
+		recorder.rejected = True
+	incr("mobile_app_rejections_total", reason=reason)
+
+
+def rejection_reason(exc):
+	"""Rejection reason label of an exception."""
+	# Imported here: hrms is not needed to record or render metrics
+	from hrms.hr.doctype.employee_checkin.employee_checkin import CheckinRadiusExceededError
+
+	if isinstance(exc, CheckinRadiusExceededError):
+		return "outside_geofence"
+	if isinstance(exc, DoesNotExistError):
+		return "not_found"
+	if isinstance(exc, PermissionError):
+		return "permission"
+	return "validation"
+
+
+def is_enabled():
+	return (frappe.conf.get("mobile_app_metrics") or {}).get("enabled", True)
+
+
+def render():
+	"""All recorded metrics in Prometheus text format (version 0.0.4)."""
+	try:
+		cache = frappe.cache()
+		# Raw hash read: the wrapper's hgetall expects pickled values
+		pipe = cache.pipeline()
+		pipe.hgetall(cache.make_key(METRICS_KEY))
+		values = pipe.execute()[0] or {}
+	except Exception:
+		values = {}
+
+	series = {}
+	for field, value in values.items():
+		field = field.decode() if isinstance(field, bytes) else field
+		name, _sep, labels = field.partition("|")
+		series.setdefault(name, []).append((labels, float(value)))
+
+	lines = []
+	for name, (metric_type, help_text) in METRICS.items():
+		lines.append(f"# HELP {name} {help_text}")
+		lines.append(f"# TYPE {name} {metric_type}")
+		if metric_type == "histogram":
+			lines.extend(_render_histogram(name, series))
+		else:
+			lines.extend(
+				f"{name}{{{labels}}} {_format_value(value)}" for labels, value in sorted(series.get(name, []))
+			)
+	return "\n".join(lines) + "\n"
+
+
+def _render_histogram(name, series):
+	# Per-bucket counts -> cumulative buckets, per label set
+	buckets = {}
+	for labels, value in series.get(f"{name}_bucket", []):
+		base, _sep, bound = labels.rpartition(',le="')
+		buckets.setdefault(base, {})[bound.rstrip('"')] = value
+
+	lines = []
+	sums = dict(series.get(f"{name}_sum", []))
+	for labels, count in sorted(series.get(f"{name}_count", [])):
+		cumulative = 0
+		for bound in (*(str(bound) for bound in DURATION_BUCKETS), "+Inf"):
+			cumulative += buckets.get(labels, {}).get(bound, 0)
+			lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {_format_value(cumulative)}')
+		lines.append(f"{name}_sum{{{labels}}} {sums.get(labels, 0)}")
+		lines.append(f"{name}_count{{{labels}}} {_format_value(count)}")
+	return lines
+
+
+def _is_rejection(response):
+	"""Whether an endpoint answered with an error: {"exception": ...} or an HTTP error status."""
+	if isinstance(response, dict):
+		return bool(response.get("exception"))
+	return getattr(response, "status_code", 200) >= 400
+
+
+def _format_labels(labels):
+	return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def _format_value(value):
+	return str(int(value)) if float(value).is_integer() else str(value)
@@ -0,0 +1,6 @@
+from frappe_mobile_application.db_indexes import ensure_indexes
+
+
+def execute():
+	# Composite indexes for the app's hot queries (see db_indexes.INDEXES)
+	ensure_indexes()
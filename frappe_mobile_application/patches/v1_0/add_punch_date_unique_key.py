@@ -0,0 +1,51 @@
+"""
+Add Employee Checkin.custom_punch_date and backfill it, so the unique key on (employee,
+punch date, log_type) can be added by db_indexes.ensure_indexes after migrate. One IN and
+one OUT per employee per date is then enforced by the insert itself.
+
+Only punches created through the mobile API get a punch date; other check-ins (e.g.
+from biometric devices) leave it empty and are not constrained. Existing check-ins are
+backfilled with the date of their earliest punch per employee, date and log type, which
+matches what the previous count-based rule enforced.
+"""
+
+import frappe
+from frappe.custom.doctype.custom_field.custom_field import create_custom_field
+
+from frappe_mobile_application.api import PUNCH_DATE_FIELD
+
+
+def execute():
+	if not frappe.get_meta("Employee Checkin").has_field(PUNCH_DATE_FIELD):
+		# Also shipped as a fixture, which is only synced after the patches run
+		create_custom_field(
+			"Employee Checkin",
+			{
+				"fieldname": PUNCH_DATE_FIELD,
+				"fieldtype": "Date",
+				"label": "Mobile Punch Date",
+				"insert_after": "custom_client_bio_metric_photo",
+				"read_only": 1,
+				"no_copy": 1,
+				"hidden": 1,
+			},
+		)
+
+	frappe.db.sql(
+		f"""
+		update `tabEmployee Checkin` checkin
+		join (
+			select name from (
+				select
+					name,
+					row_number() over (
+						partition by employee, date(time), log_type order by time, creation
+					) as punch_number
+				from `tabEmployee Checkin`
+			) ranked
+			where punch_number = 1
+		) first_punch on first_punch.name = checkin.name
+		set checkin.`{PUNCH_DATE_FIELD}` = date(checkin.time)
+		where checkin.`{PUNCH_DATE_FIELD}` is null
+		"""
+	)
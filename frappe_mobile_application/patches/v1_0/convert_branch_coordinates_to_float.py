@@ -0,0 +1,58 @@
+"""
+Convert Branch.custom_latitude / custom_longitude from Data to Float and index them,
+so the database can run range (bounding box) queries on branch locations.
+
+Existing values are cleaned up first: they are parsed, range checked and written back
+in a canonical form, because the column type change fails on non-numeric strings.
+Empty or invalid values become 0, which is treated as "no location configured".
+"""
+
+import frappe
+
+from frappe_mobile_application.employee_settings import clear_all_employee_settings_cache
+from frappe_mobile_application.geofence import COORDINATE_INDEX, COORDINATE_LIMITS, clear_branch_index
+
+
+def execute():
+	if not all(frappe.db.exists("Custom Field", f"Branch-{fieldname}") for fieldname in COORDINATE_LIMITS):
+		# Fresh site: the fixtures create the fields as Float
+		return
+
+	invalid = []
+	converted = False
+	for fieldname, limit in COORDINATE_LIMITS.items():
+		if frappe.db.get_value("Custom Field", f"Branch-{fieldname}", "fieldtype") == "Float":
+			continue
+
+		# Backfill canonical numeric values while the column is still text
+		for row in frappe.db.sql(f"select name, `{fieldname}` as value from `tabBranch`", as_dict=True):
+			value = str(row.value or "").strip()
+			try:
+				number = float(value) if value else 0.0
+			except ValueError:
+				number = None
+			if number is None or not -limit <= number <= limit:
+				invalid.append(f"{row.name} ({fieldname}: {value})")
+				number = 0.0
+			if value != repr(number):
+				frappe.db.set_value("Branch", row.name, fieldname, repr(number), update_modified=False)
+
+		# Custom Field validation does not allow Data -> Float, so update the row directly
+		frappe.db.set_value(
+			"Custom Field",
+			f"Branch-{fieldname}",
+			{"fieldtype": "Float", "precision": "9", "translatable": 0},
+		)
+		converted = True
+
+	if converted:
+		frappe.clear_cache(doctype="Branch")
+		# Alter the columns to match the new field types
+		frappe.db.updatedb("Branch")
+		clear_branch_index()
+		clear_all_employee_settings_cache()
+
+	frappe.db.add_index("Branch", list(COORDINATE_LIMITS), COORDINATE_INDEX)
+
+	if invalid:
+		print("Branch coordinates reset to 0 (invalid value):\n" + "\n".join(invalid))
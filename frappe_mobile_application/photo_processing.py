@@ -0,0 +1,168 @@
+"""
+Recompression and thumbnails for check-in photos.
+
+Once a check-in photo is saved, a background job (queue "long", so the worker pool
+absorbs bursts) recompresses it in place to a maximum resolution and JPEG quality, and
+writes a small thumbnail next to it. The thumbnail is recorded in the File's standard
+``thumbnail_url`` field, so both URLs live on the File row. The File keeps the
+``content_hash`` of the uploaded bytes, so identical uploads still match. The check-ins
+the photo is attached to get a new ``modified``, so delta sync
+(api.sync_employee_checkin_records) sends them again with the thumbnail URL. Identical
+uploads share both the blob and its thumbnail; deleting one of their File rows makes
+frappe delete the thumbnail, which is then written again (on_file_delete).
+
+Configuration (site_config.json), all keys optional:
+
+	"mobile_app_photo_processing": {
+		"enabled": true,
+		"max_dimension": 1600,    # longest side of the stored photo, in pixels
+		"quality": 80,            # JPEG quality of the stored photo
+		"thumbnail_size": 320,    # longest side of the thumbnail, in pixels
+		"thumbnail_quality": 70
+	}
+"""
+
+import os
+
+import frappe
+from frappe.utils import now_datetime
+from PIL import Image, ImageOps
+
+DEFAULT_CONFIG = {
+	"enabled": True,
+	"max_dimension": 1600,
+	"quality": 80,
+	"thumbnail_size": 320,
+	"thumbnail_quality": 70,
+}
+
+
+def get_config():
+	"""Read photo processing settings from site config, with defaults."""
+	return {**DEFAULT_CONFIG, **(frappe.conf.get("mobile_app_photo_processing") or {})}
+
+
+def enqueue_photo_processing(file_name):
+	"""Queue recompression and thumbnail generation for a saved File (after commit)."""
+	if not get_config()["enabled"]:
+		return
+	frappe.enqueue(
+		"frappe_mobile_application.photo_processing.process_photo",
+		queue="long",
+		enqueue_after_commit=True,
+		file_name=file_name,
+	)
+
+
+def process_photo(file_name):
+	"""
+	Background job: recompress a photo in place and create its thumbnail.
+
+	Args:
+		file_name (str): File ID
+	"""
+	file_doc = frappe.db.get_value(
+		"File", file_name, ["name", "file_url", "is_private", "thumbnail_url"], as_dict=True
+	)
+	if not file_doc or not file_doc.file_url:
+		# The punch was rolled back, or the file was removed meanwhile
+		return
+	if file_doc.thumbnail_url:
+		# Blob shared with an earlier upload that is already processed
+		return
+
+	config = get_config()
+	path = get_file_path(file_doc.file_url)
+	if not os.path.exists(path):
+		return
+
+	base, _extension = os.path.splitext(path)
+	thumbnail_path = f"{base}_thumb.jpg"
+	temp_path = f"{base}.recompress.jpg"
+
+	try:
+		with Image.open(path) as source:
+			# Apply the EXIF orientation; the EXIF data itself is not carried over
+			image = ImageOps.exif_transpose(source).convert("RGB")
+
+		photo = image.copy()
+		photo.thumbnail((config["max_dimension"], config["max_dimension"]), Image.LANCZOS)
+		photo.save(temp_path, "JPEG", quality=config["quality"], optimize=True, progressive=True)
+
+		# Only keep the recompressed photo if it is actually smaller
+		if os.path.getsize(temp_path) < os.path.getsize(path):
+			os.replace(temp_path, path)
+
+		image.thumbnail((config["thumbnail_size"], config["thumbnail_size"]), Image.LANCZOS)
+		image.save(thumbnail_path, "JPEG", quality=config["thumbnail_quality"], optimize=True)
+	finally:
+		if os.path.exists(temp_path):
+			os.remove(temp_path)
+
+	# Update every File row sharing this blob (identical uploads, see photo_storage.py)
+	folder_url = file_doc.file_url.rsplit("/", 1)[0]
+	frappe.db.set_value(
+		"File",
+		{"file_url": file_doc.file_url},
+		{
+			"file_size": os.path.getsize(path),
+			"thumbnail_url": f"{folder_url}/{os.path.basename(thumbnail_path)}",
+		},
+		update_modified=False,
+	)
+
+	# Delta sync selects check-ins by modified, so the new thumbnail URL is picked up
+	checkins = frappe.get_all(
+		"File",
+		filters={"file_url": file_doc.file_url, "attached_to_doctype": "Employee Checkin"},
+		pluck="attached_to_name",
+	)
+	if checkins:
+		frappe.db.set_value(
+			"Employee Checkin",
+			{"name": ["in", checkins]},
+			"modified",
+			now_datetime(),
+			update_modified=False,
+		)
+	frappe.db.commit()
+
+
+def on_file_delete(doc, method=None):
+	"""
+	doc_events handler (after_delete) for File: restore the thumbnail of a shared blob.
+
+	When a File row sharing its blob with others is deleted, frappe keeps the blob but
+	deletes the row's thumbnail, which is shared as well (see photo_storage.py).
+	"""
+	if not doc.thumbnail_url or not doc.file_url:
+		return
+	if frappe.db.exists("File", {"file_url": doc.file_url, "thumbnail_url": doc.thumbnail_url}):
+		frappe.enqueue(
+			"frappe_mobile_application.photo_processing.restore_thumbnail",
+			queue="long",
+			enqueue_after_commit=True,
+			file_url=doc.file_url,
+			thumbnail_url=doc.thumbnail_url,
+		)
+
+
+def restore_thumbnail(file_url, thumbnail_url):
+	"""Background job: write the thumbnail of a blob again if it is missing."""
+	path = get_file_path(file_url)
+	thumbnail_path = get_file_path(thumbnail_url)
+	if os.path.exists(thumbnail_path) or not os.path.exists(path):
+		return
+
+	config = get_config()
+	with Image.open(path) as source:
+		image = ImageOps.exif_transpose(source).convert("RGB")
+	image.thumbnail((config["thumbnail_size"], config["thumbnail_size"]), Image.LANCZOS)
+	image.save(thumbnail_path, "JPEG", quality=config["thumbnail_quality"], optimize=True)
+
+
+def get_file_path(file_url):
+	"""Path on disk of a local /files/ or /private/files/ URL."""
+	if file_url.startswith("/private/files/"):
+		return frappe.get_site_path("private", "files", file_url[len("/private/files/") :])
+	return frappe.get_site_path("public", "files", file_url[len("/files/") :])
@@ -0,0 +1,262 @@
+"""
+Streaming, size-capped ingestion of check-in photos.
+
+Photos arrive as multipart files (FileStorage), base64 strings (optionally as a
+``data:`` URL) or raw bytes. Instead of reading them fully into memory, they are
+read in chunks (base64 decoded incrementally) into a staging file on the site's
+disk, hashing as they go, and rejected as soon as MAX_PHOTO_SIZE is exceeded. The
+staged file is then stored by content hash in the files folder (identical uploads
+share one blob) and its File record is written directly, so the bytes are never
+held in memory in full.
+"""
+
+import base64
+import hashlib
+import os
+import tempfile
+import time
+
+import frappe
+from frappe import _
+from frappe.exceptions import ValidationError
+from frappe.utils import now_datetime
+
+# Maximum decoded photo size (5MB as per documentation)
+MAX_PHOTO_SIZE = 5 * 1024 * 1024
+
+# Bytes read per chunk from uploaded files
+CHUNK_SIZE = 64 * 1024
+# Characters decoded per chunk from base64 strings (multiple of 4)
+BASE64_CHUNK_SIZE = 4 * CHUNK_SIZE // 3
+
+STAGING_FOLDER = "mobile_app_staging"
+# Age after which a staging file is considered abandoned (seconds). Photos of punches
+# waiting in the punch queue are staged too, so this is well above any drain backlog.
+STAGING_MAX_AGE = 2 * 24 * 60 * 60
+
+# Photo type -> marker used in generated file names ({photo_type}_photo_{employee}_{timestamp}.jpg)
+PHOTO_FILE_MARKERS = {
+	"location": "location_photo",
+	"biometric": "biometric",
+}
+
+# Photo type -> Employee Checkin custom field holding the photo reference
+PHOTO_CUSTOM_FIELDS = {
+	"location": "custom_location_photo",
+	"biometric": "custom_client_bio_metric_photo",
+}
+
+
+def stage_photo(photo_data):
+	"""
+	Stream a photo into a staging file.
+
+	Args:
+		photo_data (FileStorage, str or bytes): Uploaded file, base64 string or raw bytes
+
+	Returns:
+		frappe._dict: {"path", "size", "content_hash"} of the staged file. Pass it to
+		save_staged_photo, and always call discard_staged_photo afterwards.
+
+	Raises:
+		ValidationError: If the photo is empty, not valid base64 or larger than MAX_PHOTO_SIZE
+	"""
+	staging_dir = frappe.get_site_path("private", STAGING_FOLDER)
+	os.makedirs(staging_dir, exist_ok=True)
+
+	fd, path = tempfile.mkstemp(dir=staging_dir, suffix=".part")
+	staged = frappe._dict(path=path, size=0, content_hash=None)
+	content_hash = hashlib.md5()
+
+	try:
+		with os.fdopen(fd, "wb") as staging_file:
+			for chunk in _iter_photo_chunks(photo_data):
+				staged.size += len(chunk)
+				if staged.size > MAX_PHOTO_SIZE:
+					_throw_too_large()
+				content_hash.update(chunk)
+				staging_file.write(chunk)
+	except Exception:
+		discard_staged_photo(staged)
+		raise
+
+	if not staged.size:
+		discard_staged_photo(staged)
+		frappe.throw(
+			_("Photo file is empty. Please capture the photo again and try uploading."), ValidationError
+		)
+
+	staged.content_hash = content_hash.hexdigest()
+	return staged
+
+
+def save_staged_photo(staged, file_name, attached_to_doctype, attached_to_name, is_private=0):
+	"""
+	Store a staged photo by content and create its File record.
+
+	Photos are stored once per content hash, as ``{content_hash}.jpg`` in the files folder.
+	If the same bytes were uploaded before, the staged copy is dropped and the new File row
+	links to the existing blob and thumbnail. frappe only deletes a blob once no File row
+	with its content hash is left, but deletes the thumbnail along with any of them;
+	photo_processing.on_file_delete writes it again.
+	Otherwise the staged file is moved into place (same disk, no copy). The File row is
+	written directly, so the photo bytes are never read back into memory.
+
+	The move is not undone when the transaction rolls back. A blob without a File row is
+	therefore reused as well, so a retry whose staged file was already moved into place
+	(e.g. deferred_photos.attach_photos) still succeeds.
+
+	Args:
+		file_name (str): Display name of the File, e.g. location_photo_EMP-0001_20250127_091530.jpg
+
+	Returns:
+		File: The created File document; ``flags.deduplicated`` is set if an existing blob was reused
+	"""
+	folder = "private" if is_private else "public"
+	files_dir = frappe.get_site_path(folder, "files")
+	os.makedirs(files_dir, exist_ok=True)
+
+	blob_name = f"{staged.content_hash}{os.path.splitext(file_name)[1] or '.jpg'}"
+	blob_path = os.path.join(files_dir, blob_name)
+	file_url = f"/private/files/{blob_name}" if is_private else f"/files/{blob_name}"
+
+	existing = None
+	blob_exists = os.path.exists(blob_path)
+	if blob_exists:
+		existing = frappe.db.get_value(
+			"File",
+			{"content_hash": staged.content_hash, "file_url": file_url},
+			["file_size", "thumbnail_url"],
+			as_dict=True,
+		)
+
+	if blob_exists:
+		discard_staged_photo(staged)
+	else:
+		os.replace(staged.path, blob_path)
+		staged.path = None
+
+	file_doc = frappe.get_doc(
+		{
+			"doctype": "File",
+			"file_name": file_name,
+			"file_url": file_url,
+			"attached_to_doctype": attached_to_doctype,
+			"attached_to_name": attached_to_name,
+			"is_private": is_private,
+			# Reused blobs may already be recompressed and have a thumbnail
+			"file_size": existing.file_size if existing else staged.size,
+			"thumbnail_url": existing.thumbnail_url if existing else None,
+			"content_hash": staged.content_hash,
+			"file_type": os.path.splitext(file_name)[1].lstrip(".").upper(),
+			"folder": "Home/Attachments",
+			"owner": frappe.session.user,
+		}
+	)
+	file_doc.db_insert()
+	file_doc.flags.deduplicated = bool(existing)
+	return file_doc
+
+
+def cleanup_staging_files():
+	"""
+	Daily job: remove staging files older than STAGING_MAX_AGE, left behind by workers
+	that died between staging a photo and saving or discarding it.
+	"""
+	staging_dir = frappe.get_site_path("private", STAGING_FOLDER)
+	if not os.path.isdir(staging_dir):
+		return
+	cutoff = time.time() - STAGING_MAX_AGE
+	with os.scandir(staging_dir) as entries:
+		for entry in entries:
+			try:
+				if entry.is_file() and entry.stat().st_mtime < cutoff:
+					os.remove(entry.path)
+			except FileNotFoundError:
+				pass
+
+
+def discard_staged_photo(staged):
+	"""Remove a staged photo that was not saved. Safe to call more than once."""
+	if staged and staged.path:
+		try:
+			os.remove(staged.path)
+		except FileNotFoundError:
+			pass
+		staged.path = None
+
+
+def get_photo_file_name(photo_type, employee_id):
+	"""File name for a check-in photo: {photo_type}_photo_{employee}_{timestamp}.jpg"""
+	timestamp = now_datetime().strftime("%Y%m%d_%H%M%S")
+	return f"{photo_type}_photo_{employee_id}_{timestamp}.jpg"
+
+
+def _iter_photo_chunks(photo_data):
+	"""Yield the decoded photo bytes in chunks."""
+	if isinstance(photo_data, str):
+		yield from _iter_base64_chunks(photo_data)
+	elif isinstance(photo_data, (bytes, bytearray, memoryview)):
+		view = memoryview(photo_data)
+		for start in range(0, len(view), CHUNK_SIZE):
+			yield view[start : start + CHUNK_SIZE]
+	else:
+		yield from _iter_stream_chunks(photo_data)
+
+
+def _iter_stream_chunks(file_storage):
+	"""Yield chunks from a FileStorage (or any file-like object), from the start."""
+	stream = getattr(file_storage, "stream", None) or file_storage
+	if hasattr(stream, "seek"):
+		stream.seek(0)
+	while True:
+		chunk = stream.read(CHUNK_SIZE)
+		if not chunk:
+			break
+		yield chunk
+
+
+def _iter_base64_chunks(data):
+	"""Decode a base64 string (or data: URL) incrementally."""
+	start = 0
+	if data.startswith("data:"):
+		# Remove data:image/jpeg;base64, prefix
+		start = data.find(",") + 1
+		if not start:
+			_throw_invalid_base64()
+
+	# 4 base64 characters decode to 3 bytes: reject clearly oversized photos before decoding
+	# anything (with slack for line breaks; the exact limit is enforced while streaming)
+	if (len(data) - start) // 4 * 3 > MAX_PHOTO_SIZE * 102 // 100:
+		_throw_too_large()
+
+	remainder = ""
+	for offset in range(start, len(data), BASE64_CHUNK_SIZE):
+		# Whitespace (e.g. line-wrapped base64) would break the 4-character alignment
+		chunk = remainder + "".join(data[offset : offset + BASE64_CHUNK_SIZE].split())
+		usable = len(chunk) - len(chunk) % 4
+		remainder = chunk[usable:]
+		if usable:
+			yield _decode_base64(chunk[:usable])
+	if remainder:
+		yield _decode_base64(remainder + "=" * (-len(remainder) % 4))
+
+
+def _decode_base64(chunk):
+	try:
+		return base64.b64decode(chunk)
+	except Exception:
+		_throw_invalid_base64()
+
+
+def _throw_invalid_base64():
+	frappe.throw(
+		_("Invalid image format. Please ensure the photo is properly encoded and try again."), ValidationError
+	)
+
+
+def _throw_too_large():
+	frappe.throw(
+		_("Photo file size exceeds the maximum limit of 5MB. Please compress the image and try again."),
+		ValidationError,
+	)
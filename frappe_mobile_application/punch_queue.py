@@ -0,0 +1,445 @@
+"""
+Write-behind ingestion of punches, to absorb shift-start surges.
+
+In queued mode (create_checkin_checkout with ``queued`` set, on sites that enable it)
+the request only runs the cheap validations: employee, geofence, required photos and
+the daily rule. It then stages the photos, appends the punch to a Redis stream and
+answers with a receipt. A background job drains the stream into Employee Checkin in
+batches (fetch_shift, insert, one commit per batch) and records the outcome of every
+receipt for polling (api.get_punch_receipt_status). Photos are saved as deferred photos
+(see deferred_photos.py).
+
+Durability: the streams live on the queue Redis (where background jobs are kept), not on
+the cache Redis, which may evict keys. An entry is acknowledged and deleted only after
+its batch is committed; entries of a drain job that died are read again by the next one.
+
+Ordering: punches are spread over PARTITIONS streams by employee, and each stream is
+drained by one job at a time (deduplicated job ID), in stream order. So the punches of
+an employee are inserted in the order they were accepted.
+
+Backpressure: once a stream holds max_pending punches, requests get a 503 with
+Retry-After instead of growing the backlog.
+
+Daily rule: accepted punches are not in the database until drained, so each accepted
+punch is also marked in the cache per employee, date and log type. The mark is cleared
+once the punch is drained (inserted or rejected). The unique key on the punch date stays
+the final check when the punch is inserted.
+
+Configuration (site_config.json), all keys optional:
+
+	"mobile_app_punch_queue": {
+		"enabled": true,        # accept queued punches; otherwise they are inserted in the request
+		"max_pending": 5000,    # punches waiting per stream before requests get a 503
+		"batch_size": 100,      # punches inserted per commit
+		"retry_after": 30       # Retry-After of the 503 (seconds)
+	}
+"""
+
+import json
+import time
+import zlib
+
+import frappe
+from frappe import _
+from frappe.exceptions import DoesNotExistError, ValidationError
+from frappe.utils import get_datetime
+
+from frappe_mobile_application import metrics, photo_storage
+from frappe_mobile_application.responses import json_response
+
+STREAM_KEY = "mobile_app_punch_stream"
+GROUP = "mobile_app_punch_drain"
+# One drain job per stream at a time, so a single consumer name is enough
+CONSUMER = "drain"
+STATUS_KEY = "mobile_app_punch_receipt"
+STATUS_TTL = 24 * 60 * 60  # seconds
+MARK_KEY = "mobile_app_punch_mark"
+# Marks outlive any drain backlog; they are cleared when the punch is drained
+MARK_TTL = 24 * 60 * 60  # seconds
+
+PARTITIONS = 4
+
+DEFAULT_CONFIG = {
+	"enabled": False,
+	"max_pending": 5000,
+	"batch_size": 100,
+	"retry_after": 30,
+}
+
+# Seconds a drain job keeps reading before leaving the rest to the next job (the short
+# queue times jobs out after 300 seconds)
+MAX_DRAIN_SECONDS = 240
+
+ACCEPTED = "accepted"
+QUEUED = "queued"
+DONE = "done"
+FAILED = "failed"
+
+
+def get_config():
+	"""Read punch queue settings from site config, merged into DEFAULT_CONFIG."""
+	config = dict(DEFAULT_CONFIG)
+	config.update(frappe.conf.get("mobile_app_punch_queue") or {})
+	return config
+
+
+def is_enabled():
+	return bool(get_config()["enabled"])
+
+
+def is_full(employee):
+	"""Whether the employee's stream holds max_pending punches. False if Redis is unavailable."""
+	try:
+		return _get_conn().xlen(_stream_key(_partition(employee))) >= get_config()["max_pending"]
+	except Exception:
+		return False
+
+
+def busy_response():
+	"""503 with Retry-After for a punch refused because the queue is full."""
+	retry_after = get_config()["retry_after"]
+	metrics.reject("queue_full")
+	return json_response(
+		{
+			"exception": _(
+				"Too many check-ins are being processed right now. Please try again in {0} seconds."
+			).format(retry_after)
+		},
+		status=503,
+		headers={"Retry-After": str(retry_after)},
+	)
+
+
+def get_marks(employee, punch_date):
+	"""
+	Log types of the employee's accepted punches on punch_date that are not drained yet.
+	Returns: set of "IN" / "OUT"
+	"""
+	try:
+		cache = frappe.cache()
+		values = cache.mget([_mark_key(employee, punch_date, log_type) for log_type in ("IN", "OUT")])
+	except Exception:
+		return set()
+	return {log_type for log_type, value in zip(("IN", "OUT"), values, strict=True) if value}
+
+
+def mark(employee, punch_date, log_type):
+	"""
+	Mark a punch as accepted for the daily rule.
+	Returns: False if the same punch was already accepted (e.g. by a concurrent request)
+	"""
+	try:
+		return bool(frappe.cache().set(_mark_key(employee, punch_date, log_type), 1, nx=True, ex=MARK_TTL))
+	except Exception:
+		# The unique key still rejects a duplicate when the punch is inserted
+		return True
+
+
+def unmark(employee, punch_date, log_type):
+	try:
+		frappe.cache().delete(_mark_key(employee, punch_date, log_type))
+	except Exception:
+		pass
+
+
+def enqueue(
+	employee,
+	log_type,
+	checkin_time,
+	latitude,
+	longitude,
+	device_id,
+	notes,
+	geofence_match,
+	staged_photos,
+	location_photo_id,
+	client_biometric_photo_id,
+):
+	"""
+	Append a validated punch to its stream and start a drain job.
+
+	Args: as api._insert_checkin. Staged photos are owned by the queue from here on (their
+		path is cleared so the caller does not discard them).
+
+	Returns:
+		dict: The accepted receipt, or None if the queue Redis is unavailable (the caller
+		inserts the punch itself)
+	"""
+	receipt_id = frappe.generate_hash(length=20)
+	photos = []
+	for photo_type, staged in staged_photos.items():
+		if not staged:
+			continue
+		if isinstance(staged, str):
+			# An existing File given in place of the upload
+			if photo_type == "location":
+				location_photo_id = location_photo_id or staged
+			else:
+				client_biometric_photo_id = client_biometric_photo_id or staged
+			continue
+		photos.append(
+			{
+				"photo_type": photo_type,
+				"path": staged.path,
+				"size": staged.size,
+				"content_hash": staged.content_hash,
+			}
+		)
+
+	punch = {
+		"receipt_id": receipt_id,
+		"user": frappe.session.user,
+		"employee": employee.name,
+		"log_type": log_type,
+		"time": checkin_time.isoformat(),
+		"latitude": latitude,
+		"longitude": longitude,
+		"device_id": device_id,
+		"notes": notes,
+		"geofence": {"branch": geofence_match.branch, "distance": geofence_match.distance}
+		if geofence_match is not None
+		else None,
+		"photos": photos,
+		"location_photo_id": location_photo_id,
+		"client_biometric_photo_id": client_biometric_photo_id,
+	}
+
+	response = {
+		"receipt_id": receipt_id,
+		"employee_id": getattr(employee, "employee_code", None)
+		or getattr(employee, "employee_number", None)
+		or employee.name,
+		"employee_name": getattr(employee, "employee_name", None) or employee.name,
+		"log_type": log_type,
+		"time": punch["time"],
+		"status": ACCEPTED,
+	}
+	if geofence_match is not None:
+		response["distance_from_branch_meters"] = round(geofence_match.distance, 2)
+		response["matched_branch"] = geofence_match.branch
+
+	partition = _partition(employee.name)
+	try:
+		# Stored before the punch is added, so a fast drain cannot be overwritten by it
+		set_status(receipt_id, QUEUED, punch)
+		_get_conn().xadd(_stream_key(partition), {"punch": json.dumps(punch, default=str)})
+	except Exception:
+		frappe.cache().delete_value(f"{STATUS_KEY}:{receipt_id}")
+		return None
+
+	for staged in staged_photos.values():
+		if staged and not isinstance(staged, str):
+			staged.path = None
+
+	enqueue_drain(partition)
+	return response
+
+
+def enqueue_drain(partition):
+	"""Start a drain job for a stream, unless one is already queued or running."""
+	frappe.enqueue(
+		"frappe_mobile_application.punch_queue.drain",
+		queue="short",
+		job_id=f"mobile_app_punch_drain:{partition}",
+		deduplicate=True,
+		partition=partition,
+	)
+
+
+def drain_all():
+	"""
+	Scheduler job: start a drain job for every stream with punches left. Picks up punches
+	added while a drain job was finishing, and entries of drain jobs that died.
+	"""
+	if not is_enabled():
+		return
+	conn = _get_conn()
+	for partition in range(PARTITIONS):
+		if conn.xlen(_stream_key(partition)):
+			enqueue_drain(partition)
+
+
+def drain(partition):
+	"""
+	Background job: insert the punches of a stream into Employee Checkin, in stream order,
+	batch_size punches per commit.
+	"""
+	conn = _get_conn()
+	key = _stream_key(partition)
+	_ensure_group(conn, key)
+
+	batch_size = get_config()["batch_size"]
+	user = frappe.session.user
+	start = time.monotonic()
+	# Entries read by an earlier drain but never acknowledged come first
+	pending = True
+	try:
+		while time.monotonic() - start < MAX_DRAIN_SECONDS:
+			streams = conn.xreadgroup(GROUP, CONSUMER, {key: "0" if pending else ">"}, count=batch_size)
+			entries = streams[0][1] if streams else []
+			if not entries:
+				if not pending:
+					break
+				pending = False
+				continue
+			_drain_batch(conn, key, entries, recovered=pending)
+	finally:
+		frappe.set_user(user)
+
+
+def get_status(receipt_id):
+	"""Return the stored status of a receipt, or None if unknown (or expired)."""
+	return frappe.cache().get_value(f"{STATUS_KEY}:{receipt_id}")
+
+
+def set_status(receipt_id, status, punch, checkin=None, error=None):
+	"""Store the status of a receipt for polling."""
+	frappe.cache().set_value(
+		f"{STATUS_KEY}:{receipt_id}",
+		{
+			"status": status,
+			"user": punch["user"],
+			"employee": punch["employee"],
+			"log_type": punch["log_type"],
+			"time": punch["time"],
+			"checkin": checkin,
+			"error": error,
+		},
+		expires_in_sec=STATUS_TTL,
+	)
+
+
+def _drain_batch(conn, key, entries, recovered=False):
+	"""Insert a batch of entries, commit, then acknowledge them and record their outcomes."""
+	outcomes = []
+	for index, (entry_id, fields) in enumerate(entries):
+		try:
+			punch = json.loads(fields.get(b"punch") or fields.get("punch"))
+		except (TypeError, ValueError):
+			# Unreadable entry: drop it
+			outcomes.append((entry_id, None, FAILED, None, None))
+			continue
+
+		savepoint = f"mobile_queue_{index}"
+		frappe.db.savepoint(savepoint)
+		try:
+			checkin = _insert_punch(punch, recovered)
+			outcomes.append((entry_id, punch, DONE, checkin, None))
+		except (ValidationError, DoesNotExistError) as e:
+			frappe.db.rollback(save_point=savepoint)
+			metrics.reject(metrics.rejection_reason(e))
+			outcomes.append((entry_id, punch, FAILED, None, str(e)))
+		except Exception as e:
+			frappe.db.rollback(save_point=savepoint)
+			frappe.log_error(title="Queued Checkin Unexpected Error", message=str(e))
+			metrics.incr("mobile_app_error_logs_total")
+			outcomes.append(
+				(
+					entry_id,
+					punch,
+					FAILED,
+					None,
+					_(
+						"Something went wrong while creating your check-in. Please try again or contact support."
+					),
+				)
+			)
+
+	frappe.db.commit()
+
+	entry_ids = [entry_id for entry_id, *_rest in outcomes]
+	pipe = conn.pipeline()
+	pipe.xack(key, GROUP, *entry_ids)
+	pipe.xdel(key, *entry_ids)
+	pipe.execute()
+
+	counts = {}
+	for _entry_id, punch, status, checkin, error in outcomes:
+		counts[status] = counts.get(status, 0) + 1
+		if punch is None:
+			continue
+		if status == FAILED:
+			_discard(punch["photos"])
+		set_status(punch["receipt_id"], status, punch, checkin=checkin, error=error)
+		unmark(punch["employee"], get_datetime(punch["time"]).date(), punch["log_type"])
+	for status, count in counts.items():
+		metrics.incr("mobile_app_queued_punches_total", count, outcome=status)
+
+
+def _insert_punch(punch, recovered=False):
+	"""
+	Insert one queued punch as its user.
+	Returns: the create_checkin_checkout success response
+	"""
+	# Imported here: api imports hrms, which the scheduler job does not need
+	from frappe_mobile_application import api
+
+	checkin_time = get_datetime(punch["time"])
+	if recovered:
+		# The batch of a drain job that died may have been committed before it was acknowledged
+		existing = frappe.db.get_value(
+			"Employee Checkin",
+			{"employee": punch["employee"], "log_type": punch["log_type"], "time": checkin_time},
+			"name",
+		)
+		if existing:
+			# Its photos went to the deferred photo job enqueued by that commit
+			return {"checkin_id": existing, "log_type": punch["log_type"], "status": "success"}
+
+	if frappe.session.user != punch["user"]:
+		frappe.set_user(punch["user"])
+
+	employee = api._get_checkin_employee(punch["employee"])
+	staged_photos = {
+		photo["photo_type"]: frappe._dict(photo) for photo in punch["photos"] if photo.get("path")
+	}
+	geofence_match = frappe._dict(punch["geofence"]) if punch.get("geofence") else None
+	return api._insert_checkin(
+		employee,
+		punch["log_type"],
+		checkin_time,
+		punch["latitude"],
+		punch["longitude"],
+		punch["device_id"],
+		punch["notes"],
+		geofence_match,
+		staged_photos,
+		punch["location_photo_id"],
+		punch["client_biometric_photo_id"],
+		None,
+		False,
+		defer_photos=True,
+	)
+
+
+def _ensure_group(conn, key):
+	from redis.exceptions import ResponseError
+
+	try:
+		conn.xgroup_create(key, GROUP, id="0", mkstream=True)
+	except ResponseError as e:
+		if "BUSYGROUP" not in str(e):
+			raise
+
+
+def _discard(photos):
+	for photo in photos:
+		photo_storage.discard_staged_photo(frappe._dict(photo))
+
+
+def _get_conn():
+	from frappe.utils.background_jobs import get_redis_conn
+
+	return get_redis_conn()
+
+
+def _partition(employee):
+	return zlib.crc32(employee.encode()) % PARTITIONS
+
+
+def _stream_key(partition):
+	return frappe.cache().make_key(f"{STREAM_KEY}:{partition}")
+
+
+def _mark_key(employee, punch_date, log_type):
+	return frappe.cache().make_key(f"{MARK_KEY}:{employee}:{punch_date}:{log_type}")
@@ -0,0 +1,171 @@
+"""
+Sliding-window rate limits for the mobile endpoints.
+
+Each endpoint has limits per scope: the user, the device (``device_id``) and the client
+IP. Every accepted request is recorded in a Redis sorted set per endpoint, scope and
+identity, scored by time; requests older than the window are trimmed on each check.
+All scopes are checked in one Redis round trip, before the endpoint touches the
+database, and a request over any limit gets a 429 with a Retry-After header.
+
+Configuration (site_config.json), all keys optional. Endpoint entries are merged into
+DEFAULT_LIMITS per scope; set a scope to null to disable it:
+
+	"mobile_app_rate_limits": {
+		"enabled": true,
+		"endpoints": {
+			"create_checkin_checkout": {
+				"user": {"limit": 20, "window": 60},   # requests per window (seconds)
+				"device": null
+			}
+		}
+	}
+
+If Redis is unavailable, requests are let through.
+"""
+
+import math
+import random
+import time
+
+import frappe
+from frappe import _
+
+from frappe_mobile_application import metrics
+from frappe_mobile_application.responses import get_request, json_response
+
+LIMIT_KEY = "mobile_app_rate_limit"
+
+# endpoint -> scope -> {"limit": requests, "window": seconds}
+DEFAULT_LIMITS = {
+	"mobile_login": {
+		"user": {"limit": 10, "window": 60},
+		"ip": {"limit": 30, "window": 60},
+	},
+	"create_checkin_checkout": {
+		"user": {"limit": 20, "window": 60},
+		"device": {"limit": 20, "window": 60},
+		# Phones on one office network share an IP
+		"ip": {"limit": 300, "window": 60},
+	},
+	"sync_offline_punches": {
+		"user": {"limit": 10, "window": 60},
+		"ip": {"limit": 100, "window": 60},
+	},
+	"get_employee_configuration": {
+		"user": {"limit": 60, "window": 60},
+	},
+	"get_employee_checkin_records": {
+		"user": {"limit": 60, "window": 60},
+	},
+	"get_checkin_photo_status": {
+		"user": {"limit": 120, "window": 60},
+	},
+	"get_punch_receipt_status": {
+		"user": {"limit": 120, "window": 60},
+	},
+	"sync_employee_checkin_records": {
+		"user": {"limit": 60, "window": 60},
+	},
+	"get_team_attendance": {
+		"user": {"limit": 30, "window": 60},
+	},
+}
+
+
+def check(endpoint, user=None, device_id=None):
+	"""
+	Count a request against the endpoint's limits.
+
+	Only HTTP requests are limited. Call this first in the endpoint and return its result
+	if it is not None.
+
+	Args:
+		endpoint (str): Endpoint name, as in DEFAULT_LIMITS
+		user (str, optional): User to limit. Defaults to the session user (Guest is not
+			limited per user); mobile_login passes the login name.
+		device_id (str, optional): Device to limit
+
+	Returns:
+		Response: A 429 response with Retry-After if a limit is exceeded, else None
+	"""
+	request = get_request()
+	if request is None:
+		return None
+
+	config = get_config()
+	if not config["enabled"]:
+		return None
+
+	if user is None and frappe.session.user != "Guest":
+		user = frappe.session.user
+	identities = {"user": user, "device": device_id, "ip": getattr(frappe.local, "request_ip", None)}
+
+	checks = []
+	for scope, limit in (config["endpoints"].get(endpoint) or {}).items():
+		if limit and identities.get(scope):
+			checks.append((f"{LIMIT_KEY}:{endpoint}:{scope}:{identities[scope]}", limit))
+	if not checks:
+		return None
+
+	try:
+		retry_after = _record(checks)
+	except Exception:
+		# Rate limiting must never take the endpoints down
+		return None
+
+	if retry_after is None:
+		return None
+
+	metrics.reject("rate_limited")
+	return json_response(
+		{"exception": _("Too many requests. Please wait {0} seconds and try again.").format(retry_after)},
+		status=429,
+		headers={"Retry-After": str(retry_after)},
+	)
+
+
+def get_config():
+	"""Read rate limit settings from site config, merged into DEFAULT_LIMITS."""
+	config = frappe.conf.get("mobile_app_rate_limits") or {}
+	endpoints = {endpoint: dict(limits) for endpoint, limits in DEFAULT_LIMITS.items()}
+	for endpoint, limits in (config.get("endpoints") or {}).items():
+		endpoints.setdefault(endpoint, {}).update(limits or {})
+	return {"enabled": config.get("enabled", True), "endpoints": endpoints}
+
+
+def _record(checks):
+	"""
+	Add the request to every window and count them, in one pipeline.
+	Returns: seconds until the request would be allowed, or None if it is allowed
+	"""
+	cache = frappe.cache()
+	now = time.time()
+	member = f"{now:.6f}:{random.random()}"
+	keys = [cache.make_key(key) for key, _limit in checks]
+
+	pipe = cache.pipeline()
+	for key, (_name, limit) in zip(keys, checks, strict=True):
+		window = int(limit["window"])
+		pipe.zremrangebyscore(key, 0, now - window)
+		pipe.zadd(key, {member: now})
+		pipe.zcard(key)
+		pipe.zrange(key, 0, 0, withscores=True)
+		pipe.expire(key, window)
+	results = pipe.execute()
+
+	retry_after = None
+	for position, (_name, limit) in enumerate(checks):
+		count, oldest = results[position * 5 + 2], results[position * 5 + 3]
+		if count > int(limit["limit"]):
+			oldest_time = oldest[0][1] if oldest else now
+			wait = max(1, math.ceil(oldest_time + int(limit["window"]) - now))
+			retry_after = max(retry_after or 0, wait)
+
+	if retry_after is not None:
+		# Rejected requests do not use up the window
+		pipe = cache.pipeline()
+		for key in keys:
+			pipe.zrem(key, member)
+		pipe.execute()
+
+	return retry_after
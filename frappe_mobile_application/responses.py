@@ -0,0 +1,113 @@
+"""
+Helpers for endpoints that need control over the raw HTTP response
+(status codes, caching headers) beyond frappe's default JSON envelope.
+
+Whitelisted methods may return a werkzeug Response, which frappe passes through as-is.
+Bodies keep frappe's ``{"message": ...}`` envelope so clients parse them the same way.
+
+encoded_response negotiates the body format for compact payloads: msgpack if the
+client accepts it (and the msgpack package is installed), else JSON, gzipped when the
+client accepts gzip.
+"""
+
+import gzip
+
+import frappe
+import orjson
+from werkzeug.wrappers import Response
+
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
+
+MSGPACK_CONTENT_TYPES = ("application/msgpack", "application/x-msgpack")
+
+# Bodies smaller than this are not worth compressing
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 5
+
+
+def get_request():
+	"""Return the current HTTP request, or None when not serving one (jobs, console, tests)."""
+	return getattr(frappe.local, "request", None)
+
+
+def get_request_header(name):
+	"""Return a header of the current request, or None."""
+	request = get_request()
+	if request is None:
+		return None
+	return request.headers.get(name)
+
+
+def json_response(data, status=200, headers=None):
+	"""Build a JSON Response in frappe's ``{"message": data}`` envelope."""
+	return Response(
+		frappe.as_json({"message": data}, indent=None),
+		status=status,
+		headers=headers,
+		mimetype="application/json",
+	)
+
+
+def text_response(body, content_type="text/plain; charset=utf-8", status=200):
+	"""Build a plain text Response, outside frappe's envelope (e.g. for metric scrapers)."""
+	return Response(body, status=status, content_type=content_type)
+
+
+def etag_matches(etag, if_none_match):
+	"""
+	Check an If-None-Match header value against an entity tag.
+
+	Args:
+		etag (str): Current entity tag, without quotes
+		if_none_match (str): Raw header value (may list several, possibly weak, tags)
+
+	Returns:
+		bool: True if the client already holds this version
+	"""
+	if not etag or not if_none_match:
+		return False
+	for candidate in if_none_match.split(","):
+		candidate = candidate.strip()
+		if candidate == "*":
+			return True
+		if candidate.startswith("W/"):
+			candidate = candidate[2:]
+		if candidate.strip('"') == etag:
+			return True
+	return False
+
+
+def not_modified_response(etag):
+	"""Build an empty 304 Not Modified response for an entity tag."""
+	return Response(status=304, headers={"ETag": f'"{etag}"'})
+
+
+def encoded_response(data, status=200, headers=None):
+	"""
+	Build a Response in frappe's ``{"message": data}`` envelope, encoded as the client
+	accepts: msgpack (``Accept: application/msgpack``) or JSON, gzipped if the client
+	sends ``Accept-Encoding: gzip``. JSON is serialized with orjson.
+
+	Args:
+		data: Payload; datetimes should already be converted (e.g. to epoch seconds)
+	"""
+	headers = dict(headers or {})
+	headers["Vary"] = "Accept, Accept-Encoding"
+	envelope = {"message": data}
+
+	accept = (get_request_header("Accept") or "").lower()
+	if msgpack is not None and any(content_type in accept for content_type in MSGPACK_CONTENT_TYPES):
+		body = msgpack.packb(envelope, default=str)
+		mimetype = "application/msgpack"
+	else:
+		body = orjson.dumps(envelope, default=str, option=orjson.OPT_NON_STR_KEYS)
+		mimetype = "application/json"
+
+	if len(body) >= GZIP_MIN_SIZE and "gzip" in (get_request_header("Accept-Encoding") or "").lower():
+		body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+		headers["Content-Encoding"] = "gzip"
+
+	return Response(body, status=status, headers=headers, mimetype=mimetype)
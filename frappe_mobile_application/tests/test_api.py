@@ -0,0 +1,71 @@
+import io
+from datetime import datetime, time
+
+import frappe
+from erpnext.setup.doctype.employee.test_employee import make_employee
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, getdate
+from PIL import Image
+
+from frappe_mobile_application.api import get_employee_checkin_records
+from frappe_mobile_application.metrics import QueryCounter
+from frappe_mobile_application.photo_storage import PHOTO_FILE_MARKERS
+
+HISTORY_DAYS = 12
+
+
+class TestCheckinHistory(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.employee = make_employee("mobile-app-history@example.com")
+		photo = _make_photo()
+		today = getdate()
+		# One IN and one OUT per day, each with a location photo
+		for day in range(1, HISTORY_DAYS + 1):
+			for log_type, hour in (("IN", 8), ("OUT", 17)):
+				checkin = frappe.get_doc(
+					{
+						"doctype": "Employee Checkin",
+						"employee": cls.employee,
+						"log_type": log_type,
+						"time": datetime.combine(add_days(today, -day), time(hour)),
+					}
+				).insert()
+				frappe.get_doc(
+					{
+						"doctype": "File",
+						"file_name": f"{PHOTO_FILE_MARKERS['location']}_{cls.employee}_{checkin.name}.jpg",
+						"content": photo,
+						"attached_to_doctype": "Employee Checkin",
+						"attached_to_name": checkin.name,
+						"is_private": 0,
+					}
+				).insert()
+
+	def test_page_size_does_not_change_query_count(self):
+		small_queries, small_page = _count_queries(
+			lambda: get_employee_checkin_records(employee_id=self.employee, limit=10)
+		)
+		large_queries, large_page = _count_queries(
+			lambda: get_employee_checkin_records(employee_id=self.employee, limit=100)
+		)
+
+		self.assertEqual(len(small_page["records"]), 10)
+		self.assertEqual(len(large_page["records"]), 2 * HISTORY_DAYS)
+		self.assertTrue(all(record["location_photo_url"] for record in large_page["records"]))
+		self.assertEqual(small_queries, large_queries)
+
+
+def _count_queries(call):
+	# The first call warms the caches and is not counted
+	call()
+	with QueryCounter() as counter:
+		response = call()
+	return counter.count, response
+
+
+def _make_photo():
+	buffer = io.BytesIO()
+	Image.new("RGB", (64, 48), (90, 140, 200)).save(buffer, "JPEG")
+	return buffer.getvalue()
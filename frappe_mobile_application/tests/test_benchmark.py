@@ -0,0 +1,26 @@
+from frappe.tests.utils import FrappeTestCase
+
+from frappe_mobile_application import benchmark
+
+
+class TestQueryBudgets(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		# Smallest scale; seed() commits, so the data is removed again in tearDownClass
+		benchmark.seed("1k")
+
+	@classmethod
+	def tearDownClass(cls):
+		benchmark.cleanup()
+		super().tearDownClass()
+
+	def test_endpoints_stay_within_query_budgets(self):
+		report = benchmark.run(iterations=2)
+
+		failed = [
+			f"{result.label}: queries={result.queries} budget={result.budget} error={result.error}"
+			for result in report
+			if result.failed
+		]
+		self.assertEqual(failed, [])